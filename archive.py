@@ -0,0 +1,112 @@
+import gzip
+import os
+from typing import Dict, Any, Iterable, List
+
+import codec
+from storage import atomic_write_json
+
+
+class SessionArchive:
+    """Archivo frío del historial de usuarios: un JSON comprimido por mes.
+
+    Cada archivo `<directorio>/<AAAA-MM>.json.gz` contiene, por usuario, los
+    tiempos diarios (`daily_times`) y las sesiones cerradas de ese mes que ya
+    se sacaron del documento principal. Escribir un mes dos veces con los
+    mismos datos no duplica nada, así que un archivado interrumpido puede
+    repetirse sin riesgo. Los registros completos de usuarios inactivos van a
+    `inactive_users.json.gz`.
+    """
+
+    def __init__(self, directory: str = "archive"):
+        self.directory = directory
+
+    def month_path(self, month: str) -> str:
+        """Ruta del archivo de un mes (AAAA-MM)"""
+        return os.path.join(self.directory, f"{month}.json.gz")
+
+    @property
+    def inactive_users_path(self) -> str:
+        """Ruta del archivo de usuarios inactivos"""
+        return os.path.join(self.directory, "inactive_users.json.gz")
+
+    def load_month(self, month: str) -> Dict[str, Any]:
+        """Cargar el archivo de un mes ({} si no existe)"""
+        return self._load_file(self.month_path(month))
+
+    def _load_file(self, path: str) -> Dict[str, Any]:
+        """Cargar un archivo JSON comprimido ({} si no existe).
+
+        Cualquier otro error se propaga: archivar sobre un archivo que no se
+        pudo leer lo reescribiría sin el historial que ya contenía.
+        """
+        try:
+            with gzip.open(path, 'rb') as f:
+                return codec.loads(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def _read_file(self, path: str) -> Dict[str, Any]:
+        """Cargar un archivo solo para consultarlo ({} si no existe o no se puede leer)"""
+        try:
+            return self._load_file(path)
+        except Exception as e:
+            print(f"Error cargando archivo histórico {path}: {e}")
+            return {}
+
+    def archive(self, months: Dict[str, Dict[str, Dict[str, Any]]]) -> None:
+        """Agregar historial a los archivos mensuales.
+
+        `months` es {mes: {user_id: {'daily_times': {...}, 'sessions': [...]}}}.
+        Los tiempos diarios se sobrescriben por fecha y las sesiones se
+        deduplican por inicio y fin.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for month, users in months.items():
+            document = self.load_month(month)
+            for user_id_str, history in users.items():
+                record = document.setdefault(user_id_str, {'daily_times': {}, 'sessions': []})
+                record.setdefault('daily_times', {}).update(history.get('daily_times', {}))
+
+                sessions = record.setdefault('sessions', [])
+                seen = {(s.get('start'), s.get('end')) for s in sessions}
+                for session in history.get('sessions', []):
+                    key = (session.get('start'), session.get('end'))
+                    if key not in seen:
+                        seen.add(key)
+                        sessions.append(session)
+
+            atomic_write_json(self.month_path(month), document, compress=True)
+
+    def archive_users(self, records: Dict[str, Dict[str, Any]]) -> None:
+        """Guardar registros completos de usuarios retirados del documento principal.
+
+        Van a `<directorio>/inactive_users.json.gz`; un usuario archivado de
+        nuevo reemplaza su registro anterior.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        document = self._load_file(self.inactive_users_path)
+        document.update(records)
+        atomic_write_json(self.inactive_users_path, document, compress=True)
+
+    def get_inactive_user(self, user_id: int) -> Dict[str, Any]:
+        """Registro archivado de un usuario inactivo ({} si no existe)"""
+        return self._read_file(self.inactive_users_path).get(str(user_id), {})
+
+    def get_daily_times(self, user_id: int, dates: Iterable[str]) -> Dict[str, float]:
+        """Tiempos diarios archivados de un usuario para las fechas indicadas"""
+        user_id_str = str(user_id)
+        by_month = {}
+        for date in dates:
+            by_month.setdefault(date[:7], []).append(date)
+
+        result = {}
+        for month, month_dates in by_month.items():
+            daily_times = self._read_file(self.month_path(month)).get(user_id_str, {}).get('daily_times', {})
+            for date in month_dates:
+                if date in daily_times:
+                    result[date] = daily_times[date]
+        return result
+
+    def get_sessions(self, user_id: int, month: str) -> List[Dict[str, Any]]:
+        """Sesiones archivadas de un usuario en un mes (AAAA-MM)"""
+        return self._read_file(self.month_path(month)).get(str(user_id), {}).get('sessions', [])
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga y guardado de user_times.json con distintos codificadores
+Uso: python benchmarks/bench_codec.py [usuarios ...]   (por defecto 1000 10000 100000)
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import codec
+from storage import atomic_write_json
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def build_users(count):
+    """Documento de usuarios sintético con historial de dos semanas"""
+    now = datetime.now()
+    dates = [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(14)]
+    users = {}
+    for i in range(count):
+        start = now - timedelta(hours=random.randint(1, 300))
+        users[str(900000000000000000 + i)] = {
+            'name': f"Usuario {i}",
+            'total_time': random.uniform(0, 36000),
+            'sessions': [
+                {'start': start.isoformat(), 'end': (start + timedelta(hours=1)).isoformat(),
+                 'duration': 3600.0, 'date': start.strftime("%Y-%m-%d")}
+                for _ in range(3)
+            ],
+            'is_active': i % 10 == 0,
+            'is_paused': False,
+            'pause_count': random.randint(0, 3),
+            'notified_milestones': [],
+            'milestone_completed': False,
+            'is_pre_registered': False,
+            'daily_times': {date: random.uniform(0, 7200) for date in dates},
+            'last_start': start.isoformat()
+        }
+    return users
+
+
+def timed(function):
+    """Ejecutar una función y devolver (segundos, resultado)"""
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def peak_memory(function):
+    """Pico de memoria de Python (MB) durante la función"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def load_stdlib(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_stream(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return dict(codec.iter_object_items(f))
+
+
+def save_stdlib_indented(path, document):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+
+
+def run(count, directory):
+    users = build_users(count)
+    path = os.path.join(directory, f"user_times_{count}.json")
+    indented_path = os.path.join(directory, f"user_times_{count}_indent.json")
+
+    save_indent, _ = timed(lambda: save_stdlib_indented(indented_path, users))
+    save_codec, _ = timed(lambda: atomic_write_json(path, users))
+    load_json, loaded_stdlib = timed(lambda: load_stdlib(path))
+    load_codec, loaded_codec = timed(lambda: codec.load_file(path, stream_threshold=float('inf')))
+    load_streamed, loaded_stream = timed(lambda: load_stream(path))
+    assert loaded_stdlib == loaded_codec == loaded_stream == users
+
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    indent_mb = os.path.getsize(indented_path) / (1024 * 1024)
+    print(f"\n👥 {count} usuarios - compacto {size_mb:.1f} MB (indentado {indent_mb:.1f} MB)")
+    print(f"   Guardar  json indent=2: {save_indent * 1000:8.1f} ms")
+    print(f"   Guardar  {codec.BACKEND} atómico: {save_codec * 1000:8.1f} ms")
+    print(f"   Cargar   json.load:     {load_json * 1000:8.1f} ms")
+    print(f"   Cargar   {codec.BACKEND}:{' ' * (14 - len(codec.BACKEND))}{load_codec * 1000:8.1f} ms")
+    print(f"   Cargar   incremental:   {load_streamed * 1000:8.1f} ms")
+
+    # El pico de memoria solo se mide con el stdlib (tracemalloc no ve la memoria de orjson)
+    del loaded_stdlib, loaded_codec, loaded_stream
+    print(f"   Pico RAM json.load:     {peak_memory(lambda: load_stdlib(path)):8.1f} MB")
+    print(f"   Pico RAM incremental:   {peak_memory(lambda: load_stream(path)):8.1f} MB")
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"📊 Benchmark de codificación JSON (codificador: {codec.BACKEND})")
+    print("-" * 50)
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as directory:
+        for count in sizes:
+            run(count, directory)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
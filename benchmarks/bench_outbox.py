@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la bandeja de salida de notificaciones
+Uso: python benchmarks/bench_outbox.py [comandos] [latencia_ms]   (por defecto 100 80)
+
+Cada comando imita /pausar_tiempo: responde a la interacción y publica un
+embed en el canal de pausas. "En línea" espera el envío al canal antes de
+terminar (como antes); "bandeja" lo encola en NotificationOutbox, que lo
+agrupa y lo envía en segundo plano con los límites de Discord por canal.
+El canal falso no aplica esos límites: en Discord, 100 envíos en línea al
+mismo canal quedarían retenidos por discord.py a razón de 5 cada 5 segundos.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notification_outbox import NotificationOutbox
+
+DEFAULT_COMMANDS = 100
+DEFAULT_LATENCY_MS = 80
+
+
+class FakeEmbed:
+    """Embed de prueba con el tamaño aproximado del de /pausar_tiempo"""
+
+    def __len__(self):
+        return 120
+
+
+class FakeChannel:
+    """Canal que tarda `latency` segundos en cada envío y cuenta los mensajes"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.messages = 0
+
+    async def send(self, content=None, embed=None, embeds=None):
+        await asyncio.sleep(self.latency)
+        self.messages += 1
+
+
+async def run(commands, latency, use_outbox):
+    """Lanzar todos los comandos a la vez y medir su latencia y los mensajes enviados"""
+    channel = FakeChannel(latency)
+    outbox = NotificationOutbox(lambda channel_id: channel)
+    durations = []
+
+    async def command():
+        start = time.perf_counter()
+        await asyncio.sleep(latency)  # respuesta a la interacción
+        if use_outbox:
+            outbox.post(1, embed=FakeEmbed())
+        else:
+            await channel.send(embed=FakeEmbed())
+        durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(command() for _ in range(commands)))
+    await outbox.drain()
+    delivered = time.perf_counter() - start
+
+    label = "bandeja" if use_outbox else "en línea"
+    print(f"   {label:>9}: latencia media del comando {sum(durations) / commands * 1000:7.1f} ms, "
+          f"{channel.messages:4d} mensajes al canal, todo entregado en {delivered:5.1f} s")
+
+
+def main():
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COMMANDS
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LATENCY_MS) / 1000
+    print(f"📊 Benchmark de notificaciones ({commands} comandos, {latency * 1000:.0f} ms por envío)")
+    print("-" * 50)
+    for use_outbox in (False, True):
+        asyncio.run(run(commands, latency, use_outbox))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark de contención de los locks por usuario de TimeTracker
+Uso: python benchmarks/bench_user_locks.py [operaciones] [usuarios]   (por defecto 20000 500)
+
+Cada operación imita un comando: comprueba el estado de un usuario, cede el
+event loop (como al esperar una escritura o una respuesta de Discord) y luego
+lo modifica. Sin locks, dos corrutinas pueden ver el mismo estado y aplicar
+la misma transición dos veces.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage import JsonStorage
+from time_tracker import TimeTracker
+
+DEFAULT_OPERATIONS = 20000
+DEFAULT_USERS = 500
+STRIPES = [1, 16, 64, 256]
+
+
+def build_tracker(directory, users, lock_stripes):
+    """Tracker en modo write-behind (sin escrituras a disco) con usuarios inactivos"""
+    storage = JsonStorage(os.path.join(directory, 'user_times.json'),
+                          os.path.join(directory, 'attendance_data.json'),
+                          os.path.join(directory, 'saved_credits.json'))
+    tracker = TimeTracker(os.path.join(directory, 'user_times.json'), write_behind=True,
+                          max_dirty=float('inf'), storage=storage, lock_stripes=lock_stripes)
+    tracker.data = {}
+    tracker.credits_data = {}
+    for user_id in range(1, users + 1):
+        tracker.pre_register_user(user_id, f"Usuario {user_id}")
+        tracker.start_tracking(user_id, f"Usuario {user_id}")
+        tracker.stop_tracking(user_id)
+    return tracker
+
+
+async def toggle(tracker, user_id, stats, locked):
+    """Iniciar o detener a un usuario según su estado; con crédito al detener"""
+    async def transition():
+        was_active = tracker.is_user_active(user_id)
+        await asyncio.sleep(0)
+        if was_active:
+            if not tracker.stop_tracking(user_id):
+                stats['lost'] += 1
+            tracker.add_saved_credits(user_id, 1)
+        elif not tracker.start_tracking(user_id, f"Usuario {user_id}"):
+            stats['lost'] += 1
+
+    start = time.perf_counter()
+    if locked:
+        async with tracker.user_lock(user_id):
+            stats['wait'] += time.perf_counter() - start
+            await transition()
+    else:
+        await transition()
+
+
+async def run(operations, users, lock_stripes):
+    """Lanzar todas las operaciones a la vez y medir tiempo, esperas y transiciones perdidas"""
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as directory:
+        tracker = build_tracker(directory, users, lock_stripes or 1)
+        stats = {'lost': 0, 'wait': 0.0}
+        targets = [random.randint(1, users) for _ in range(operations)]
+        start = time.perf_counter()
+        await asyncio.gather(*(toggle(tracker, user_id, stats, lock_stripes is not None) for user_id in targets))
+        elapsed = time.perf_counter() - start
+
+    label = "sin locks" if lock_stripes is None else f"{lock_stripes} franjas"
+    print(f"   {label:>12}: {elapsed * 1000:8.1f} ms, {operations / elapsed:9.0f} ops/s, "
+          f"espera media {stats['wait'] / operations * 1e6:8.1f} µs, "
+          f"transiciones dobles {stats['lost']}")
+
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_OPERATIONS
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_USERS
+    print(f"📊 Benchmark de locks por usuario ({operations} operaciones sobre {users} usuarios)")
+    print("-" * 50)
+    for lock_stripes in [None, *STRIPES]:
+        asyncio.run(run(operations, users, lock_stripes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
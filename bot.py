@@ -3,9 +3,14 @@ from discord.ext import commands
 from discord import app_commands
 import json
 import asyncio
+import atexit
+import itertools
 import os
+import time
 from datetime import datetime, timedelta
-import time_tracker
+from cluster import ClusterNode
+from guild_state import GuildRegistry, ROLE_NAMES
+from notification_outbox import NotificationOutbox
 
 # Cargar configuración
 def load_config():
@@ -46,16 +51,23 @@ intents.message_content = True
 intents.guilds = True
 intents.members = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-# IDs de roles
-ROLE_IDS = {
-    'gold': config.get('gold_role_id', 1382198935971430440),
-    'alto': config.get('alto_role_id', None),
-    'supervisor': config.get('supervisor_role_id', None),
-    'silver': config.get('silver_role_id', None),
-    'expediente': config.get('expediente_role_id', None)
-}
+# Modo sharded: varios procesos, cada uno con sus shards (SHARD_IDS o `sharding.shard_ids`),
+# comparten el almacenamiento y se reparten las tareas con leases (ver cluster.py)
+SHARDING_CONFIG = config.get('sharding', {})
+if SHARDING_CONFIG.get('enabled', False):
+    shard_ids = os.getenv('SHARD_IDS')
+    shard_ids = [int(shard_id) for shard_id in shard_ids.split(',')] if shard_ids else SHARDING_CONFIG.get('shard_ids')
+    shard_count = int(os.getenv('SHARD_COUNT', 0)) or SHARDING_CONFIG.get('shard_count')
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+    cluster = ClusterNode(os.getenv('NODE_ID') or SHARDING_CONFIG.get('node_id') or None,
+                          SHARDING_CONFIG.get('lease_seconds', 30))
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
+    cluster = None
+
+# Límite diario de trabajo en segundos por rol: Recluta 1 hora, los demás 2 horas
+DAILY_LIMIT_SECONDS = {role_name: 1 * 3600 if role_name == 'recluta' else 2 * 3600
+                       for role_name in ['recluta', *ROLE_NAMES]}
 
 # Sistema de créditos por rol y día de la semana
 CREDIT_SYSTEM = {
@@ -99,11 +111,25 @@ CREDIT_SYSTEM = {
 # Días permitidos para trabajar (viernes, sábado, domingo)
 ALLOWED_DAYS = [4, 5, 6]  # 4=viernes, 5=sábado, 6=domingo
 
-# Canales de notificación
-NOTIFICATION_CHANNELS = config.get('notification_channels', {})
+# Configuración de guardado
+TIME_TRACKING_CONFIG = config.get('time_tracking', {})
+SAVE_INTERVAL_MINUTES = TIME_TRACKING_CONFIG.get('save_interval_minutes', 5)
+BACKUP_INTERVAL_HOURS = TIME_TRACKING_CONFIG.get('backup_interval_hours', 6)
+ARCHIVE_AFTER_DAYS = TIME_TRACKING_CONFIG.get('archive_after_days', 30)
+CLEANUP_INACTIVE_DAYS = TIME_TRACKING_CONFIG.get('cleanup_inactive_days', 30)
+CLEANUP_INTERVAL_MINUTES = TIME_TRACKING_CONFIG.get('cleanup_interval_minutes', 10)
+CLEANUP_BATCH_SIZE = TIME_TRACKING_CONFIG.get('cleanup_batch_size', 500)
+SYNC_INTERVAL_SECONDS = SHARDING_CONFIG.get('sync_interval_seconds', 2)
+
+# Estado de cada servidor: tracker, escritor, actor, roles y canales propios (ver guild_state)
+guilds = GuildRegistry(config, cluster)
 
-# Instancia del tracker
-tracker = time_tracker.TimeTracker()
+# Los avisos a canales salen en segundo plano, agrupados y con los límites de Discord
+outbox = NotificationOutbox(bot.get_channel)
+
+def guild_state(guild):
+    """Estado del servidor de una interacción, miembro o canal (se crea al primer uso)"""
+    return guilds.get(guild.id)
 
 @bot.event
 async def on_ready():
@@ -114,30 +140,76 @@ async def on_ready():
     except Exception as e:
         print(f'❌ Error sincronizando comandos: {e}')
 
+    # El servidor principal (dueño de los datos de siempre) no puede depender del orden de llegada
+    try:
+        guilds.resolve_primary(guild.id for guild in bot.guilds)
+    except RuntimeError as e:
+        print(f'❌ {e}')
+        await bot.close()
+        return
+
+    # Cada servidor carga sus datos y construye sus índices por separado
+    await asyncio.gather(*(start_guild(guild) for guild in bot.guilds))
+
+@bot.event
+async def on_guild_join(guild):
+    """Preparar el estado de un servidor al que se acaba de unir el bot"""
+    await start_guild(guild)
+
+async def start_guild(guild):
+    """Cargar los usuarios de un servidor, construir sus buckets por rol y arrancar su planificador"""
+    state = guild_state(guild)
+    if state.milestone_task is None:
+        # Los cambios del tracker (también desde el hilo de warm_up) despiertan al planificador
+        loop = asyncio.get_running_loop()
+        state.tracker.milestone_listeners.append(lambda: loop.call_soon_threadsafe(state.milestone_wakeup.set))
+        if TIME_TRACKING_CONFIG.get('warm_up_on_start', True):
+            state.tracker.warm_up(background=True)
+        state.milestone_task = loop.create_task(milestone_scheduler(state), name=f"milestones-{guild.id}")
+
+    # Buckets por rol desde la caché de miembros (los usuarios se cargan fuera del event loop)
+    await asyncio.to_thread(state.tracker.warm_up, False, ['users'])
+    state.rebuild_role_buckets(guild)
+
+@bot.event
+async def on_member_update(before, after):
+    """Olvidar el rol cacheado cuando cambian los roles de un miembro"""
+    state = guild_state(after.guild)
+    state.member_role_cache.pop(after.id, None)
+    if after.id in state.member_role_bucket or after.id in state.unplaced:
+        state.place_in_role_bucket(after)
+
+@bot.event
+async def on_member_join(member):
+    """Un usuario del tracker que vuelve al servidor recupera su bucket de rol"""
+    guild_state(member.guild).place_in_role_bucket(member)
+
+@bot.event
+async def on_member_remove(member):
+    """Olvidar el rol cacheado de un miembro que salió del servidor"""
+    state = guild_state(member.guild)
+    state.member_role_cache.pop(member.id, None)
+    state.remove_from_role_bucket(member.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """Un cambio de posición de un rol puede cambiar el rol más alto de cualquiera"""
+    state = guild_state(after.guild)
+    state.member_role_cache.clear()
+    state.rebuild_role_buckets(after.guild)
+
+@bot.event
+async def on_guild_role_delete(role):
+    """Olvidar todos los roles cacheados al borrar un rol"""
+    state = guild_state(role.guild)
+    state.member_role_cache.clear()
+    state.rebuild_role_buckets(role.guild)
+
 def get_user_role(member):
     """Obtener el rol más alto del usuario basado en la jerarquía de Discord"""
     if not member:
         return 'recluta'
-
-    # Obtener todos los roles del usuario ordenados por posición (jerarquía)
-    # Discord ordena los roles por posición, donde mayor posición = mayor jerarquía
-    user_roles = sorted(member.roles, key=lambda r: r.position, reverse=True)
-
-    # Definir mapeo de IDs a nombres de roles para búsqueda
-    role_mapping = {
-        ROLE_IDS['expediente']: 'expediente',
-        ROLE_IDS['silver']: 'silver', 
-        ROLE_IDS['supervisor']: 'supervisor',
-        ROLE_IDS['alto']: 'alto',
-        ROLE_IDS['gold']: 'gold'
-    }
-
-    # Buscar el rol más alto que coincida con nuestros roles configurados
-    for role in user_roles:
-        if role.id in role_mapping:
-            return role_mapping[role.id]
-
-    return 'recluta'
+    return guild_state(member.guild).resolve_member_roles(member)[0]
 
 def is_allowed_day():
     """Verificar si hoy es un día permitido (viernes, sábado, domingo)"""
@@ -153,43 +225,40 @@ def get_daily_credits(user_role):
     role_credits = CREDIT_SYSTEM.get(user_role, {})
     return role_credits.get(today, 0)
 
-def get_user_daily_time(user_id):
+def get_user_daily_time(state, user_id):
     """Obtener tiempo trabajado hoy por un usuario"""
-    return tracker.get_daily_time(user_id)
-
-def can_user_work_today(user_id):
-    """Verificar si un usuario puede trabajar hoy según su rol"""
-    member = bot.get_guild(bot.guilds[0].id).get_member(user_id) if bot.guilds else None
-    user_role = get_user_role(member) if member else 'recluta'
-
-    daily_time = get_user_daily_time(user_id)
+    return state.tracker.get_daily_time(user_id)
 
-    # Rol normal: máximo 1 hora por día
-    if user_role == 'recluta':
-        max_daily_seconds = 1 * 3600  # 1 hora en segundos
-    else:
-        # Todos los demás roles: máximo 2 horas por día
-        max_daily_seconds = 2 * 3600  # 2 horas en segundos
-
-    return daily_time < max_daily_seconds
+def can_user_work_today(state, user_id, member=None):
+    """Verificar si un usuario puede trabajar hoy según su rol (sin modificar datos)"""
+    if member is None:
+        guild = bot.get_guild(state.guild_id)
+        member = guild.get_member(user_id) if guild else None
+    user_role = get_user_role(member)
+    return get_user_daily_time(state, user_id) < DAILY_LIMIT_SECONDS[user_role]
 
-def get_user_saved_credits(user_id):
+def get_user_saved_credits(state, user_id):
     """Obtener créditos guardados de un usuario"""
-    return tracker.get_saved_credits(user_id)
+    return state.tracker.get_saved_credits(user_id)
 
-def add_credits_to_user(user_id, credits):
+def add_credits_to_user(state, user_id, credits):
     """Agregar créditos a un usuario"""
-    return tracker.add_saved_credits(user_id, credits)
+    return state.tracker.add_saved_credits(user_id, credits)
+
+async def apply_deferred(interaction, function, *args):
+    """Diferir la respuesta y aplicar una mutación en el actor del servidor; responde tras su commit.
+
+    El commit de grupo puede tardar más que el plazo de 3 segundos de Discord
+    para responder a una interacción: después se responde con `followup`.
+    """
+    await interaction.response.defer()
+    return await guild_state(interaction.guild).actor.submit(function, *args)
 
 # Función para verificar si el usuario tiene el rol con ID para acceso completo
 def has_admin_bypass(member):
     if not member:
         return False
-    admin_bypass_role_id = 1366550916773318680  # ← Cambiar este ID por el nuevo rol
-    for role in member.roles:
-        if role.id == admin_bypass_role_id:
-            return True
-    return False
+    return guild_state(member.guild).resolve_member_roles(member)[1]
 
 # Pagination
 class PaginationView(discord.ui.View):
@@ -243,314 +312,335 @@ def create_paginated_embeds(data, title, color, items_per_page=10):
 async def iniciar_tiempo(interaction: discord.Interaction, usuario: discord.Member):
     import pytz
 
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
     user_id = usuario.id
-    member = interaction.guild.get_member(user_id)
-    user_role = get_user_role(member)
 
-    # Obtener hora actual en Chile
-    chile_tz = pytz.timezone('America/Santiago')
-    chile_time = datetime.now(chile_tz)
+    # Comprobar y cambiar el estado del usuario sin que otra operación lo modifique en medio
+    async with tracker.user_lock(user_id):
+        member = interaction.guild.get_member(user_id)
+        user_role = get_user_role(member)
 
-    # Verificar día permitido (con bypass para admin)
-    is_admin_bypass = has_admin_bypass(member)
-    if not is_allowed_day() and not is_admin_bypass:
-        embed = discord.Embed(
-            title="❌ Día no permitido",
-            description="Solo se puede trabajar los viernes, sábados y domingos.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
+        # Obtener hora actual en Chile
+        chile_tz = pytz.timezone('America/Santiago')
+        chile_time = datetime.now(chile_tz)
 
-    # Verificar límite diario según rol
-    if not can_user_work_today(user_id):
-        daily_time = get_user_daily_time(user_id)
-        hours = int(daily_time // 3600)
-        minutes = int((daily_time % 3600) // 60)
+        # Verificar día permitido (con bypass para admin)
+        is_admin_bypass = has_admin_bypass(member)
+        if not is_allowed_day() and not is_admin_bypass:
+            embed = discord.Embed(
+                title="❌ Día no permitido",
+                description="Solo se puede trabajar los viernes, sábados y domingos.",
+                color=0xff0000
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-        # Mensaje diferente según el rol
-        if user_role == 'recluta':
-            limit_message = "su 1 hora diaria permitida"
-        else:
-            limit_message = "sus 2 horas diarias permitidas"
+        # Verificar límite diario según rol
+        if not can_user_work_today(state, user_id, member):
+            daily_time = get_user_daily_time(state, user_id)
+            hours = int(daily_time // 3600)
+            minutes = int((daily_time % 3600) // 60)
 
-        embed = discord.Embed(
-            title="❌ Límite diario alcanzado",
-            description=f"{usuario.mention} ya completó {limit_message}.\n"
-                       f"Tiempo trabajado hoy: {hours}h {minutes}m\n"
-                       f"Podrá trabajar nuevamente mañana.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
+            # Mensaje diferente según el rol
+            if user_role == 'recluta':
+                limit_message = "su 1 hora diaria permitida"
+            else:
+                limit_message = "sus 2 horas diarias permitidas"
 
-    # Verificar si ya tiene tiempo activo
-    if tracker.is_user_active(user_id):
-        embed = discord.Embed(
-            title="⚠️ Usuario ya tiene tiempo activo",
-            description=f"{usuario.mention} ya tiene un seguimiento de tiempo activo.",
-            color=0xffaa00
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
+            embed = discord.Embed(
+                title="❌ Límite diario alcanzado",
+                description=f"{usuario.mention} ya completó {limit_message}.\n"
+                           f"Tiempo trabajado hoy: {hours}h {minutes}m\n"
+                           f"Podrá trabajar nuevamente mañana.",
+                color=0xff0000
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-    # Verificar si está pausado
-    if tracker.is_user_paused(user_id):
-        embed = discord.Embed(
-            title="⚠️ Usuario pausado",
-            description=f"{usuario.mention} tiene tiempo pausado. Usa `/despausar_tiempo` primero.",
-            color=0xffaa00
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
+        # Verificar si ya tiene tiempo activo
+        if tracker.is_user_active(user_id):
+            embed = discord.Embed(
+                title="⚠️ Usuario ya tiene tiempo activo",
+                description=f"{usuario.mention} ya tiene un seguimiento de tiempo activo.",
+                color=0xffaa00
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
+
+        # Verificar si está pausado
+        if tracker.is_user_paused(user_id):
+            embed = discord.Embed(
+                title="⚠️ Usuario pausado",
+                description=f"{usuario.mention} tiene tiempo pausado. Usa `/despausar_tiempo` primero.",
+                color=0xffaa00
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-    # LÓGICA PRINCIPAL: Pre-registro antes de las 12:23, inicio inmediato después
-    target_hour = 14
-    target_minute = 31
+        # LÓGICA PRINCIPAL: Pre-registro antes de las 12:23, inicio inmediato después
+        target_hour = 14
+        target_minute = 31
 
-    # Crear tiempo objetivo para comparación
-    target_time = chile_time.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)
+        # Crear tiempo objetivo para comparación
+        target_time = chile_time.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)
 
-    if chile_time < target_time:
-        # PRE-REGISTRO (antes de las 12:23)
-        success = tracker.pre_register_user(user_id, usuario.display_name)
+        if chile_time < target_time:
+            # PRE-REGISTRO (antes de las 12:23)
+            def pre_register():
+                if not tracker.pre_register_user(user_id, usuario.display_name):
+                    return False
+                # Registrar quién hizo el pre-registro
+                tracker.set_pre_register_initiator(user_id, interaction.user.id, interaction.user.display_name)
+                return True
 
-        if success:
-            # Registrar quién hizo el pre-registro
-            tracker.set_pre_register_initiator(user_id, interaction.user.id, interaction.user.display_name)
+            success = await apply_deferred(interaction, pre_register)
 
-            await interaction.response.send_message(
-                f"📝 Se ha registrado el tiempo de {usuario.mention} por {interaction.user.mention}",
-                ephemeral=False
-            )
+            if success:
+                state.place_in_role_bucket(usuario)
+
+                await interaction.followup.send(
+                    f"📝 Se ha registrado el tiempo de {usuario.mention} por {interaction.user.mention}",
+                    ephemeral=False
+                )
+            else:
+                embed = discord.Embed(
+                    title="❌ Error",
+                    description=f"{usuario.mention} ya está pre-registrado o tiene tiempo activo.",
+                    color=0xff0000
+                )
+                await interaction.followup.send(embed=embed, ephemeral=True)
         else:
+            # INICIO INMEDIATO (12:23 en adelante) - NO se otorgan créditos aquí
+            success = await apply_deferred(interaction, tracker.start_time, user_id)
+
+            if success:
+                state.place_in_role_bucket(usuario)
+                await interaction.followup.send(
+                    f"⏰ El tiempo de {usuario.mention} ha sido iniciado por {interaction.user.mention}",
+                    ephemeral=False
+                )
+            else:
+                embed = discord.Embed(
+                    title="❌ Error",
+                    description="No se pudo iniciar el seguimiento.",
+                    color=0xff0000
+                )
+                await interaction.followup.send(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="pausar_tiempo", description="Pausar seguimiento de tiempo de un usuario")
+async def pausar_tiempo(interaction: discord.Interaction, usuario: discord.Member):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
+    user_id = usuario.id
+
+    # Comprobar y cambiar el estado del usuario sin que otra operación lo modifique en medio
+    async with tracker.user_lock(user_id):
+        if not tracker.is_user_active(user_id):
             embed = discord.Embed(
-                title="❌ Error",
-                description=f"{usuario.mention} ya está pre-registrado o tiene tiempo activo.",
+                title="❌ Usuario sin tiempo activo",
+                description=f"{usuario.mention} no tiene un seguimiento de tiempo activo.",
                 color=0xff0000
             )
             await interaction.response.send_message(embed=embed, ephemeral=True)
-    else:
-        # INICIO INMEDIATO (12:23 en adelante) - NO se otorgan créditos aquí
-        success = tracker.start_time(user_id)
+            return
+
+        success = await apply_deferred(interaction, tracker.pause_time, user_id)
 
         if success:
-            await interaction.response.send_message(
-                f"⏰ El tiempo de {usuario.mention} ha sido iniciado por {interaction.user.mention}",
-                ephemeral=False
+            time_data = tracker.get_user_time(user_id)
+            hours = int(time_data['total_seconds'] // 3600)
+            minutes = int((time_data['total_seconds'] % 3600) // 60)
+
+            embed = discord.Embed(
+                title="⏸️ Tiempo pausado",
+                description=f"Tiempo pausado para {usuario.mention} por {interaction.user.mention}\n"
+                           f"Tiempo acumulado: {hours}h {minutes}m",
+                color=0xffaa00
             )
+            await interaction.followup.send(embed=embed)
+
+            # Notificar en canal de pausas (sin esperar al envío)
+            outbox.post(state.notification_channels.get('pauses'), embed=embed)
         else:
             embed = discord.Embed(
                 title="❌ Error",
-                description="No se pudo iniciar el seguimiento.",
+                description="No se pudo pausar el tiempo.",
                 color=0xff0000
             )
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-
-@bot.tree.command(name="pausar_tiempo", description="Pausar seguimiento de tiempo de un usuario")
-async def pausar_tiempo(interaction: discord.Interaction, usuario: discord.Member):
-    user_id = usuario.id
-
-    if not tracker.is_user_active(user_id):
-        embed = discord.Embed(
-            title="❌ Usuario sin tiempo activo",
-            description=f"{usuario.mention} no tiene un seguimiento de tiempo activo.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
-
-    success = tracker.pause_time(user_id)
-
-    if success:
-        time_data = tracker.get_user_time(user_id)
-        hours = int(time_data['total_seconds'] // 3600)
-        minutes = int((time_data['total_seconds'] % 3600) // 60)
-
-        embed = discord.Embed(
-            title="⏸️ Tiempo pausado",
-            description=f"Tiempo pausado para {usuario.mention} por {interaction.user.mention}\n"
-                       f"Tiempo acumulado: {hours}h {minutes}m",
-            color=0xffaa00
-        )
-        await interaction.response.send_message(embed=embed)
-
-        # Notificar en canal de pausas
-        if NOTIFICATION_CHANNELS.get('pauses'):
-            channel = bot.get_channel(NOTIFICATION_CHANNELS['pauses'])
-            if channel:
-                await channel.send(embed=embed)
-    else:
-        embed = discord.Embed(
-            title="❌ Error",
-            description="No se pudo pausar el tiempo.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+            await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="despausar_tiempo", description="Reanudar seguimiento de tiempo de un usuario")
 async def despausar_tiempo(interaction: discord.Interaction, usuario: discord.Member):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
     user_id = usuario.id
 
-    if not tracker.is_user_paused(user_id):
-        embed = discord.Embed(
-            title="❌ Usuario sin tiempo pausado",
-            description=f"{usuario.mention} no tiene un tiempo pausado para reanudar.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
+    # Comprobar y cambiar el estado del usuario sin que otra operación lo modifique en medio
+    async with tracker.user_lock(user_id):
+        if not tracker.is_user_paused(user_id):
+            embed = discord.Embed(
+                title="❌ Usuario sin tiempo pausado",
+                description=f"{usuario.mention} no tiene un tiempo pausado para reanudar.",
+                color=0xff0000
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-    success = tracker.unpause_time(user_id)
+        success = await apply_deferred(interaction, tracker.unpause_time, user_id)
 
-    if success:
-        embed = discord.Embed(
-            title="▶️ Tiempo reanudado",
-            description=f"Tiempo reanudado para {usuario.mention} por {interaction.user.mention}",
-            color=0x00ff00
-        )
-        await interaction.response.send_message(embed=embed)
+        if success:
+            embed = discord.Embed(
+                title="▶️ Tiempo reanudado",
+                description=f"Tiempo reanudado para {usuario.mention} por {interaction.user.mention}",
+                color=0x00ff00
+            )
+            await interaction.followup.send(embed=embed)
 
-        # Notificar en canal de despausas
-        if NOTIFICATION_CHANNELS.get('unpause'):
-            channel = bot.get_channel(NOTIFICATION_CHANNELS['unpause'])
-            if channel:
-                await channel.send(embed=embed)
-    else:
-        embed = discord.Embed(
-            title="❌ Error",
-            description="No se pudo reanudar el tiempo.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+            # Notificar en canal de despausas (sin esperar al envío)
+            outbox.post(state.notification_channels.get('unpause'), embed=embed)
+        else:
+            embed = discord.Embed(
+                title="❌ Error",
+                description="No se pudo reanudar el tiempo.",
+                color=0xff0000
+            )
+            await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="sumar_tiempo", description="Sumar tiempo a un usuario (en minutos)")
 async def sumar_tiempo(interaction: discord.Interaction, usuario: discord.Member, minutos: int):
     """Suma minutos al tiempo de un usuario."""
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
     user_id = usuario.id
 
-    # Verificar que los minutos sean válidos (entre 1 y 120)
-    if minutos < 1 or minutos > 120:
-        embed = discord.Embed(
-            title="❌ Error",
-            description="Los minutos deben estar entre 1 y 120.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
-
-    # Verificar si el usuario existe en el sistema
-    if str(user_id) not in tracker.data:
-        embed = discord.Embed(
-            title="❌ Usuario no encontrado",
-            description=f"{usuario.mention} no tiene tiempo registrado. Debe tener tiempo activo primero.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
+    # Comprobar y cambiar el estado del usuario sin que otra operación lo modifique en medio
+    async with tracker.user_lock(user_id):
+        # Verificar que los minutos sean válidos (entre 1 y 120)
+        if minutos < 1 or minutos > 120:
+            embed = discord.Embed(
+                title="❌ Error",
+                description="Los minutos deben estar entre 1 y 120.",
+                color=0xff0000
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-    # Obtener tiempo total actual antes de sumar
-    tiempo_anterior = tracker.get_total_time(user_id)
-    horas_antes = tiempo_anterior / 3600
+        # Verificar si el usuario existe en el sistema
+        if user_id not in tracker.data:
+            embed = discord.Embed(
+                title="❌ Usuario no encontrado",
+                description=f"{usuario.mention} no tiene tiempo registrado. Debe tener tiempo activo primero.",
+                color=0xff0000
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-    # Sumar los minutos usando el método correcto
-    success = tracker.add_minutes(user_id, usuario.display_name, minutos)
+        # Obtener tiempo total actual antes de sumar
+        tiempo_anterior = tracker.get_total_time(user_id)
+        horas_antes = tiempo_anterior / 3600
 
-    if success:
-        # Obtener tiempo total después de sumar
-        tiempo_nuevo = tracker.get_total_time(user_id)
-        horas_despues = tiempo_nuevo / 3600
+        # Sumar los minutos usando el método correcto
+        success = await apply_deferred(interaction, tracker.add_minutes, user_id, usuario.display_name, minutos)
 
-        # Obtener rol del usuario para calcular créditos
-        member = interaction.guild.get_member(user_id)
-        user_role = get_user_role(member) if member else 'recluta'
+        if success:
+            # Obtener tiempo total después de sumar
+            tiempo_nuevo = tracker.get_total_time(user_id)
+            horas_despues = tiempo_nuevo / 3600
 
-        # Obtener créditos por hora según rol y día
-        today = datetime.now().weekday()
-        role_credits = CREDIT_SYSTEM.get(user_role, {})
+            # Obtener rol del usuario para calcular créditos
+            member = interaction.guild.get_member(user_id)
+            user_role = get_user_role(member) if member else 'recluta'
+
+            # Obtener créditos por hora según rol y día
+            today = datetime.now().weekday()
+            role_credits = CREDIT_SYSTEM.get(user_role, {})
+
+            # Verificar si es admin bypass para días no permitidos
+            is_admin_bypass = has_admin_bypass(member)
+            if is_admin_bypass and today not in ALLOWED_DAYS:
+                credits_per_hour = role_credits.get(4, 0)  # Usar créditos del viernes
+            else:
+                credits_per_hour = role_credits.get(today, 0)
+
+            # Verificar si se completaron nuevas horas y otorgar créditos
+            creditos_otorgados = 0
+            milestones_completados = []
+
+            # Créditos, flags y detención se aplican juntos en el actor (un solo commit)
+            def apply_manual_milestones():
+                nonlocal creditos_otorgados
+
+                # Verificar milestone de 1 hora
+                if horas_antes < 1 and horas_despues >= 1:
+                    if not tracker.data[user_id].milestone_1h_completed:
+                        tracker.data[user_id].milestone_1h_completed = True
+                        if credits_per_hour > 0:
+                            creditos_otorgados += credits_per_hour
+                            add_credits_to_user(state, user_id, credits_per_hour)
+                            milestones_completados.append(f"1 hora (+{int(credits_per_hour) if credits_per_hour == int(credits_per_hour) else credits_per_hour} créditos)")
+
+                # Verificar milestone de 2 horas
+                if horas_antes < 2 and horas_despues >= 2:
+                    if not tracker.data[user_id].milestone_2h_completed:
+                        tracker.data[user_id].milestone_2h_completed = True
+                        if credits_per_hour > 0:
+                            creditos_otorgados += credits_per_hour
+                            add_credits_to_user(state, user_id, credits_per_hour)
+                            milestones_completados.append(f"2 horas (+{int(credits_per_hour) if credits_per_hour == int(credits_per_hour) else credits_per_hour} créditos)")
+
+                # Verificar si debe detenerse automáticamente 
+                tiempo_total_horas = tiempo_nuevo / 3600
+
+                # Para rol recluta: detener al alcanzar 1 hora
+                if user_role == 'recluta' and tiempo_total_horas >= 1.0:
+                    if tracker.is_user_active(user_id) or tracker.is_user_paused(user_id):
+                        tracker.stop_tracking(user_id)
+
+                # Para otros roles: detener al alcanzar 2 horas
+                elif user_role != 'recluta' and tiempo_total_horas >= 2.0:
+                    if tracker.is_user_active(user_id) or tracker.is_user_paused(user_id):
+                        tracker.stop_tracking(user_id)
+
+                # Guardar cambios (flags de milestone del usuario)
+                tracker.save_user_data(user_id)
+
+            await state.actor.submit(apply_manual_milestones)
+
+            # Mensaje simple sin información de detención automática
+            mensaje = f"⏱️ {interaction.user.mention} sumó {minutos} minutos a {usuario.mention}"
+
+            await interaction.followup.send(mensaje)
+
+            # Notificar en canal de milestones si se otorgaron créditos
+            if milestones_completados and credits_per_hour > 0:
+                # Mapear rol interno a nombre de cargo
+                role_names = {
+                    'expediente': 'Expediente',
+                    'silver': 'Silver',
+                    'supervisor': 'Supervisor',
+                    'alto': 'Alto',
+                    'gold': 'Gold',
+                    'recluta': 'Recluta'
+                }
+                role_display = role_names.get(user_role, user_role.title())
+
+                notificacion = f"🎉 **Créditos otorgados manualmente:**\n"
+                notificacion += f"{usuario.mention} - {', '.join(milestones_completados)} - Cargo: {role_display}"
+                outbox.post(state.milestone_channel_id, notificacion)
 
-        # Verificar si es admin bypass para días no permitidos
-        is_admin_bypass = has_admin_bypass(member)
-        if is_admin_bypass and today not in ALLOWED_DAYS:
-            credits_per_hour = role_credits.get(4, 0)  # Usar créditos del viernes
         else:
-            credits_per_hour = role_credits.get(today, 0)
-
-        # Verificar si se completaron nuevas horas y otorgar créditos
-        creditos_otorgados = 0
-        milestones_completados = []
-
-        # Verificar milestone de 1 hora
-        if horas_antes < 1 and horas_despues >= 1:
-            if not tracker.data[str(user_id)].get('milestone_1h_completed', False):
-                tracker.data[str(user_id)]['milestone_1h_completed'] = True
-                if credits_per_hour > 0:
-                    creditos_otorgados += credits_per_hour
-                    add_credits_to_user(user_id, credits_per_hour)
-                    milestones_completados.append(f"1 hora (+{int(credits_per_hour) if credits_per_hour == int(credits_per_hour) else credits_per_hour} créditos)")
-
-        # Verificar milestone de 2 horas
-        if horas_antes < 2 and horas_despues >= 2:
-            if not tracker.data[str(user_id)].get('milestone_2h_completed', False):
-                tracker.data[str(user_id)]['milestone_2h_completed'] = True
-                if credits_per_hour > 0:
-                    creditos_otorgados += credits_per_hour
-                    add_credits_to_user(user_id, credits_per_hour)
-                    milestones_completados.append(f"2 horas (+{int(credits_per_hour) if credits_per_hour == int(credits_per_hour) else credits_per_hour} créditos)")
-
-        # Verificar si debe detenerse automáticamente 
-        tiempo_total_horas = tiempo_nuevo / 3600
-
-        # Para rol recluta: detener al alcanzar 1 hora
-        if user_role == 'recluta' and tiempo_total_horas >= 1.0:
-            if tracker.is_user_active(user_id) or tracker.is_user_paused(user_id):
-                tracker.stop_tracking(user_id)
-
-        # Para otros roles: detener al alcanzar 2 horas
-        elif user_role != 'recluta' and tiempo_total_horas >= 2.0:
-            if tracker.is_user_active(user_id) or tracker.is_user_paused(user_id):
-                tracker.stop_tracking(user_id)
-
-        # Guardar cambios
-        tracker.save_data()
-
-        # Mensaje simple sin información de detención automática
-        mensaje = f"⏱️ {interaction.user.mention} sumó {minutos} minutos a {usuario.mention}"
-
-        await interaction.response.send_message(mensaje)
-
-        # Notificar en canal de milestones si se otorgaron créditos
-        if milestones_completados and credits_per_hour > 0:
-            milestone_channel = bot.get_channel(1385005232685318281)
-            if milestone_channel:
-                try:
-                    # Mapear rol interno a nombre de cargo
-                    role_names = {
-                        'expediente': 'Expediente',
-                        'silver': 'Silver',
-                        'supervisor': 'Supervisor',
-                        'alto': 'Alto',
-                        'gold': 'Gold',
-                        'recluta': 'Recluta'
-                    }
-                    role_display = role_names.get(user_role, user_role.title())
-
-                    notificacion = f"🎉 **Créditos otorgados manualmente:**\n"
-                    notificacion += f"{usuario.mention} - {', '.join(milestones_completados)} - Cargo: {role_display}"
-                    await milestone_channel.send(notificacion)
-                except Exception as e:
-                    print(f"Error enviando notificación de milestone manual: {e}")
-
-    else:
-        embed = discord.Embed(
-            title="❌ Error",
-            description="No se pudo sumar el tiempo.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+            embed = discord.Embed(
+                title="❌ Error",
+                description="No se pudo sumar el tiempo.",
+                color=0xff0000
+            )
+            await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="mi_tiempo", description="Ver tu tiempo personal")
 async def mi_tiempo(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
     user_id = interaction.user.id
     member = interaction.guild.get_member(user_id)
     user_role = get_user_role(member)
@@ -618,7 +708,7 @@ async def mi_tiempo(interaction: discord.Interaction):
         time_display = f"{hours} Hora{'s' if hours != 1 else ''}, {minutes} Minuto{'s' if minutes != 1 else ''}, {seconds} Segundo{'s' if seconds != 1 else ''}"
 
     # Obtener créditos guardados del usuario (solo los de horas completas anteriores)
-    saved_credits = get_user_saved_credits(user_id)
+    saved_credits = get_user_saved_credits(state, user_id)
 
     # NO calcular créditos en tiempo real
     # Los créditos se otorgan únicamente al completar 1 o 2 horas en check_time_limits()
@@ -637,12 +727,8 @@ async def mi_tiempo(interaction: discord.Interaction):
     daily_hours = daily_seconds / 3600
 
     # Límites diferentes según el rol
-    if user_role == 'recluta':
-        max_hours = 1
-        remaining_hours = max(0, 1 - daily_hours)
-    else:
-        max_hours = 2
-        remaining_hours = max(0, 2 - daily_hours)
+    max_hours = DAILY_LIMIT_SECONDS[user_role] // 3600
+    remaining_hours = max(0, max_hours - daily_hours)
 
     role_limits = {
         'recluta': f'Recluta - Límite: 1 hora diaria (Restante: {remaining_hours:.1f}h)',
@@ -720,14 +806,12 @@ async def mi_tiempo(interaction: discord.Interaction):
 
 @bot.tree.command(name="ver_tiempos", description="Ver tiempos de usuarios activos (con tiempo corriendo o pausado)")
 async def ver_tiempos(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
-    all_times = tracker.get_all_user_times()
-
-    # Filtrar solo usuarios con tiempo activo o pausado
-    active_users = {}
-    for user_id, time_data in all_times.items():
-        if time_data.get('is_active', False) or time_data.get('is_paused', False):
-            active_users[user_id] = time_data
+    # Solo usuarios con tiempo activo o pausado (desde los índices por estado)
+    active_users = tracker.get_user_times(itertools.chain(tracker.iter_active_users(),
+                                                          tracker.iter_paused_users()))
 
     if not active_users:
         embed = discord.Embed(
@@ -796,67 +880,70 @@ async def ver_tiempos(interaction: discord.Interaction):
 
 @bot.tree.command(name="cancelar_tiempo", description="Cancelar seguimiento de tiempo de un usuario")
 async def cancelar_tiempo(interaction: discord.Interaction, usuario: discord.Member):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
     user_id = usuario.id
 
-    if not tracker.is_user_active(user_id) and not tracker.is_user_paused(user_id):
-        embed = discord.Embed(
-            title="❌ Usuario sin tiempo activo",
-            description=f"{usuario.mention} no tiene tiempo activo o pausado.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-        return
-
-    # Obtener tiempo antes de cancelar
-    time_data = tracker.get_user_time(user_id)
-    total_seconds = int(time_data['total_seconds'])
-    hours = total_seconds // 3600
-    minutes = (total_seconds % 3600) // 60
-    seconds = total_seconds % 60
+    # Comprobar y cambiar el estado del usuario sin que otra operación lo modifique en medio
+    async with tracker.user_lock(user_id):
+        if not tracker.is_user_active(user_id) and not tracker.is_user_paused(user_id):
+            embed = discord.Embed(
+                title="❌ Usuario sin tiempo activo",
+                description=f"{usuario.mention} no tiene tiempo activo o pausado.",
+                color=0xff0000
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
-    # Formatear tiempo
-    if hours > 0:
-        time_display = f"{hours} Hora{'s' if hours != 1 else ''}"
-        if minutes > 0:
-            time_display += f" {minutes} Minuto{'s' if minutes != 1 else ''}"
-        if seconds > 0:
-            time_display += f" {seconds} Segundo{'s' if seconds != 1 else ''}"
-    elif minutes > 0:
-        time_display = f"{minutes} Minuto{'s' if minutes != 1 else ''}"
-        if seconds > 0:
-            time_display += f" y {seconds} Segundo{'s' if seconds != 1 else ''}"
-    else:
-        time_display = f"{seconds} Segundo{'s' if seconds != 1 else ''}"
+        # Obtener tiempo antes de cancelar
+        time_data = tracker.get_user_time(user_id)
+        total_seconds = int(time_data['total_seconds'])
+        hours = total_seconds // 3600
+        minutes = (total_seconds % 3600) // 60
+        seconds = total_seconds % 60
+
+        # Formatear tiempo
+        if hours > 0:
+            time_display = f"{hours} Hora{'s' if hours != 1 else ''}"
+            if minutes > 0:
+                time_display += f" {minutes} Minuto{'s' if minutes != 1 else ''}"
+            if seconds > 0:
+                time_display += f" {seconds} Segundo{'s' if seconds != 1 else ''}"
+        elif minutes > 0:
+            time_display = f"{minutes} Minuto{'s' if minutes != 1 else ''}"
+            if seconds > 0:
+                time_display += f" y {seconds} Segundo{'s' if seconds != 1 else ''}"
+        else:
+            time_display = f"{seconds} Segundo{'s' if seconds != 1 else ''}"
 
-    success = tracker.cancel_time(user_id)
+        success = await apply_deferred(interaction, tracker.cancel_time, user_id)
 
-    if success:
-        embed = discord.Embed(
-            title="❌ Tiempo cancelado",
-            description=f"Tiempo cancelado para {usuario.mention}\n"
-                       f"Tiempo que tenía: {time_display}",
-            color=0xff6b6b
-        )
-        await interaction.response.send_message(embed=embed)
+        if success:
+            embed = discord.Embed(
+                title="❌ Tiempo cancelado",
+                description=f"Tiempo cancelado para {usuario.mention}\n"
+                           f"Tiempo que tenía: {time_display}",
+                color=0xff6b6b
+            )
+            await interaction.followup.send(embed=embed)
 
-        # Notificar en canal de cancelaciones
-        if NOTIFICATION_CHANNELS.get('cancellations'):
-            channel = bot.get_channel(NOTIFICATION_CHANNELS['cancellations'])
-            if channel:
-                await channel.send(embed=embed)
-    else:
-        embed = discord.Embed(
-            title="❌ Error",
-            description="No se pudo cancelar el tiempo.",
-            color=0xff0000
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+            # Notificar en canal de cancelaciones (sin esperar al envío)
+            outbox.post(state.notification_channels.get('cancellations'), embed=embed)
+        else:
+            embed = discord.Embed(
+                title="❌ Error",
+                description="No se pudo cancelar el tiempo.",
+                color=0xff0000
+            )
+            await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="paga_alto", description="Ver créditos de usuarios con rol Alto")
 async def paga_alto(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
-    all_times = tracker.get_all_user_times()
+    all_times = tracker.get_user_times(state.iter_role_bucket('alto', guild=interaction.guild))
 
     if not all_times:
         embed = discord.Embed(
@@ -874,26 +961,22 @@ async def paga_alto(interaction: discord.Interaction):
     )
 
     alto_users = []
+    daily_credits = get_daily_credits('alto')
     for user_id, time_data in all_times.items():
         try:
             user = bot.get_user(int(user_id))
             if user:
-                member = interaction.guild.get_member(int(user_id))
-                if member:
-                    user_role = get_user_role(member)
-                    if user_role == 'alto':
-                        daily_credits = get_daily_credits(user_role)
-                        hours = int(time_data['total_seconds'] // 3600)
-                        minutes = int((time_data['total_seconds'] % 3600) // 60)
-
-                        status = "🟢" if time_data['is_active'] else "⏸️" if time_data['is_paused'] else "⭕"
-
-                        alto_users.append({
-                            'name': user.display_name,
-                            'time': f"{hours}h {minutes}m",
-                            'credits': daily_credits,
-                            'status': status
-                        })
+                hours = int(time_data['total_seconds'] // 3600)
+                minutes = int((time_data['total_seconds'] % 3600) // 60)
+
+                status = "🟢" if time_data['is_active'] else "⏸️" if time_data['is_paused'] else "⭕"
+
+                alto_users.append({
+                    'name': user.display_name,
+                    'time': f"{hours}h {minutes}m",
+                    'credits': daily_credits,
+                    'status': status
+                })
         except:
             continue
 
@@ -915,8 +998,10 @@ async def paga_alto(interaction: discord.Interaction):
 
 @bot.tree.command(name="paga_recluta", description="Ver créditos de usuarios con rol Recluta")
 async def paga_recluta(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
-    all_times = tracker.get_all_user_times()
+    all_times = tracker.get_user_times(state.iter_role_bucket('recluta', guild=interaction.guild))
 
     if not all_times:
         embed = discord.Embed(
@@ -934,26 +1019,22 @@ async def paga_recluta(interaction: discord.Interaction):
     )
 
     recluta_users = []
+    daily_credits = get_daily_credits('recluta')
     for user_id, time_data in all_times.items():
         try:
             user = bot.get_user(int(user_id))
             if user:
-                member = interaction.guild.get_member(int(user_id))
-                if member:
-                    user_role = get_user_role(member)
-                    if user_role == 'recluta':
-                        daily_credits = get_daily_credits(user_role)
-                        hours = int(time_data['total_seconds'] // 3600)
-                        minutes = int((time_data['total_seconds'] % 3600) // 60)
-
-                        status = "🟢" if time_data['is_active'] else "⏸️" if time_data['is_paused'] else "⭕"
-
-                        recluta_users.append({
-                            'name': user.display_name,
-                            'time': f"{hours}h {minutes}m",
-                            'credits': daily_credits,
-                            'status': status
-                        })
+                hours = int(time_data['total_seconds'] // 3600)
+                minutes = int((time_data['total_seconds'] % 3600) // 60)
+
+                status = "🟢" if time_data['is_active'] else "⏸️" if time_data['is_paused'] else "⭕"
+
+                recluta_users.append({
+                    'name': user.display_name,
+                    'time': f"{hours}h {minutes}m",
+                    'credits': daily_credits,
+                    'status': status
+                })
         except:
             continue
 
@@ -975,8 +1056,10 @@ async def paga_recluta(interaction: discord.Interaction):
 
 @bot.tree.command(name="paga_gold", description="Ver créditos de usuarios con rol Gold")
 async def paga_gold(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
-    all_times = tracker.get_all_user_times()
+    all_times = tracker.get_user_times(state.iter_role_bucket('gold', guild=interaction.guild))
 
     if not all_times:
         embed = discord.Embed(
@@ -994,26 +1077,22 @@ async def paga_gold(interaction: discord.Interaction):
     )
 
     gold_users = []
+    daily_credits = get_daily_credits('gold')
     for user_id, time_data in all_times.items():
         try:
             user = bot.get_user(int(user_id))
             if user:
-                member = interaction.guild.get_member(int(user_id))
-                if member:
-                    user_role = get_user_role(member)
-                    if user_role == 'gold':
-                        daily_credits = get_daily_credits(user_role)
-                        hours = int(time_data['total_seconds'] // 3600)
-                        minutes = int((time_data['total_seconds'] % 3600) // 60)
-
-                        status = "🟢" if time_data['is_active'] else "⏸️" if time_data['is_paused'] else "⭕"
-
-                        gold_users.append({
-                            'name': user.display_name,
-                            'time': f"{hours}h {minutes}m",
-                            'credits': daily_credits,
-                            'status': status
-                        })
+                hours = int(time_data['total_seconds'] // 3600)
+                minutes = int((time_data['total_seconds'] % 3600) // 60)
+
+                status = "🟢" if time_data['is_active'] else "⏸️" if time_data['is_paused'] else "⭕"
+
+                gold_users.append({
+                    'name': user.display_name,
+                    'time': f"{hours}h {minutes}m",
+                    'credits': daily_credits,
+                    'status': status
+                })
         except:
             continue
 
@@ -1033,22 +1112,76 @@ async def paga_gold(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="ranking", description="Ver los usuarios con más tiempo total o más créditos guardados")
+@app_commands.describe(tipo="Qué clasificar", cantidad="Cuántos usuarios mostrar (1-25)")
+@app_commands.choices(tipo=[
+    app_commands.Choice(name="Tiempo total", value="tiempo"),
+    app_commands.Choice(name="Créditos guardados", value="creditos")
+])
+async def ranking(interaction: discord.Interaction, tipo: app_commands.Choice[str], cantidad: int = 10):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
+
+    # Verificar que la cantidad sea válida (un embed admite hasta 25 líneas cómodamente)
+    if cantidad < 1 or cantidad > 25:
+        embed = discord.Embed(
+            title="❌ Error",
+            description="La cantidad debe estar entre 1 y 25.",
+            color=0xff0000
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    # Solo los primeros N desde el índice de ranking (sin ordenar a todos los usuarios)
+    if tipo.value == "tiempo":
+        title = "🏆 Ranking de tiempo total"
+        top = [(user_id, tracker.format_time_human(seconds)) for user_id, seconds in tracker.get_top_total_time(cantidad)]
+    else:
+        title = "🏆 Ranking de créditos guardados"
+        top = [(user_id, f"{credits} créditos") for user_id, credits in tracker.get_top_saved_credits(cantidad)]
+
+    lines = []
+    for position, (user_id, value) in enumerate(top, start=1):
+        member = interaction.guild.get_member(user_id) if interaction.guild else None
+        user_data = tracker.data.get(user_id)
+        if member:
+            name = member.display_name
+        elif user_data is not None and user_data.name:
+            name = user_data.name
+        else:
+            name = f"Usuario {user_id}"
+        lines.append(f"**{position}.** {name} — {value}")
+
+    embed = discord.Embed(
+        title=title,
+        description="\n".join(lines) if lines else "No hay datos para mostrar.",
+        color=0xf1c40f
+    )
+    await interaction.response.send_message(embed=embed)
+
 @bot.tree.command(name="reset_horas_max", description="Resetar límites diarios, créditos guardados y tiempos totales de todos los usuarios")
 async def reset_horas_max(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
     try:
         # Obtener total de usuarios afectados antes del reset
         all_users = tracker.get_all_user_times()
         total_users = len(all_users)
 
-        # Resetear tiempos diarios y flags de milestone de todos los usuarios
-        tracker.reset_daily_times()
+        # Los tres resets se guardan juntos en un solo commit
+        def reset_all():
+            # Resetear tiempos diarios y flags de milestone de todos los usuarios
+            tracker.reset_daily_times()
 
-        # Resetear créditos guardados de todos los usuarios
-        tracker.clear_all_saved_credits()
+            # Resetear créditos guardados de todos los usuarios
+            tracker.clear_all_saved_credits()
 
-        # NUEVO: Resetear tiempos totales de todos los usuarios
-        tracker.reset_all_total_times()
+            # NUEVO: Resetear tiempos totales de todos los usuarios
+            tracker.reset_all_total_times()
+
+        # Confirmar solo cuando el reset ya está escrito
+        await apply_deferred(interaction, reset_all)
 
         embed = discord.Embed(
             title="🔄 Reset completo realizado",
@@ -1069,7 +1202,7 @@ async def reset_horas_max(interaction: discord.Interaction):
             inline=False
         )
 
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
     except Exception as e:
         embed = discord.Embed(
@@ -1077,23 +1210,24 @@ async def reset_horas_max(interaction: discord.Interaction):
             description=f"No se pudo realizar el reset completo: {e}",
             color=0xff0000
         )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        else:
+            await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="limpiar_base_datos", description="Limpiar tiempos, pre-registros y créditos de usuarios Recluta y Gold únicamente")
 async def limpiar_base_datos(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
-    # Obtener todos los usuarios para verificar roles
-    all_users = tracker.get_all_user_times()
+    # Solo los usuarios del tracker con los roles a limpiar
     users_to_clean = []
 
-    for user_id_str in list(all_users.keys()):
+    for user_id in state.iter_role_bucket('recluta', 'gold', guild=interaction.guild):
         try:
-            user_id = int(user_id_str)
             member = interaction.guild.get_member(user_id)
             if member:
-                user_role = get_user_role(member)
-                if user_role in ['recluta', 'gold']:
-                    users_to_clean.append({'id': user_id, 'name': member.display_name, 'role': user_role})
+                users_to_clean.append({'id': user_id, 'name': member.display_name, 'role': state.member_role_bucket[user_id]})
         except:
             continue
 
@@ -1106,18 +1240,22 @@ async def limpiar_base_datos(interaction: discord.Interaction):
         await interaction.response.send_message(embed=embed, ephemeral=True)
         return
 
-    # Limpiar datos específicos por rol
-    cleaned_count = 0
+    # Limpiar datos específicos por rol (todas las limpiezas en un solo commit)
+    def clean_users():
+        cleaned_count = 0
+        for user_info in users_to_clean:
+            user_id = user_info['id']
 
-    for user_info in users_to_clean:
-        user_id = user_info['id']
+            # Limpiar tiempos y pre-registros
+            if tracker.reset_user_time(user_id):
+                cleaned_count += 1
 
-        # Limpiar tiempos y pre-registros
-        if tracker.reset_user_time(user_id):
-            cleaned_count += 1
+            # Limpiar créditos guardados
+            tracker.clear_user_saved_credits(user_id)
+        return cleaned_count
 
-        # Limpiar créditos guardados
-        tracker.clear_user_saved_credits(user_id)
+    # Confirmar solo cuando la limpieza ya está escrita
+    cleaned_count = await apply_deferred(interaction, clean_users)
 
     embed = discord.Embed(
         title="✅ Limpieza selectiva completada",
@@ -1145,23 +1283,21 @@ async def limpiar_base_datos(interaction: discord.Interaction):
             inline=False
         )
 
-    await interaction.response.send_message(embed=embed)
+    await interaction.followup.send(embed=embed)
 
 @bot.tree.command(name="limpiar_creditos_guardados", description="Limpiar créditos, tiempos y datos de usuarios Expediente, Silver, Supervisor y Alto únicamente")
 async def limpiar_creditos_guardados(interaction: discord.Interaction):
+    state = guild_state(interaction.guild)
+    tracker = state.tracker
 
-    # Obtener todos los usuarios para verificar roles
-    all_users = tracker.get_all_user_times()
+    # Solo los usuarios del tracker con los roles a limpiar
     users_to_clean = []
 
-    for user_id_str in list(all_users.keys()):
+    for user_id in state.iter_role_bucket('expediente', 'silver', 'supervisor', 'alto', guild=interaction.guild):
         try:
-            user_id = int(user_id_str)
             member = interaction.guild.get_member(user_id)
             if member:
-                user_role = get_user_role(member)
-                if user_role in ['expediente', 'silver', 'supervisor', 'alto']:
-                    users_to_clean.append({'id': user_id, 'name': member.display_name, 'role': user_role})
+                users_to_clean.append({'id': user_id, 'name': member.display_name, 'role': state.member_role_bucket[user_id]})
         except:
             continue
 
@@ -1174,18 +1310,22 @@ async def limpiar_creditos_guardados(interaction: discord.Interaction):
         await interaction.response.send_message(embed=embed, ephemeral=True)
         return
 
-    # Limpiar datos específicos por rol
-    cleaned_count = 0
+    # Limpiar datos específicos por rol (todas las limpiezas en un solo commit)
+    def clean_users():
+        cleaned_count = 0
+        for user_info in users_to_clean:
+            user_id = user_info['id']
 
-    for user_info in users_to_clean:
-        user_id = user_info['id']
+            # Limpiar tiempos y todos los datos
+            if tracker.reset_user_time(user_id):
+                cleaned_count += 1
 
-        # Limpiar tiempos y todos los datos
-        if tracker.reset_user_time(user_id):
-            cleaned_count += 1
+            # Limpiar créditos guardados
+            tracker.clear_user_saved_credits(user_id)
+        return cleaned_count
 
-        # Limpiar créditos guardados
-        tracker.clear_user_saved_credits(user_id)
+    # Confirmar solo cuando la limpieza ya está escrita
+    cleaned_count = await apply_deferred(interaction, clean_users)
 
     embed = discord.Embed(
         title="✅ Limpieza selectiva completada",
@@ -1214,358 +1354,425 @@ async def limpiar_creditos_guardados(interaction: discord.Interaction):
             inline=False
         )
 
-    await interaction.response.send_message(embed=embed)
+    await interaction.followup.send(embed=embed)
 
-# Tarea para verificar tiempo cada minuto
+# Tareas en segundo plano
 @bot.event
 async def setup_hook():
     """Configurar tareas en segundo plano"""
-    check_time_limits.start()
+    # El servidor principal (si está configurado) carga sus datos mientras el bot se conecta;
+    # los planificadores de milestones se arrancan por servidor en start_guild. En modo
+    # sharded puede que el servidor principal no sea de los shards de este proceso
+    if cluster is None and guilds.primary_guild_id is not None and TIME_TRACKING_CONFIG.get('warm_up_on_start', True):
+        guilds.get(guilds.primary_guild_id).tracker.warm_up(background=True)
+    if cluster is not None:
+        print(f"🧩 Nodo {cluster.node_id} (shards {bot.shard_ids or 'automáticos'})")
+        sync_cluster_state.start()
     check_auto_start.start()
+    if TIME_TRACKING_CONFIG.get('write_behind', False):
+        flush_tracker_data.start()
+    backup_tracker_data.start()
+    if ARCHIVE_AFTER_DAYS > 0:
+        archive_tracker_history.start()
+    if CLEANUP_INACTIVE_DAYS > 0:
+        cleanup_tracker_data.start()
 
 from discord.ext import tasks
 
-@tasks.loop(minutes=1)
-async def check_time_limits():
-    """Verificar límites de tiempo cada minuto - optimizado para 80+ usuarios simultáneos"""
+async def for_each_guild(description, function):
+    """Ejecutar `function(state)` en todos los servidores a la vez; el error de uno no detiene a los demás"""
+    states = list(guilds)
+    results = await asyncio.gather(*(function(state) for state in states), return_exceptions=True)
+    for state, result in zip(states, results):
+        if isinstance(result, Exception):
+            print(f"Error {description} (servidor {state.guild_id}): {result}")
+
+async def holds_lease(state, name):
+    """Con varios nodos, True solo en el que tiene el lease `name` del servidor"""
+    if cluster is None:
+        return True
     try:
-        all_times = tracker.get_all_user_times()
-        milestone_channel = bot.get_channel(1385005232685318281)
-
-        if not all_times:
-            return
-
-        # Ajuste dinámico del chunk_size basado en la cantidad de usuarios
-        total_users = len(all_times)
-        if total_users > 60:
-            chunk_size = 8  # Chunks más pequeños para 60+ usuarios
-        elif total_users > 30:
-            chunk_size = 10
-        else:
-            chunk_size = 15
+        return await cluster.hold(state.tracker.storage, name)
+    except Exception as e:
+        print(f"Error consultando el lease {name} (servidor {state.guild_id}): {e}")
+        return False
 
-        user_items = list(all_times.items())
+async def milestone_scheduler(state):
+    """Dormir hasta el próximo milestone programado del servidor y procesar los usuarios que lo alcanzaron"""
+    tracker = state.tracker
+    # Cargar fuera del event loop; si el warm-up ya los cargó no hace nada
+    await asyncio.to_thread(tracker.warm_up, False, ['users'])
+    while True:
+        try:
+            state.milestone_wakeup.clear()
+            deadline = tracker.next_milestone_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                await asyncio.wait_for(state.milestone_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            due_users = tracker.pop_due_milestones()
+            if due_users and not await holds_lease(state, 'milestones'):
+                # Otro nodo otorga los milestones; volver a intentarlo cuando pueda vencer su lease
+                tracker.schedule_milestones(due_users)
+                await asyncio.sleep(cluster.lease_seconds / 3)
+                continue
+            if due_users:
+                await check_time_limits(state, due_users)
+                # Los que no cambiaron de estado (p. ej. error al procesarlos) vuelven al heap
+                tracker.schedule_milestones(due_users)
+        except Exception as e:
+            print(f"Error en el planificador de milestones (servidor {state.guild_id}): {e}")
+            await asyncio.sleep(1)
+
+async def check_time_limits(state, user_ids):
+    """Otorgar los milestones de 1 y 2 horas a los usuarios indicados - optimizado para 80+ usuarios simultáneos"""
+    tracker = state.tracker
+    try:
+        guild = bot.get_guild(state.guild_id)
 
         # Listas para agrupar notificaciones
         completed_1h_users = []
         completed_2h_users = []
 
-        print(f"🔄 Procesando {total_users} usuarios en chunks de {chunk_size}...")
-
-        for i in range(0, len(user_items), chunk_size):
-            chunk = user_items[i:i + chunk_size]
-            chunk_start_time = datetime.now()
+        def apply_milestones(user_id):
+            """Otorgar el milestone vencido de un usuario (se ejecuta dentro del actor)"""
+            time_data = tracker.get_user_time(user_id)
+            if not time_data.get('is_active', False):
+                return
 
-            for user_id_str, time_data in chunk:
-                try:
-                    if not time_data.get('is_active', False):
-                        continue
+            total_seconds = time_data['total_seconds']
+            total_minutes = total_seconds // 60
 
-                    user_id = int(user_id_str)
-                    total_seconds = time_data['total_seconds']
-                    total_minutes = total_seconds // 60
+            # Verificar milestone de 1 hora
+            if (total_minutes >= 60 and 
+                not tracker.data[user_id].milestone_1h_completed):
 
-                    # Verificar milestone de 1 hora
-                    if (total_minutes >= 60 and 
-                        not tracker.data[user_id_str].get('milestone_1h_completed', False)):
+                # Marcar como completado inmediatamente para evitar duplicados
+                tracker.data[user_id].milestone_1h_completed = True
 
-                        # Marcar como completado inmediatamente para evitar duplicados
-                        tracker.data[user_id_str]['milestone_1h_completed'] = True
-
-                        user = bot.get_user(user_id)
-                        if user:
-                            try:
-                                guild = milestone_channel.guild if milestone_channel else None
-                                member = guild.get_member(user_id) if guild else None
-                                user_role = get_user_role(member) if member else 'recluta'
+                user = bot.get_user(user_id)
+                if user:
+                    try:
+                        member = guild.get_member(user_id) if guild else None
+                        user_role = get_user_role(member) if member else 'recluta'
 
-                                today = datetime.now().weekday()
-                                role_credits = CREDIT_SYSTEM.get(user_role, {})
+                        today = datetime.now().weekday()
+                        role_credits = CREDIT_SYSTEM.get(user_role, {})
 
-                                # Verificar si es admin bypass
-                                is_admin_bypass = has_admin_bypass(member)
-                                if is_admin_bypass and today not in ALLOWED_DAYS:
-                                    credits_per_hour = role_credits.get(4, 0)  # Usar créditos del viernes
-                                else:
-                                    credits_per_hour = role_credits.get(today, 0)
+                        # Verificar si es admin bypass
+                        is_admin_bypass = has_admin_bypass(member)
+                        if is_admin_bypass and today not in ALLOWED_DAYS:
+                            credits_per_hour = role_credits.get(4, 0)  # Usar créditos del viernes
+                        else:
+                            credits_per_hour = role_credits.get(today, 0)
 
-                                credits_earned = credits_per_hour if credits_per_hour > 0 else 0
-                                if credits_earned == int(credits_earned):
-                                    credits_earned = int(credits_earned)
+                        credits_earned = credits_per_hour if credits_per_hour > 0 else 0
+                        if credits_earned == int(credits_earned):
+                            credits_earned = int(credits_earned)
 
-                                # Guardar créditos y detener tiempo
-                                if credits_earned > 0:
-                                    add_credits_to_user(user_id, credits_earned)
+                        # Guardar créditos y detener tiempo en un solo commit
+                        with tracker.transaction():
+                            if credits_earned > 0:
+                                add_credits_to_user(state, user_id, credits_earned)
 
-                                tracker.stop_tracking(user_id)
+                            tracker.stop_tracking(user_id)
 
-                                # Agregar a lista para notificación grupal (incluir rol)
-                                completed_1h_users.append((user, credits_earned, user_role))
+                        # Agregar a lista para notificación grupal (incluir rol)
+                        completed_1h_users.append((user, credits_earned, user_role))
 
-                            except Exception as role_error:
-                                print(f"Error procesando rol de usuario {user_id}: {role_error}")
-                                tracker.stop_tracking(user_id)
+                    except Exception as role_error:
+                        print(f"Error procesando rol de usuario {user_id}: {role_error}")
+                        tracker.stop_tracking(user_id)
 
-                    # Verificar milestone de 2 horas
-                    elif (total_minutes >= 120 and 
-                          not tracker.data[user_id_str].get('milestone_2h_completed', False)):
+            # Verificar milestone de 2 horas
+            elif (total_minutes >= 120 and 
+                  not tracker.data[user_id].milestone_2h_completed):
 
-                        # Marcar como completado inmediatamente para evitar duplicados
-                        tracker.data[user_id_str]['milestone_2h_completed'] = True
+                # Marcar como completado inmediatamente para evitar duplicados
+                tracker.data[user_id].milestone_2h_completed = True
 
-                        user = bot.get_user(user_id)
-                        if user:
-                            try:
-                                guild = milestone_channel.guild if milestone_channel else None
-                                member = guild.get_member(user_id) if guild else None
-                                user_role = get_user_role(member) if member else 'recluta'
+                user = bot.get_user(user_id)
+                if user:
+                    try:
+                        member = guild.get_member(user_id) if guild else None
+                        user_role = get_user_role(member) if member else 'recluta'
 
-                                today = datetime.now().weekday()
-                                role_credits = CREDIT_SYSTEM.get(user_role, {})
+                        today = datetime.now().weekday()
+                        role_credits = CREDIT_SYSTEM.get(user_role, {})
 
-                                # Verificar si es admin bypass
-                                is_admin_bypass = has_admin_bypass(member)
-                                if is_admin_bypass and today not in ALLOWED_DAYS:
-                                    credits_per_hour = role_credits.get(4, 0)  # Usar créditos del viernes
-                                else:
-                                    credits_per_hour = role_credits.get(today, 0)
+                        # Verificar si es admin bypass
+                        is_admin_bypass = has_admin_bypass(member)
+                        if is_admin_bypass and today not in ALLOWED_DAYS:
+                            credits_per_hour = role_credits.get(4, 0)  # Usar créditos del viernes
+                        else:
+                            credits_per_hour = role_credits.get(today, 0)
 
-                                credits_earned = credits_per_hour if credits_per_hour > 0 else 0
-                                total_credits_2h = credits_per_hour * 2 if credits_per_hour > 0 else 0
+                        credits_earned = credits_per_hour if credits_per_hour > 0 else 0
+                        total_credits_2h = credits_per_hour * 2 if credits_per_hour > 0 else 0
 
-                                if credits_earned == int(credits_earned):
-                                    credits_earned = int(credits_earned)
-                                if total_credits_2h == int(total_credits_2h):
-                                    total_credits_2h = int(total_credits_2h)
+                        if credits_earned == int(credits_earned):
+                            credits_earned = int(credits_earned)
+                        if total_credits_2h == int(total_credits_2h):
+                            total_credits_2h = int(total_credits_2h)
 
-                                # Guardar créditos y detener tiempo
-                                if credits_earned > 0:
-                                    add_credits_to_user(user_id, credits_earned)
+                        # Guardar créditos y detener tiempo en un solo commit
+                        with tracker.transaction():
+                            if credits_earned > 0:
+                                add_credits_to_user(state, user_id, credits_earned)
 
-                                tracker.stop_tracking(user_id)
+                            tracker.stop_tracking(user_id)
 
-                                # Agregar a lista para notificación grupal (incluir rol)
-                                completed_2h_users.append((user, total_credits_2h, user_role))
+                        # Agregar a lista para notificación grupal (incluir rol)
+                        completed_2h_users.append((user, total_credits_2h, user_role))
 
-                            except Exception as role_error:
-                                print(f"Error procesando rol de usuario {user_id}: {role_error}")
-                                tracker.stop_tracking(user_id)
+                    except Exception as role_error:
+                        print(f"Error procesando rol de usuario {user_id}: {role_error}")
+                        tracker.stop_tracking(user_id)
 
-                except Exception as user_error:
-                    print(f"Error procesando usuario {user_id_str}: {user_error}")
-                    continue
+            # Registrar el flag aunque no se haya podido detener al usuario
+            tracker.save_user_data(user_id)
 
-            # Guardar datos tras cada chunk con retry
+        async def process_user(user_id):
             try:
-                tracker.save_data()
-            except Exception as save_error:
-                print(f"Error guardando datos chunk {i//chunk_size + 1}: {save_error}")
-                # Retry una vez
-                try:
-                    await asyncio.sleep(0.5)
-                    tracker.save_data()
-                except:
-                    print(f"Error crítico guardando chunk {i//chunk_size + 1}")
-
-            # Pausa adaptativa entre chunks
-            chunk_processing_time = (datetime.now() - chunk_start_time).total_seconds()
-            if i + chunk_size < len(user_items):
-                # Pausa más larga si el chunk tardó mucho
-                if chunk_processing_time > 2:
-                    await asyncio.sleep(2.0)
-                else:
-                    await asyncio.sleep(1.2)
-
-                # Log de progreso para chunks grandes
-                if total_users > 50:
-                    print(f"📊 Chunk {i//chunk_size + 1}/{(len(user_items)-1)//chunk_size + 1} completado")
-
-        # Enviar notificaciones agrupadas de forma más robusta
-        if milestone_channel and (completed_1h_users or completed_2h_users):
-            try:
-                print(f"📤 Enviando notificaciones: {len(completed_1h_users)} de 1h, {len(completed_2h_users)} de 2h")
-
-                # Notificaciones de 1 hora (máximo 8 por mensaje para evitar límites)
-                if completed_1h_users:
-                    for i in range(0, len(completed_1h_users), 8):
-                        try:
-                            batch = completed_1h_users[i:i+8]
-                            user_mentions = []
-                            for user, credits, user_role in batch:
-                                # Mapear rol interno a nombre de cargo
-                                role_names = {
-                                    'expediente': 'Expediente',
-                                    'silver': 'Silver',
-                                    'supervisor': 'Supervisor',
-                                    'alto': 'Alto',
-                                    'gold': 'Gold',
-                                    'recluta': 'Recluta'
-                                }
-                                role_display = role_names.get(user_role, user_role.title())
-                                user_mentions.append(f"{user.mention} ({credits} créditos) - Cargo: {role_display}")
-
-                            message = f"🎉 **Usuarios que completaron 1 hora ({i+1}-{min(i+8, len(completed_1h_users))}):**\n" + "\n".join(user_mentions)
-                            await milestone_channel.send(message)
-                            await asyncio.sleep(1.5)  # Pausa más larga para evitar rate limits
-                        except Exception as batch_error:
-                            print(f"Error enviando lote 1h {i//8 + 1}: {batch_error}")
-                            await asyncio.sleep(2)
-
-                # Notificaciones de 2 horas (máximo 8 por mensaje)
-                if completed_2h_users:
-                    for i in range(0, len(completed_2h_users), 8):
-                        try:
-                            batch = completed_2h_users[i:i+8]
-                            user_mentions = []
-                            for user, credits, user_role in batch:
-                                # Mapear rol interno a nombre de cargo
-                                role_names = {
-                                    'expediente': 'Expediente',
-                                    'silver': 'Silver',
-                                    'supervisor': 'Supervisor',
-                                    'alto': 'Alto',
-                                    'gold': 'Gold',
-                                    'recluta': 'Recluta'
-                                }
-                                role_display = role_names.get(user_role, user_role.title())
-                                user_mentions.append(f"{user.mention} ({credits} créditos) - Cargo: {role_display}")
-
-                            message = f"🎉 **Usuarios que completaron 2 horas ({i+1}-{min(i+8, len(completed_2h_users))}):**\n" + "\n".join(user_mentions)
-                            await milestone_channel.send(message)
-                            await asyncio.sleep(1.5)
-                        except Exception as batch_error:
-                            print(f"Error enviando lote 2h {i//8 + 1}: {batch_error}")
-                            await asyncio.sleep(2)
-
-                print(f"✅ Notificaciones enviadas completamente")
-
-            except Exception as notification_error:
-                print(f"Error crítico enviando notificaciones: {notification_error}")
+                # Bajo el lock del usuario: un comando que lo pausó o canceló mientras
+                # tanto no puede provocar créditos ni detenciones dobles
+                async with tracker.user_lock(user_id):
+                    await state.actor.submit(apply_milestones, user_id)
+            except Exception as user_error:
+                print(f"Error procesando usuario {user_id}: {user_error}")
+
+        # Todos los usuarios a la vez: el actor los agrupa en uno o pocos commits
+        await asyncio.gather(*(process_user(user_id) for user_id in user_ids))
+
+        # Encolar las notificaciones agrupadas: la bandeja de salida las parte en mensajes
+        # de hasta 2000 caracteres y las envía respetando los límites del canal
+        if completed_1h_users or completed_2h_users:
+            print(f"📤 Encolando notificaciones: {len(completed_1h_users)} de 1h, {len(completed_2h_users)} de 2h")
+
+            # Mapear rol interno a nombre de cargo
+            role_names = {
+                'expediente': 'Expediente',
+                'silver': 'Silver',
+                'supervisor': 'Supervisor',
+                'alto': 'Alto',
+                'gold': 'Gold',
+                'recluta': 'Recluta'
+            }
+            for completed_users, label in ((completed_1h_users, "1 hora"), (completed_2h_users, "2 horas")):
+                if not completed_users:
+                    continue
+                user_mentions = [
+                    f"{user.mention} ({credits} créditos) - Cargo: {role_names.get(user_role, user_role.title())}"
+                    for user, credits, user_role in completed_users
+                ]
+                message = f"🎉 **Usuarios que completaron {label} ({len(completed_users)}):**\n" + "\n".join(user_mentions)
+                outbox.post(state.milestone_channel_id, message)
 
     except Exception as e:
         print(f"Error crítico en verificación de límites: {e}")
         # Continuar funcionando incluso si hay errores
 
-@tasks.loop(minutes=1)
-async def check_auto_start():
-    """Verificar y ejecutar inicio automático - optimizado para 80+ usuarios simultáneos"""
-    try:
-        # Obtener hora actual en Chile (UTC-3)
-        import pytz
-        chile_tz = pytz.timezone('America/Santiago')
-        chile_time = datetime.now(chile_tz)
-
-        # Verificar si son exactamente las 12:25 PM (hora de prueba)
-        if chile_time.hour == 14 and chile_time.minute == 32:
-            pre_registered_users = tracker.get_pre_registered_users()
+@tasks.loop(minutes=SAVE_INTERVAL_MINUTES)
+async def flush_tracker_data():
+    """Escribir a disco los cambios acumulados en modo write-behind"""
+    await for_each_guild("guardando cambios pendientes", lambda state: state.writer.durable())
+
+@flush_tracker_data.after_loop
+async def after_flush_tracker_data():
+    """Último guardado al detener la tarea"""
+    await for_each_guild("en el último guardado", lambda state: state.writer.durable())
+
+async def backup_guild_data(state):
+    """Crear una generación de backup de un servidor (una vez por cluster)"""
+    if await holds_lease(state, 'backup'):
+        await state.writer.backup()
+
+@tasks.loop(hours=BACKUP_INTERVAL_HOURS)
+async def backup_tracker_data():
+    """Crear una generación de backup de los archivos de datos"""
+    await for_each_guild("creando backups programados", backup_guild_data)
+
+async def archive_guild_history(state):
+    """Mover el historial antiguo de un servidor a sus archivos mensuales comprimidos"""
+    if not await holds_lease(state, 'maintenance'):
+        return
+    # Reunir en el actor, escribir los archivos en el hilo escritor y quitar de memoria en el actor
+    job = await state.actor.submit(state.tracker.prepare_archive_history, ARCHIVE_AFTER_DAYS)
+    if not job['history']:
+        return
+    await asyncio.wrap_future(state.writer.submit(state.tracker.write_archive, job))
+    stats = await state.actor.submit(state.tracker.finish_archive, job)
+    if stats['users']:
+        print(f"📦 Historial archivado (servidor {state.guild_id}): {stats['days']} días y "
+              f"{stats['sessions']} sesiones de {stats['users']} usuarios")
+
+@tasks.loop(hours=24)
+async def archive_tracker_history():
+    """Mover el historial antiguo a los archivos mensuales comprimidos"""
+    await for_each_guild("archivando historial", archive_guild_history)
+
+async def cleanup_guild_data(state):
+    """Limpiar por lotes los registros inactivos de un servidor"""
+    if not await holds_lease(state, 'maintenance'):
+        return
+    # Como archive_guild_history: el archivo comprimido se escribe fuera del event loop
+    job = await state.actor.submit(state.tracker.prepare_cleanup, CLEANUP_INACTIVE_DAYS, CLEANUP_BATCH_SIZE)
+    await asyncio.wrap_future(state.writer.submit(state.tracker.write_archive, job))
+    stats = await state.actor.submit(state.tracker.finish_cleanup, job)
+    if stats['evicted'] or stats['pruned_keys'] or stats['bytes_reclaimed'] > 0:
+        print(f"🧹 Limpieza (servidor {state.guild_id}): {stats['scanned']} registros revisados, "
+              f"{stats['evicted']} usuarios archivados, {stats['pruned_keys']} claves diarias eliminadas, "
+              f"{stats['bytes_reclaimed']} bytes liberados")
+
+@tasks.loop(minutes=CLEANUP_INTERVAL_MINUTES)
+async def cleanup_tracker_data():
+    """Limpiar por lotes los registros inactivos y el historial diario antiguo"""
+    await for_each_guild("en limpieza de inactivos", cleanup_guild_data)
+
+async def auto_start_guild(state):
+    """Iniciar a los usuarios pre-registrados de un servidor"""
+    if not await holds_lease(state, 'auto_start'):
+        return
+    tracker = state.tracker
+    pre_registered_users = tracker.get_pre_registered_users()
 
-            if pre_registered_users:
-                movements_channel = bot.get_channel(NOTIFICATION_CHANNELS.get('movements'))
-                total_users = len(pre_registered_users)
+    if pre_registered_users:
+        movements_channel = bot.get_channel(state.notification_channels.get('movements'))
+        total_users = len(pre_registered_users)
 
-                print(f"🚀 Iniciando proceso automático para {total_users} usuarios...")
+        print(f"🚀 Iniciando proceso automático para {total_users} usuarios (servidor {state.guild_id})...")
 
-                # Ajuste dinámico del batch_size según la cantidad de usuarios
-                if total_users > 60:
-                    batch_size = 10  # Lotes más pequeños para 60+ usuarios
-                elif total_users > 30:
-                    batch_size = 12
-                else:
-                    batch_size = 15
+        # Ajuste dinámico del batch_size según la cantidad de usuarios
+        if total_users > 60:
+            batch_size = 10  # Lotes más pequeños para 60+ usuarios
+        elif total_users > 30:
+            batch_size = 12
+        else:
+            batch_size = 15
 
-                # Usar el método optimizado en lotes de time_tracker
-                user_ids = [int(user_id_str) for user_id_str in pre_registered_users.keys()]
+        # Usar el método optimizado en lotes de time_tracker
+        user_ids = [int(user_id_str) for user_id_str in pre_registered_users.keys()]
 
-                started_users = []
-                failed_users = []
+        started_users = []
+        failed_users = []
 
-                # Procesar en chunks para evitar timeouts
-                for i in range(0, len(user_ids), batch_size):
-                    batch_ids = user_ids[i:i + batch_size]
-                    batch_start_time = datetime.now()
+        # Procesar en chunks para evitar timeouts
+        for i in range(0, len(user_ids), batch_size):
+            batch_ids = user_ids[i:i + batch_size]
+            batch_start_time = datetime.now()
 
+            try:
+                # Usar método batch optimizado del tracker (con los usuarios del lote bloqueados);
+                # cada lote es un solo commit del actor
+                async with tracker.lock_users(batch_ids):
+                    results = await state.actor.submit(tracker.start_tracking_from_pre_register_batch, batch_ids)
+
+                # Procesar resultados del batch
+                for user_id in results['success']:
+                    user = bot.get_user(user_id)
+                    if user:
+                        started_users.append(user.mention)
+                        # Limpiar información del pre-registro
+                        tracker.clear_pre_register_initiator(user_id)
+                    else:
+                        failed_users.append(f"Usuario {user_id} (no encontrado)")
+
+                # Agregar fallos del batch
+                for user_id in results['failed']:
+                    failed_users.append(f"Usuario {user_id} (error de inicio)")
+
+                batch_processing_time = (datetime.now() - batch_start_time).total_seconds()
+
+                # Log de progreso para lotes grandes
+                if total_users > 30:
+                    print(f"📊 Lote {i//batch_size + 1}/{(len(user_ids)-1)//batch_size + 1}: {len(results['success'])} iniciados, {len(results['failed'])} fallidos (tiempo: {batch_processing_time:.1f}s)")
+
+            except Exception as batch_error:
+                print(f"Error procesando lote {i//batch_size + 1}: {batch_error}")
+                # Procesamiento individual como fallback
+                for user_id in batch_ids:
                     try:
-                        # Usar método batch optimizado del tracker
-                        results = tracker.start_tracking_from_pre_register_batch(batch_ids)
-
-                        # Procesar resultados del batch
-                        for user_id in results['success']:
+                        async with tracker.user_lock(user_id):
+                            success = await state.actor.submit(tracker.start_tracking_from_pre_register, user_id)
+                        if success:
                             user = bot.get_user(user_id)
                             if user:
                                 started_users.append(user.mention)
-                                # Limpiar información del pre-registro
                                 tracker.clear_pre_register_initiator(user_id)
                             else:
                                 failed_users.append(f"Usuario {user_id} (no encontrado)")
+                        else:
+                            failed_users.append(f"Usuario {user_id} (error individual)")
+                    except Exception as individual_error:
+                        print(f"Error individual usuario {user_id}: {individual_error}")
+                        failed_users.append(f"Usuario {user_id} (excepción)")
+
+        print(f"✅ Proceso automático completado:")
+        print(f"   ✅ {len(started_users)} usuarios iniciados correctamente")
+        print(f"   ❌ {len(failed_users)} usuarios con errores")
+
+        # Notificación de inicio automático deshabilitada
+        # if started_users and movements_channel:
+        #     try:
+        #         if len(started_users) <= 15:
+        #             # Notificación detallada para pocos usuarios
+        #             users_text = ", ".join(started_users)
+        #             await movements_channel.send(
+        #                 f"🤖 **INICIO AUTOMÁTICO - 12:25 PM**\n"
+        #                 f"⏰ Usuarios iniciados automáticamente:\n"
+        #                 f"{users_text}\n"
+        #                 f"📊 Total: {len(started_users)} usuarios"
+        #             )
+        #         else:
+        #             # Mensaje resumen para muchos usuarios + muestra de 10
+        #             sample_users = started_users[:10]
+        #             sample_text = ", ".join(sample_users)
+
+        #             await movements_channel.send(
+        #                 f"🤖 **INICIO AUTOMÁTICO - 12:25 PM**\n"
+        #                 f"📊 {len(started_users)} usuarios iniciados automáticamente\n"
+        #                 f"❌ {len(failed_users)} usuarios con error\n\n"
+        #                 f"👥 Muestra (primeros 10): {sample_text}"
+        #                 f"{'...' if len(started_users) > 10 else ''}"
+        #             )
+        #     except Exception as notification_error:
+        #         print(f"Error enviando notificación: {notification_error}")
+
+async def sync_guild_state(state):
+    """Aplicar en memoria lo que otros nodos escribieron en el servidor"""
+    # En el hilo escritor: detrás de los commits propios ya encolados
+    batch = await asyncio.wrap_future(state.writer.submit(state.sync.fetch))
+    if batch is None:
+        return
+    applied = await state.actor.submit(state.tracker.apply_remote_changes, *batch)
+    guild = bot.get_guild(state.guild_id)
+    for user_id in applied.get('users', ()):
+        member = guild.get_member(int(user_id)) if guild else None
+        if member:
+            state.place_in_role_bucket(member)
+        else:
+            state.mark_unplaced(int(user_id))
 
-                        # Agregar fallos del batch
-                        for user_id in results['failed']:
-                            failed_users.append(f"Usuario {user_id} (error de inicio)")
-
-                        batch_processing_time = (datetime.now() - batch_start_time).total_seconds()
+@tasks.loop(seconds=SYNC_INTERVAL_SECONDS)
+async def sync_cluster_state():
+    """Mantener la caché de cada servidor al día con los demás nodos del cluster"""
+    await for_each_guild("sincronizando con el cluster", sync_guild_state)
 
-                        # Log de progreso para lotes grandes
-                        if total_users > 30:
-                            print(f"📊 Lote {i//batch_size + 1}/{(len(user_ids)-1)//batch_size + 1}: {len(results['success'])} iniciados, {len(results['failed'])} fallidos (tiempo: {batch_processing_time:.1f}s)")
+@tasks.loop(minutes=1)
+async def check_auto_start():
+    """Verificar y ejecutar inicio automático - optimizado para 80+ usuarios simultáneos"""
+    try:
+        # Obtener hora actual en Chile (UTC-3)
+        import pytz
+        chile_tz = pytz.timezone('America/Santiago')
+        chile_time = datetime.now(chile_tz)
 
-                        # Pausa adaptativa entre lotes
-                        if i + batch_size < len(user_ids):
-                            if batch_processing_time > 3:
-                                await asyncio.sleep(1.5)  # Pausa más larga si el lote tardó mucho
-                            else:
-                                await asyncio.sleep(1.0)
-
-                    except Exception as batch_error:
-                        print(f"Error procesando lote {i//batch_size + 1}: {batch_error}")
-                        # Procesamiento individual como fallback
-                        for user_id in batch_ids:
-                            try:
-                                success = tracker.start_tracking_from_pre_register(user_id)
-                                if success:
-                                    user = bot.get_user(user_id)
-                                    if user:
-                                        started_users.append(user.mention)
-                                        tracker.clear_pre_register_initiator(user_id)
-                                    else:
-                                        failed_users.append(f"Usuario {user_id} (no encontrado)")
-                                else:
-                                    failed_users.append(f"Usuario {user_id} (error individual)")
-                            except Exception as individual_error:
-                                print(f"Error individual usuario {user_id}: {individual_error}")
-                                failed_users.append(f"Usuario {user_id} (excepción)")
-
-                        await asyncio.sleep(1.5)
-
-                print(f"✅ Proceso automático completado:")
-                print(f"   ✅ {len(started_users)} usuarios iniciados correctamente")
-                print(f"   ❌ {len(failed_users)} usuarios con errores")
-
-                # Notificación de inicio automático deshabilitada
-                # if started_users and movements_channel:
-                #     try:
-                #         if len(started_users) <= 15:
-                #             # Notificación detallada para pocos usuarios
-                #             users_text = ", ".join(started_users)
-                #             await movements_channel.send(
-                #                 f"🤖 **INICIO AUTOMÁTICO - 12:25 PM**\n"
-                #                 f"⏰ Usuarios iniciados automáticamente:\n"
-                #                 f"{users_text}\n"
-                #                 f"📊 Total: {len(started_users)} usuarios"
-                #             )
-                #         else:
-                #             # Mensaje resumen para muchos usuarios + muestra de 10
-                #             sample_users = started_users[:10]
-                #             sample_text = ", ".join(sample_users)
-
-                #             await movements_channel.send(
-                #                 f"🤖 **INICIO AUTOMÁTICO - 12:25 PM**\n"
-                #                 f"📊 {len(started_users)} usuarios iniciados automáticamente\n"
-                #                 f"❌ {len(failed_users)} usuarios con error\n\n"
-                #                 f"👥 Muestra (primeros 10): {sample_text}"
-                #                 f"{'...' if len(started_users) > 10 else ''}"
-                #             )
-                #     except Exception as notification_error:
-                #         print(f"Error enviando notificación: {notification_error}")
+        # Verificar si son exactamente las 12:25 PM (hora de prueba)
+        if chile_time.hour == 14 and chile_time.minute == 32:
+            # Cada servidor inicia a sus usuarios por separado, todos a la vez
+            await for_each_guild("en inicio automático", auto_start_guild)
 
     except Exception as e:
         print(f"Error crítico en verificación de inicio automático: {e}")
@@ -1576,11 +1783,6 @@ async def before_check_auto_start():
     """Esperar a que el bot esté listo antes de iniciar la tarea"""
     await bot.wait_until_ready()
 
-@check_time_limits.before_loop
-async def before_check_time_limits():
-    """Esperar a que el bot esté listo antes de iniciar la tarea"""
-    await bot.wait_until_ready()
-
 # Función principal
 if __name__ == "__main__":
     token = get_discord_token()
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+class ClusterNode:
+    """Identidad de este proceso en un despliegue con varios procesos y sus leases.
+
+    Las tareas que deben ejecutarse una sola vez en todo el cluster (milestones,
+    inicio automático, mantenimiento) piden un lease al almacenamiento
+    compartido antes de cada ejecución. El nodo que lo tiene lo renueva al
+    volver a pedirlo; si deja de hacerlo (proceso caído o reiniciándose), otro
+    nodo lo toma en cuanto vence.
+    """
+
+    def __init__(self, node_id: Optional[str] = None, lease_seconds: float = 30.0):
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        # Última renovación (reloj monotónico) de cada lease tomado: (almacenamiento, nombre) -> segundos
+        self._renewed: Dict[Tuple[int, str], float] = {}
+
+    def _fresh(self, key: Tuple[int, str]) -> bool:
+        """Un lease renovado hace menos de un tercio de su duración sigue vigente sin consultar"""
+        renewed = self._renewed.get(key)
+        return renewed is not None and time.monotonic() - renewed < self.lease_seconds / 3
+
+    def holds(self, storage, name: str) -> bool:
+        """Tomar o renovar un lease (bloqueante); True si este nodo lo tiene"""
+        key = (id(storage), name)
+        if self._fresh(key):
+            return True
+        started = time.monotonic()
+        if storage.acquire_lease(name, self.node_id, self.lease_seconds):
+            self._renewed[key] = started
+            return True
+        self._renewed.pop(key, None)
+        return False
+
+    async def hold(self, storage, name: str) -> bool:
+        """Como holds, con la consulta al almacenamiento fuera del event loop"""
+        if self._fresh((id(storage), name)):
+            return True
+        return await asyncio.to_thread(self.holds, storage, name)
+
+    def release(self, storage) -> None:
+        """Liberar los leases de un almacenamiento (al apagar el nodo) para no esperar a que venzan"""
+        for key in [key for key in self._renewed if key[0] == id(storage)]:
+            del self._renewed[key]
+            try:
+                storage.release_lease(key[1], self.node_id)
+            except Exception as e:
+                print(f"Error liberando lease {key[1]}: {e}")
+
+
+class StoreSync:
+    """Coherencia de la caché de un TimeTracker con lo que escriben otros nodos.
+
+    Cada commit de un nodo queda anotado en el registro de cambios del
+    almacenamiento compartido. `fetch` lee las entradas de los demás nodos
+    desde la última versión vista y relee esos registros; se ejecuta en el hilo
+    escritor, detrás de los commits propios ya encolados. El resultado se
+    aplica en memoria con `TimeTracker.apply_remote_changes`.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.storage = tracker.storage
+        # Versión del registro de cambios ya reflejada en memoria; se lee antes
+        # de cargar los datos para no perder cambios hechos durante la carga
+        self.version = self.storage.latest_change()
+
+    def fetch(self) -> Optional[Tuple[Dict[str, Dict[str, Optional[Dict[str, Any]]]], Set[str]]]:
+        """Registros cambiados por otros nodos y almacenes a recargar completos (None si no hay nada)"""
+        version, changed = self.storage.changes_since(self.version)
+        self.version = version
+
+        records, complete = {}, set()
+        for store, ids in changed.items():
+            # Un almacén aún sin cargar se leerá completo y actualizado al primer acceso
+            if not self.tracker.is_loaded(store):
+                continue
+            if ids is None:
+                records[store] = self.storage.load([store])[store]
+                complete.add(store)
+            else:
+                records[store] = self.storage.load_records(store, ids)
+        return (records, complete) if records else None
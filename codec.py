@@ -0,0 +1,132 @@
+import json
+import os
+from typing import Dict, Any, Iterator, Tuple, TextIO, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Nombre del codificador en uso (para logs y benchmarks)
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Archivos más grandes que esto se cargan con el parser incremental
+STREAM_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps_bytes(document: Any) -> bytes:
+    """Serializar a JSON compacto en UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(document)
+    return json.dumps(document, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps(document: Any) -> str:
+    """Serializar a una cadena JSON compacta"""
+    if orjson is not None:
+        return orjson.dumps(document).decode('utf-8')
+    return json.dumps(document, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Interpretar un documento JSON (lanza JSONDecodeError si es inválido)"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            # Mismo tipo de error con o sin orjson
+            raise JSONDecodeError(str(e), data if isinstance(data, str) else '', 0) from None
+    return json.loads(data)
+
+
+def iter_object_items(f: TextIO, chunk_size: int = 1024 * 1024) -> Iterator[Tuple[str, Any]]:
+    """Recorrer los pares clave/valor de un objeto JSON de primer nivel sin leerlo entero.
+
+    Solo se mantiene en memoria un bloque de texto y el valor que se está
+    interpretando, así que cargar un archivo grande no necesita el texto
+    completo además de los objetos resultantes. Las claves repetidas (campos,
+    fechas) se comparten entre registros como haría json.load.
+    """
+    keys = {}
+    decoder = json.JSONDecoder(object_pairs_hook=lambda pairs: {keys.setdefault(k, k): v for k, v in pairs})
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def skip_whitespace() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                return ''
+
+    def decode_value() -> Any:
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except JSONDecodeError:
+                # Valor incompleto: leer otro bloque y reintentar
+                if fill():
+                    continue
+                raise
+            # Un número al final del bloque podría continuar en el siguiente
+            if end == len(buffer) and fill():
+                continue
+            position = end
+            return value
+
+    if skip_whitespace() != '{':
+        raise JSONDecodeError("Se esperaba un objeto JSON", buffer, position)
+    position += 1
+
+    if skip_whitespace() == '}':
+        return
+
+    while True:
+        if skip_whitespace() != '"':
+            raise JSONDecodeError("Se esperaba una clave", buffer, position)
+        key = decode_value()
+        if skip_whitespace() != ':':
+            raise JSONDecodeError("Se esperaba ':'", buffer, position)
+        position += 1
+        skip_whitespace()
+        yield key, decode_value()
+
+        separator = skip_whitespace()
+        position += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise JSONDecodeError("Se esperaba ',' o '}'", buffer, position - 1)
+
+
+def load_file(path: str, stream_threshold: int = STREAM_THRESHOLD_BYTES) -> Dict[str, Any]:
+    """Cargar un documento JSON de primer nivel (objeto) desde un archivo.
+
+    Los archivos pequeños se leen de una vez con el codificador rápido; los
+    mayores que `stream_threshold` se recorren por bloques.
+    """
+    if os.path.getsize(path) > stream_threshold:
+        with open(path, 'r', encoding='utf-8') as f:
+            return dict(iter_object_items(f))
+
+    with open(path, 'rb') as f:
+        return loads(f.read())
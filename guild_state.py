@@ -0,0 +1,275 @@
+import asyncio
+import atexit
+import os
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+import archive
+import storage
+import time_tracker
+from cluster import StoreSync
+from tracker_actor import TrackerActor
+from tracker_writer import TrackerWriter
+
+# Roles internos configurables (el resto de miembros son 'recluta')
+ROLE_NAMES = ('gold', 'alto', 'supervisor', 'silver', 'expediente')
+DEFAULT_ROLE_IDS = {'gold': 1382198935971430440}
+# Rol con acceso completo (ignora días y límites)
+DEFAULT_ADMIN_BYPASS_ROLE_ID = 1366550916773318680
+DEFAULT_MILESTONE_CHANNEL_ID = 1385005232685318281
+
+
+class GuildState:
+    """Estado de un servidor de Discord: tracker propio, roles, canales e índices.
+
+    Cada servidor tiene sus datos en su propio almacenamiento, con su hilo
+    escritor y su actor de mutaciones, así que la carga y los guardados de un
+    servidor grande no retrasan a los demás. La configuración de cada servidor
+    sale de `guilds.<id>` en config.json; lo que no se defina ahí se toma de
+    las claves globales de siempre (`gold_role_id`, `notification_channels`...).
+    """
+
+    def __init__(self, guild_id: int, settings: Dict[str, Any], tracker, writer, actor,
+                 sync: Optional[StoreSync] = None):
+        self.guild_id = guild_id
+        self.tracker = tracker
+        self.writer = writer
+        self.actor = actor
+        # Cambios de otros nodos en modo sharded (None con un solo proceso)
+        self.sync = sync
+
+        self.role_ids = {role_name: settings.get(f'{role_name}_role_id', DEFAULT_ROLE_IDS.get(role_name))
+                         for role_name in ROLE_NAMES}
+        # Rol interno de cada ID de rol configurado (los roles sin ID se ignoran)
+        self.role_id_to_name = {role_id: role_name for role_name, role_id in self.role_ids.items() if role_id}
+        self.admin_bypass_role_id = settings.get('admin_bypass_role_id', DEFAULT_ADMIN_BYPASS_ROLE_ID)
+        self.notification_channels = settings.get('notification_channels', {})
+        self.milestone_channel_id = settings.get('milestone_channel_id', DEFAULT_MILESTONE_CHANNEL_ID)
+
+        # (rol interno, admin bypass) por id de miembro; se invalida con los eventos de miembros y roles
+        self.member_role_cache: Dict[int, Tuple[str, bool]] = {}
+        # Ids de usuarios del tracker agrupados por rol interno (ver rebuild_role_buckets)
+        self.role_buckets = {role_name: set() for role_name in ['recluta', *ROLE_NAMES]}
+        self.member_role_bucket: Dict[int, str] = {}  # id de usuario -> rol del bucket en que está
+        # Usuarios del tracker sin miembro en la caché al colocarlos; se resuelven en iter_role_bucket
+        self.unplaced: Set[int] = set()
+
+        # Despierta al planificador de milestones del servidor (ver bot.milestone_scheduler)
+        self.milestone_wakeup = asyncio.Event()
+        self.milestone_task: Optional[asyncio.Task] = None
+
+    def resolve_member_roles(self, member) -> Tuple[str, bool]:
+        """Rol interno más alto y admin bypass de un miembro (cacheado por id)"""
+        cached = self.member_role_cache.get(member.id)
+        if cached is not None:
+            return cached
+
+        # Discord ordena los roles por posición, donde mayor posición = mayor jerarquía
+        highest = None
+        is_admin_bypass = False
+        for role in member.roles:
+            if role.id == self.admin_bypass_role_id:
+                is_admin_bypass = True
+            if role.id in self.role_id_to_name and (highest is None or role.position > highest.position):
+                highest = role
+
+        cached = (self.role_id_to_name[highest.id] if highest else 'recluta', is_admin_bypass)
+        self.member_role_cache[member.id] = cached
+        return cached
+
+    def remove_from_role_bucket(self, user_id: int) -> None:
+        """Sacar a un usuario de su bucket de rol"""
+        self.unplaced.discard(user_id)
+        role_name = self.member_role_bucket.pop(user_id, None)
+        if role_name is not None:
+            self.role_buckets[role_name].discard(user_id)
+
+    def place_in_role_bucket(self, member) -> None:
+        """Colocar a un miembro registrado en el tracker en el bucket de su rol actual"""
+        self.remove_from_role_bucket(member.id)
+        if not self.tracker.is_loaded('users') or member.id not in self.tracker.data:
+            return
+        role_name = self.resolve_member_roles(member)[0]
+        self.role_buckets[role_name].add(member.id)
+        self.member_role_bucket[member.id] = role_name
+
+    def mark_unplaced(self, user_id: int) -> None:
+        """Dejar a un usuario del tracker sin miembro en la caché pendiente de colocar"""
+        self.remove_from_role_bucket(user_id)
+        if self.tracker.is_loaded('users') and user_id in self.tracker.data:
+            self.unplaced.add(user_id)
+
+    def rebuild_role_buckets(self, guild=None) -> None:
+        """Reconstruir los buckets por rol con los usuarios del tracker que están en el servidor"""
+        for bucket in self.role_buckets.values():
+            bucket.clear()
+        self.member_role_bucket.clear()
+        self.unplaced.clear()
+        if guild is None or not self.tracker.is_loaded('users'):
+            return
+        for user_id in list(self.tracker.data):
+            member = guild.get_member(user_id)
+            if member:
+                self.place_in_role_bucket(member)
+            else:
+                self.unplaced.add(user_id)
+
+    def iter_role_bucket(self, *role_names: str, guild=None) -> Iterator[int]:
+        """Ids de usuarios del tracker con alguno de los roles (descarta los que ya no están).
+
+        Antes se resuelven los pendientes de `unplaced` con la caché de
+        miembros de `guild`: los que tienen miembro se colocan y los demás se
+        descartan, porque no están en el servidor (on_member_join los vuelve a
+        colocar si regresan).
+        """
+        if guild is not None:
+            for user_id in tuple(self.unplaced):
+                member = guild.get_member(user_id)
+                if member:
+                    self.place_in_role_bucket(member)
+                else:
+                    self.unplaced.discard(user_id)
+
+        data = self.tracker.data
+        for role_name in role_names:
+            bucket = self.role_buckets[role_name]
+            for user_id in tuple(bucket):
+                if user_id not in data:
+                    self.remove_from_role_bucket(user_id)
+                    continue
+                yield user_id
+
+
+class GuildRegistry:
+    """Estados por servidor, creados al primer uso de cada servidor.
+
+    El servidor `primary_guild_id` conserva los archivos y la base de datos de
+    siempre; los demás guardan sus datos en `guilds_data_dir/<id>/`, en
+    `<sqlite_path>_<id>.db` o en el esquema `guild_<id>` de PostgreSQL. Si no
+    está definido y el bot está en un solo servidor, ese servidor pasa a ser el
+    principal y se recuerda en `guilds_data_dir/primary_guild_id`, para que un
+    reinicio no asocie los datos de siempre a otro servidor.
+
+    Con `cluster` (modo sharded) el almacenamiento debe ser compartido y el
+    servidor principal debe estar definido: cada proceso ve primero un servidor
+    distinto, y sin él los datos de siempre no se cargarían en ninguno.
+    """
+
+    def __init__(self, config: Dict[str, Any], cluster=None):
+        self.config = config
+        self.cluster = cluster
+        self.time_tracking = config.get('time_tracking', {})
+        self.primary_marker = os.path.join(self.time_tracking.get('guilds_data_dir', 'guilds'), 'primary_guild_id')
+        self.primary_guild_id = config.get('primary_guild_id') or self._read_primary_marker()
+        if cluster is not None and self.primary_guild_id is None:
+            raise RuntimeError("El modo sharded necesita primary_guild_id en config.json: el servidor dueño "
+                               "de los datos existentes (user_times.json, tracker.db o el esquema público)")
+        # Si ya se vieron los servidores al conectar (ver resolve_primary)
+        self.primary_resolved = self.primary_guild_id is not None or cluster is not None
+        self.states: Dict[int, GuildState] = {}
+
+    def _read_primary_marker(self) -> Optional[int]:
+        """Servidor principal elegido en un arranque anterior (None si no hay)"""
+        try:
+            with open(self.primary_marker, 'r', encoding='utf-8') as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            raise RuntimeError(f"{self.primary_marker} no contiene un id de servidor válido") from e
+
+    def _adopt_primary(self, guild_id: int) -> None:
+        """Fijar el servidor principal y recordarlo para los próximos arranques"""
+        os.makedirs(os.path.dirname(self.primary_marker) or '.', exist_ok=True)
+        with open(self.primary_marker, 'w', encoding='utf-8') as f:
+            f.write(f"{guild_id}\n")
+        self.primary_guild_id = guild_id
+        print(f"📌 Servidor principal: {guild_id} (guardado en {self.primary_marker})")
+
+    def resolve_primary(self, guild_ids: Iterable[int]) -> None:
+        """Elegir el servidor principal al conectar si no está definido.
+
+        Con un solo servidor se adopta ese; con varios la elección dependería
+        del orden en que llegan, así que se exige `primary_guild_id`.
+        """
+        if self.primary_resolved:
+            return
+        guild_ids = list(guild_ids)
+        if len(guild_ids) > 1:
+            raise RuntimeError("El bot está en varios servidores: define primary_guild_id en config.json "
+                               "con el servidor dueño de los datos existentes")
+        if guild_ids:
+            self._adopt_primary(guild_ids[0])
+        self.primary_resolved = True
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.states
+
+    def __iter__(self) -> Iterator[GuildState]:
+        return iter(list(self.states.values()))
+
+    def settings_for(self, guild_id: int) -> Dict[str, Any]:
+        """Configuración efectiva de un servidor (global + `guilds.<id>`)"""
+        settings = {key: value for key, value in self.config.items() if key != 'guilds'}
+        settings.update(self.config.get('guilds', {}).get(str(guild_id), {}))
+        return settings
+
+    def get(self, guild_id: int) -> GuildState:
+        """Estado de un servidor (se crea la primera vez)"""
+        state = self.states.get(guild_id)
+        if state is None:
+            state = self.states[guild_id] = self._create(guild_id)
+        return state
+
+    def _create(self, guild_id: int) -> GuildState:
+        """Crear el tracker, el escritor y el actor de un servidor"""
+        if not self.primary_resolved:
+            raise RuntimeError("El servidor principal se elige al conectar (ver resolve_primary)")
+        if self.primary_guild_id is None and self.cluster is None:
+            # Primer servidor del bot (se unió después de conectar sin ninguno)
+            self._adopt_primary(guild_id)
+        primary = guild_id == self.primary_guild_id
+        time_tracking = self.time_tracking
+
+        if primary:
+            directory = ''
+            archive_dir = time_tracking.get('archive_dir', 'archive')
+        else:
+            directory = os.path.join(time_tracking.get('guilds_data_dir', 'guilds'), str(guild_id))
+            os.makedirs(directory, exist_ok=True)
+            archive_dir = os.path.join(directory, 'archive')
+
+        data_file = os.path.join(directory, 'user_times.json')
+        tracker = time_tracker.TimeTracker(
+            data_file,
+            write_behind=time_tracking.get('write_behind', False),
+            max_dirty=time_tracking.get('write_behind_max_dirty', 200),
+            storage=storage.create_storage(
+                self.config.get('storage', {}),
+                data_file,
+                os.path.join(directory, 'attendance_data.json'),
+                os.path.join(directory, 'saved_credits.json'),
+                backup_generations=time_tracking.get('backup_generations', 3),
+                namespace=None if primary else f"guild_{guild_id}",
+                origin=self.cluster.node_id if self.cluster else None
+            ),
+            archive=archive.SessionArchive(archive_dir)
+        )
+
+        sync = None
+        if self.cluster is not None:
+            if not tracker.storage.shared:
+                raise RuntimeError("El modo sharded necesita un almacenamiento compartido (backend sqlite o postgres)")
+            # Antes de cargar los datos: los cambios hechos durante la carga no se pierden
+            sync = StoreSync(tracker)
+            # Al apagar, liberar los leases para que otro nodo tome las tareas sin esperar
+            atexit.register(self.cluster.release, tracker.storage)
+
+        # Las escrituras salen del event loop por el hilo escritor del servidor
+        writer = TrackerWriter(tracker, name=f"tracker-writer-{guild_id}")
+        tracker.flush_requested = writer.request_flush
+        # Terminar las escrituras encoladas y guardar lo pendiente al apagar el bot
+        atexit.register(writer.close)
+
+        # Las mutaciones que llegan juntas se escriben en un solo commit
+        actor = TrackerActor(tracker, writer, window=time_tracking.get('group_commit_ms', 5) / 1000)
+        return GuildState(guild_id, self.settings_for(guild_id), tracker, writer, actor, sync)
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Límites de un mensaje de Discord
+MAX_CONTENT_LENGTH = 2000
+MAX_EMBEDS = 10
+MAX_EMBED_TOTAL_LENGTH = 6000
+
+
+class TokenBucket:
+    """Token bucket asyncio: `capacity` envíos seguidos y `rate` tokens nuevos por segundo"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Esperar hasta tener un token y consumirlo"""
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+
+def embed_length(embed) -> int:
+    """Caracteres de un embed que cuentan para el límite total de un mensaje"""
+    return len(embed) if hasattr(embed, '__len__') else 0
+
+
+def split_content(content: str, limit: int = MAX_CONTENT_LENGTH) -> List[str]:
+    """Partir un texto largo por líneas (o a la fuerza si una línea no cabe)"""
+    if len(content) <= limit:
+        return [content]
+    chunks, current = [], ""
+    for line in content.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class NotificationOutbox:
+    """Bandeja de salida de notificaciones a canales de Discord.
+
+    `post` encola y vuelve enseguida: los comandos no esperan al envío. Cada
+    canal tiene su cola y una tarea que la vacía respetando el límite de
+    Discord por canal (5 mensajes cada 5 segundos) y un límite global. Lo que
+    se acumula mientras se espera un token se agrupa en el menor número de
+    mensajes posible: textos unidos por saltos de línea hasta 2000 caracteres
+    y hasta 10 embeds por mensaje, siempre en el orden en que se encolaron.
+    Antes del primer envío de cada ráfaga se espera `linger` segundos para
+    juntar los avisos que llegan casi a la vez.
+    """
+
+    def __init__(self, get_channel: Callable[[int], Any], channel_burst: int = 5,
+                 channel_rate: float = 1.0, global_burst: int = 50, global_rate: float = 50.0,
+                 linger: float = 0.1):
+        self.get_channel = get_channel
+        self.linger = linger
+        self.channel_burst = channel_burst
+        self.channel_rate = channel_rate
+        self.global_bucket = TokenBucket(global_burst, global_rate)
+        self._queues: Dict[int, Deque[Tuple[Optional[str], Any]]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # Estadísticas: notificaciones encoladas y mensajes enviados
+        self.posted = 0
+        self.sent = 0
+
+    def post(self, channel_id: Optional[int], content: Optional[str] = None, embed: Any = None) -> None:
+        """Encolar un texto y/o un embed para un canal (sin esperar al envío)"""
+        if not channel_id or (content is None and embed is None):
+            return
+        channel_queue = self._queues.setdefault(channel_id, deque())
+        if content is not None:
+            for chunk in split_content(content):
+                channel_queue.append((chunk, None))
+        if embed is not None:
+            channel_queue.append((None, embed))
+        self.posted += 1
+
+        worker = self._workers.get(channel_id)
+        if worker is None or worker.done():
+            self._workers[channel_id] = asyncio.get_running_loop().create_task(
+                self._run(channel_id), name=f"outbox-{channel_id}")
+
+    def _take_message(self, channel_queue: Deque[Tuple[Optional[str], Any]]) -> Tuple[Optional[str], List[Any]]:
+        """Sacar de la cola lo que cabe en un solo mensaje, sin alterar el orden"""
+        lines, embeds = [], []
+        length = embeds_length = 0
+        while channel_queue:
+            content, embed = channel_queue[0]
+            if content is not None:
+                # El texto va antes que los embeds del mensaje: no puede seguir a uno
+                added = len(content) + (1 if lines else 0)
+                if embeds or length + added > MAX_CONTENT_LENGTH:
+                    break
+                lines.append(content)
+                length += added
+            else:
+                size = embed_length(embed)
+                if len(embeds) >= MAX_EMBEDS or (embeds and embeds_length + size > MAX_EMBED_TOTAL_LENGTH):
+                    break
+                embeds.append(embed)
+                embeds_length += size
+            channel_queue.popleft()
+        return ("\n".join(lines) if lines else None), embeds
+
+    async def _run(self, channel_id: int) -> None:
+        """Tarea de un canal: esperar turno, agrupar lo encolado y enviarlo"""
+        channel_queue = self._queues[channel_id]
+        bucket = self._buckets.setdefault(channel_id, TokenBucket(self.channel_burst, self.channel_rate))
+        await asyncio.sleep(self.linger)
+        while channel_queue:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            content, embeds = self._take_message(channel_queue)
+            channel = self.get_channel(channel_id)
+            if channel is None:
+                print(f"Canal de notificaciones {channel_id} no encontrado; se descartan sus avisos pendientes")
+                channel_queue.clear()
+                return
+            try:
+                if embeds:
+                    await channel.send(content=content, embeds=embeds)
+                else:
+                    await channel.send(content=content)
+                self.sent += 1
+            except Exception as e:
+                print(f"Error enviando notificación al canal {channel_id}: {e}")
+
+    async def drain(self) -> None:
+        """Esperar a que se envíe todo lo encolado hasta ahora"""
+        workers = [worker for worker in self._workers.values() if not worker.done()]
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,64 @@
+import heapq
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+class RankingIndex:
+    """Índice incremental de los valores más altos (tiempo total, créditos...).
+
+    Mantiene un heap de máximos con borrado perezoso: cada cambio de valor
+    añade una entrada nueva y las antiguas se descartan al encontrarlas (una
+    entrada solo es válida si coincide con `values`). Así actualizar un valor
+    cuesta O(log n) y consultar el top N cuesta O(N log n) sin recorrer ni
+    ordenar a todos los usuarios.
+    """
+
+    def __init__(self):
+        self.values: Dict[Hashable, float] = {}
+        self._heap: List[Tuple[float, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def update(self, key: Hashable, value: float) -> None:
+        """Registrar el valor actual de una clave (los valores <= 0 no se clasifican)"""
+        if value <= 0:
+            self.discard(key)
+            return
+        if self.values.get(key) == value:
+            return
+        self.values[key] = value
+        heapq.heappush(self._heap, (-value, key))
+        self._compact()
+
+    def discard(self, key: Hashable) -> None:
+        """Quitar una clave del índice"""
+        if self.values.pop(key, None) is not None:
+            self._compact()
+
+    def rebuild(self, items: Iterable[Tuple[Hashable, float]]) -> None:
+        """Reconstruir el índice completo desde pares (clave, valor)"""
+        self.values = {key: value for key, value in items if value > 0}
+        self._heap = [(-value, key) for key, value in self.values.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, limit: int) -> List[Tuple[Hashable, float]]:
+        """Las `limit` claves con mayor valor, de mayor a menor"""
+        heap = self._heap
+        result = []
+        # Una clave que vuelve a un valor anterior tiene varias entradas iguales
+        # y vigentes en el heap: solo cuenta la primera
+        seen = set()
+        while heap and len(result) < limit:
+            negative, key = heapq.heappop(heap)
+            if key not in seen and self.values.get(key) == -negative:
+                seen.add(key)
+                result.append((key, -negative))
+        # Devolver las entradas vigentes; las obsoletas quedan descartadas
+        for key, value in result:
+            heapq.heappush(heap, (-value, key))
+        return result
+
+    def _compact(self) -> None:
+        """Rehacer el heap cuando las entradas obsoletas superan a las vigentes"""
+        if len(self._heap) > 2 * len(self.values) + 64:
+            self.rebuild(self.values.items())
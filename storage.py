@@ -0,0 +1,995 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+import codec
+
+try:
+    import psycopg2
+    from psycopg2 import pool as psycopg2_pool
+    from psycopg2.extras import execute_values
+except ImportError:
+    psycopg2 = None
+
+# Nombres de los almacenes que maneja TimeTracker
+STORES = ('users', 'attendance', 'credits')
+
+# Segundos que se conservan las entradas del registro de cambios compartido
+CHANGE_LOG_SECONDS = 3600
+
+
+def atomic_write_json(path: str, document: Any, indent: Optional[int] = None,
+                      compress: bool = False) -> None:
+    """Escribir un documento JSON de forma atómica y durable.
+
+    Se escribe a un archivo temporal en el mismo directorio, se hace fsync y se
+    reemplaza el archivo final con os.replace: un corte a mitad de escritura deja
+    intacta la versión anterior en lugar de un archivo truncado. Con `compress`
+    el archivo se escribe comprimido con gzip.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if indent is None:
+                payload = codec.dumps_bytes(document)
+            else:
+                payload = json.dumps(document, indent=indent, ensure_ascii=False).encode('utf-8')
+            if compress:
+                payload = gzip.compress(payload)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # Persistir también la entrada del directorio (no disponible en todas las plataformas)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+def rotate_backups(path: str, generations: int) -> None:
+    """Desplazar las generaciones de backup para dejar libre `.backup.1`"""
+    for i in range(generations - 1, 0, -1):
+        older = f"{path}.backup.{i}"
+        if os.path.exists(older):
+            os.replace(older, f"{path}.backup.{i + 1}")
+
+
+def backup_file(path: str, generations: int) -> None:
+    """Generar una nueva generación de backup (`.backup.1` es la más reciente)"""
+    if not os.path.exists(path) or generations < 1:
+        return
+
+    rotate_backups(path, generations)
+    temp_path = f"{path}.backup.tmp"
+    shutil.copy2(path, temp_path)
+    os.replace(temp_path, f"{path}.backup.1")
+
+
+def load_json_file(path: str, generations: int = 3) -> Dict[str, Any]:
+    """Cargar un documento JSON, recurriendo a los backups si el archivo está dañado"""
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        return codec.load_file(path)
+    except Exception as e:
+        print(f"Error cargando {path}: {e}")
+
+    # Backups programados y el backup antiguo de un solo archivo
+    fallbacks = [f"{path}.backup.{i}" for i in range(1, generations + 1)] + [f"{path}.backup"]
+    for backup_path in fallbacks:
+        if not os.path.exists(backup_path):
+            continue
+        try:
+            document = codec.load_file(backup_path)
+            print(f"Datos recuperados desde {backup_path}")
+            return document
+        except Exception as e:
+            print(f"Error cargando backup {backup_path}: {e}")
+
+    return {}
+
+
+class Journal:
+    """Registro append-only de mutaciones (write-ahead log) para un archivo JSON.
+
+    Cada commit se agrega como una sola línea JSON al archivo `<archivo>.wal`
+    en lugar de reescribir el documento completo. Al iniciar se reproduce el
+    registro sobre el snapshot, y cada cierto número de entradas se compacta
+    (se reescribe el snapshot y se vacía el registro). Las entradas indican el
+    almacén al que pertenecen (`store`); sin él se asume `users`. Un commit con
+    varias entradas se escribe como una entrada `tx`: una línea truncada por un
+    corte se descarta completa, así que nunca se reproduce un commit a medias.
+    """
+
+    def __init__(self, snapshot_file: str, compact_every: int = 500):
+        self.snapshot_file = snapshot_file
+        self.journal_file = f"{snapshot_file}.wal"
+        self.compact_every = compact_every
+        self.pending_entries = 0
+
+    def replay(self, documents: Dict[str, Dict[str, Any]]) -> int:
+        """Aplicar las entradas del registro sobre los documentos cargados"""
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        applied = 0
+        # Fin de la última línea completa; lo que sigue es una escritura cortada
+        valid_end = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                stripped = line.strip()
+                if stripped:
+                    try:
+                        entry = codec.loads(stripped)
+                    except (codec.JSONDecodeError, UnicodeDecodeError):
+                        # Línea incompleta por un corte durante la escritura: se ignora el resto
+                        break
+                    entries = entry['entries'] if entry.get('op') == 'tx' else [entry]
+                    for item in entries:
+                        document = documents.get(item.get('store', 'users'))
+                        if document is not None:
+                            self.apply(document, item)
+                    applied += len(entries)
+                valid_end += len(line)
+
+        if valid_end != os.path.getsize(self.journal_file):
+            # Quitar la cola cortada: si no, el siguiente append quedaría pegado a
+            # ella y todo lo registrado después se perdería en la próxima carga
+            print(f"Registro {self.journal_file} truncado, se descartan entradas incompletas")
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(valid_end)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.pending_entries = applied
+        return applied
+
+    @staticmethod
+    def apply(document: Dict[str, Any], entry: Dict[str, Any]) -> None:
+        """Aplicar una entrada del registro al documento"""
+        op = entry.get('op')
+        if op == 'set':
+            document[entry['id']] = entry['data']
+        elif op == 'del':
+            document.pop(entry['id'], None)
+        elif op == 'replace':
+            document.clear()
+            document.update(entry['data'])
+        elif op == 'clear':
+            document.clear()
+        elif op == 'reset_daily':
+            # Reset diario de todos los usuarios (ver TimeTracker.reset_daily_times)
+            for record in document.values():
+                record.setdefault('daily_times', {})[entry['date']] = 0
+                record.pop('milestone_1h_completed', None)
+                record.pop('milestone_2h_completed', None)
+
+    def append(self, entries: List[Dict[str, Any]]) -> None:
+        """Agregar las entradas de un commit al registro con una sola escritura"""
+        if not entries:
+            return
+        entry = entries[0] if len(entries) == 1 else {'op': 'tx', 'entries': entries}
+        payload = codec.dumps_bytes(entry) + b"\n"
+        with open(self.journal_file, 'ab+') as f:
+            # Empezar siempre en una línea nueva aunque el registro acabe en una escritura cortada
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    payload = b"\n" + payload
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending_entries += len(entries)
+
+    def needs_compaction(self) -> bool:
+        """Verificar si el registro creció lo suficiente para compactarlo"""
+        return self.pending_entries >= self.compact_every
+
+    def reset(self) -> None:
+        """Vaciar el registro (llamar solo después de escribir el snapshot)"""
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.pending_entries = 0
+
+
+class JsonStorage:
+    """Almacenamiento en archivos JSON: un snapshot por almacén y un registro compartido.
+
+    Las mutaciones de registros individuales se agregan al registro de
+    mutaciones; los reemplazos completos y la compactación reescriben los
+    snapshots con escrituras atómicas. Las cargas (perezosas, desde el event
+    loop) y las escrituras (desde el hilo escritor) se serializan con `lock`:
+    una carga nunca lee un snapshot viejo con un registro ya vaciado.
+    """
+
+    # Los archivos son locales al proceso: sin leases ni registro de cambios (ver SqliteStorage)
+    shared = False
+
+    def __init__(self, data_file: str = "user_times.json",
+                 attendance_file: str = "attendance_data.json",
+                 credits_file: str = "saved_credits.json",
+                 compact_every: int = 500, backup_generations: int = 3):
+        self.files = {
+            'users': data_file,
+            'attendance': attendance_file,
+            'credits': credits_file
+        }
+        self.backup_generations = backup_generations
+        self.journal = Journal(data_file, compact_every)
+        # Snapshots y registro se leen y escriben desde hilos distintos
+        self.lock = threading.RLock()
+
+    def load(self, stores: Iterable[str] = STORES) -> Dict[str, Dict[str, Any]]:
+        """Cargar los almacenes indicados y reproducir sus entradas del registro de mutaciones"""
+        with self.lock:
+            documents = {
+                store: load_json_file(self.files[store], self.backup_generations)
+                for store in stores
+            }
+            try:
+                self.journal.replay(documents)
+            except Exception as e:
+                print(f"Error reproduciendo registro de mutaciones: {e}")
+            return documents
+
+    def needs_compaction(self) -> bool:
+        """Verificar si conviene reescribir los snapshots"""
+        return self.journal.needs_compaction()
+
+    def commit(self, changes: Dict[str, Iterable[str]], documents: Dict[str, Dict[str, Any]],
+               replace: Iterable[str] = (), complete: bool = True,
+               updates: Iterable[Dict[str, Any]] = ()) -> None:
+        """Persistir los registros modificados (`changes`) y los almacenes a reemplazar.
+
+        `complete` indica si `documents` contiene los almacenes completos; si solo
+        trae los registros modificados no se compacta en esta llamada. `updates`
+        son operaciones sobre todo un almacén (ver Journal.apply) que se aplican
+        antes que los registros modificados.
+        """
+        replace = set(replace)
+        entries = []
+        # Los almacenes reemplazados van completos en la misma línea que el resto
+        # del commit; así un corte durante la compactación posterior no pierde nada
+        for store in replace:
+            entries.append({'op': 'replace', 'store': store, 'data': documents[store]})
+        entries.extend(update for update in updates if update['store'] not in replace)
+
+        for store, ids in changes.items():
+            if store in replace:
+                continue
+            document = documents[store]
+            for record_id in ids:
+                if record_id in document:
+                    entries.append({'op': 'set', 'store': store, 'id': record_id, 'data': document[record_id]})
+                else:
+                    entries.append({'op': 'del', 'store': store, 'id': record_id})
+
+        if not entries:
+            return
+
+        with self.lock:
+            try:
+                self.journal.append(entries)
+            except Exception as e:
+                print(f"Error escribiendo registro de mutaciones: {e}")
+                if not complete:
+                    raise
+                # Sin registro no hay durabilidad: volver a la reescritura completa
+                self.compact(documents)
+                return
+
+            if complete and (replace or self.journal.needs_compaction()):
+                self.compact(documents)
+
+    def compact(self, documents: Dict[str, Dict[str, Any]]) -> None:
+        """Reescribir los snapshots y vaciar el registro de mutaciones.
+
+        Los almacenes que no vienen en `documents` (no cargados en memoria) se
+        leen del disco solo para esta reescritura.
+        """
+        with self.lock:
+            missing = [store for store in self.files if store not in documents]
+            if missing:
+                documents = {**documents, **self.load(missing)}
+
+            for store, path in self.files.items():
+                atomic_write_json(path, documents[store])
+
+            # Los snapshots ya contienen todas las mutaciones registradas
+            self.journal.reset()
+
+    def backup(self, documents: Dict[str, Dict[str, Any]]) -> None:
+        """Crear una generación de backup de los snapshots"""
+        with self.lock:
+            # Asegurar que los snapshots en disco estén completos antes de copiarlos
+            if self.journal.pending_entries:
+                self.compact(documents)
+
+            for path in self.files.values():
+                try:
+                    backup_file(path, self.backup_generations)
+                except Exception as e:
+                    print(f"Error creando backup de {path}: {e}")
+
+    def close(self) -> None:
+        """Sin recursos abiertos en el almacenamiento JSON"""
+
+
+# Tabla principal, columnas indexables, tabla diaria, columna de valor diario y
+# clave del mapa diario de cada almacén en los backends SQL
+SQL_LAYOUT = {
+    'users': ('users', ('name', 'status', 'total_time'), 'user_daily_times', 'seconds', 'daily_times'),
+    'attendance': ('attendance', ('name', 'total_attendance'), 'attendance_daily', 'count', 'daily_attendance'),
+    'credits': ('credits', ('total_credits',), 'credits_daily', 'credits', 'daily_credits_history')
+}
+
+
+def user_status(record: Dict[str, Any]) -> str:
+    """Estado indexado de un usuario"""
+    if record.get('is_active', False):
+        return 'active'
+    if record.get('is_paused', False):
+        return 'paused'
+    if record.get('is_pre_registered', False):
+        return 'pre_registered'
+    return 'inactive'
+
+
+def sql_rows(store: str, record_id: str, record: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+    """Separar un registro en su fila principal y sus filas diarias"""
+    columns, daily_key = SQL_LAYOUT[store][1], SQL_LAYOUT[store][4]
+    user_id = int(record_id)
+    values = []
+    for column in columns:
+        if column == 'status':
+            values.append(user_status(record))
+        elif column == 'name':
+            values.append(record.get('name'))
+        else:
+            values.append(record.get(column, 0))
+
+    # El mapa diario va en su propia tabla; en `data` solo queda vacío si existía
+    daily = record.get(daily_key) or {}
+    data = codec.dumps({k: ({} if k == daily_key else v) for k, v in record.items()})
+    return (user_id, *values, data), [(user_id, date, value) for date, value in daily.items()]
+
+
+def sql_changed_rows(store: str, ids: Iterable[str], document: Dict[str, Any]) -> Tuple[List[tuple], List[tuple], List[int], List[int]]:
+    """Filas a escribir, filas diarias, ids a reemplazar e ids a eliminar de un almacén"""
+    rows, daily_rows, touched, deleted = [], [], [], []
+    for record_id in ids:
+        touched.append(int(record_id))
+        if record_id in document:
+            row, daily = sql_rows(store, record_id, document[record_id])
+            rows.append(row)
+            daily_rows.extend(daily)
+        else:
+            deleted.append(int(record_id))
+    return rows, daily_rows, touched, deleted
+
+
+def sql_change_rows(origin: str, changes: Dict[str, Iterable[str]], replace: Iterable[str],
+                    now: float) -> List[tuple]:
+    """Filas del registro de cambios de un commit (user_id NULL = almacén completo)"""
+    replace = set(replace)
+    rows = [(origin, store, None, now) for store in replace]
+    for store, ids in changes.items():
+        if store not in replace:
+            rows.extend((origin, store, int(record_id), now) for record_id in ids)
+    return rows
+
+
+def sql_changes(origin: Optional[str], version: int, oldest: Optional[int],
+                rows: Iterable[tuple]) -> Tuple[int, Dict[str, Optional[set]]]:
+    """Agrupar las filas del registro de cambios de otros nodos por almacén.
+
+    Devuelve la última versión vista y, por almacén, los ids cambiados o None
+    si hay que recargarlo completo (reemplazo, o entradas ya podadas del
+    registro desde `version`).
+    """
+    if version and oldest is not None and oldest > version + 1:
+        return max(version, oldest), {store: None for store in STORES}
+
+    changed: Dict[str, Optional[set]] = {}
+    for row_version, row_origin, store, user_id in rows:
+        version = max(version, row_version)
+        if row_origin == origin or store not in STORES:
+            continue
+        if user_id is None:
+            changed[store] = None
+        elif store not in changed or changed[store] is not None:
+            changed.setdefault(store, set()).add(str(user_id))
+    return version, changed
+
+
+def sql_documents(store: str, main_rows: Iterable[tuple], daily_rows: Iterable[tuple]) -> Dict[str, Any]:
+    """Reconstruir el documento de un almacén a partir de sus filas"""
+    daily_key = SQL_LAYOUT[store][4]
+    document = {}
+    for user_id, data in main_rows:
+        document[str(user_id)] = codec.loads(data) if isinstance(data, str) else dict(data)
+    for user_id, date, value in daily_rows:
+        record = document.get(str(user_id))
+        if record is not None:
+            record.setdefault(daily_key, {})[date] = value
+    return document
+
+
+class SqliteStorage:
+    """Almacenamiento en SQLite (modo WAL) con una fila por usuario.
+
+    Los campos consultables (estado, tiempo total, créditos) y los mapas
+    diarios viven en columnas/tablas indexadas; el resto del registro se guarda
+    como JSON en la columna `data`. Cada commit es una transacción que solo
+    toca las filas de los registros modificados.
+
+    Varios procesos de la misma máquina pueden compartir la base: con `origin`
+    (el id del nodo) cada commit se anota en la tabla `changes` para que los
+    demás nodos recarguen esos registros (ver cluster.StoreSync), y la tabla
+    `leases` reparte las tareas que deben ejecutarse una sola vez.
+    """
+
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT,
+            status TEXT NOT NULL,
+            total_time REAL NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_status ON users(status);
+        CREATE TABLE IF NOT EXISTS user_daily_times (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_daily_times_date ON user_daily_times(date);
+        CREATE TABLE IF NOT EXISTS attendance (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT,
+            total_attendance INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_attendance_daily_date ON attendance_daily(date);
+        CREATE TABLE IF NOT EXISTS credits (
+            user_id INTEGER PRIMARY KEY,
+            total_credits REAL NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS credits_daily (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            credits REAL NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_credits_daily_date ON credits_daily(date);
+        CREATE TABLE IF NOT EXISTS changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            store TEXT NOT NULL,
+            user_id INTEGER,
+            changed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON changes(changed_at);
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    """
+
+    # Sentencias por conjunto de cada operación sobre todo un almacén (ver Journal.apply)
+    UPDATES = {
+        'reset_daily': (
+            "UPDATE users SET data = json_remove(data, '$.milestone_1h_completed', '$.milestone_2h_completed') "
+            "WHERE json_type(data, '$.milestone_1h_completed') IS NOT NULL "
+            "OR json_type(data, '$.milestone_2h_completed') IS NOT NULL",
+            "INSERT INTO user_daily_times (user_id, date, seconds) SELECT user_id, :date, 0 FROM users WHERE true "
+            "ON CONFLICT(user_id, date) DO UPDATE SET seconds = 0 WHERE seconds <> 0"
+        )
+    }
+
+    def __init__(self, path: str = "tracker.db", backup_generations: int = 3,
+                 import_from: Optional[JsonStorage] = None, origin: Optional[str] = None):
+        self.path = path
+        self.backup_generations = backup_generations
+        self.import_from = import_from
+        # Nodo que escribe; None si ningún otro proceso comparte la base
+        self.origin = origin
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+
+    def load(self, stores: Iterable[str] = STORES) -> Dict[str, Dict[str, Any]]:
+        """Cargar los almacenes indicados (importando los JSON existentes si la base está vacía)"""
+        with self.lock:
+            empty = all(
+                self.conn.execute(f"SELECT 1 FROM {SQL_LAYOUT[store][0]} LIMIT 1").fetchone() is None
+                for store in STORES
+            )
+        # Solo la primera carga importa los JSON: una recarga posterior (p. ej. por
+        # cambios de otro nodo) no debe resucitar datos antiguos
+        import_from, self.import_from = self.import_from, None
+        if empty and import_from is not None:
+            documents = import_from.load()
+            if any(documents.values()):
+                print(f"Importando datos JSON existentes a {self.path}")
+                self.commit({}, documents, replace=STORES)
+                return {store: documents[store] for store in stores}
+
+        documents = {}
+        with self.lock:
+            for store in stores:
+                table, _, daily_table, value_column, _ = SQL_LAYOUT[store]
+                documents[store] = sql_documents(
+                    store,
+                    self.conn.execute(f"SELECT user_id, data FROM {table}"),
+                    self.conn.execute(f"SELECT user_id, date, {value_column} FROM {daily_table}")
+                )
+        return documents
+
+    def needs_compaction(self) -> bool:
+        """SQLite no necesita compactación explícita"""
+        return False
+
+    def _write_rows(self, store: str, rows: List[tuple], daily_rows: List[tuple]) -> None:
+        """Insertar o actualizar filas principales y diarias de un almacén"""
+        table, columns, daily_table, value_column, _ = SQL_LAYOUT[store]
+        if rows:
+            placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+            updates = ", ".join(f"{column} = excluded.{column}" for column in columns + ('data',))
+            self.conn.executemany(
+                f"INSERT INTO {table} (user_id, {', '.join(columns)}, data) VALUES ({placeholders}) "
+                f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+                rows
+            )
+        if daily_rows:
+            self.conn.executemany(
+                f"INSERT INTO {daily_table} (user_id, date, {value_column}) VALUES (?, ?, ?)",
+                daily_rows
+            )
+
+    def commit(self, changes: Dict[str, Iterable[str]], documents: Dict[str, Dict[str, Any]],
+               replace: Iterable[str] = (), complete: bool = True,
+               updates: Iterable[Dict[str, Any]] = ()) -> None:
+        """Persistir los cambios en una sola transacción"""
+        replace = set(replace)
+        updates = [update for update in updates if update['store'] not in replace]
+        with self.lock:
+            try:
+                for store in replace:
+                    table, _, daily_table, _, _ = SQL_LAYOUT[store]
+                    self.conn.execute(f"DELETE FROM {table}")
+                    self.conn.execute(f"DELETE FROM {daily_table}")
+                    rows, daily_rows, _, _ = sql_changed_rows(store, documents[store].keys(), documents[store])
+                    self._write_rows(store, rows, daily_rows)
+
+                # Las operaciones por conjunto van antes que los registros modificados
+                for update in updates:
+                    for statement in self.UPDATES[update['op']]:
+                        self.conn.execute(statement, update)
+
+                for store, ids in changes.items():
+                    if store in replace:
+                        continue
+                    table, _, daily_table, _, _ = SQL_LAYOUT[store]
+                    rows, daily_rows, touched, deleted = sql_changed_rows(store, ids, documents[store])
+                    # Los mapas diarios de los registros tocados se reescriben completos
+                    self.conn.executemany(f"DELETE FROM {daily_table} WHERE user_id = ?",
+                                          [(user_id,) for user_id in touched])
+                    self.conn.executemany(f"DELETE FROM {table} WHERE user_id = ?",
+                                          [(user_id,) for user_id in deleted])
+                    self._write_rows(store, rows, daily_rows)
+
+                if self.origin is not None:
+                    now = time.time()
+                    self.conn.executemany(
+                        "INSERT INTO changes (origin, store, user_id, changed_at) VALUES (?, ?, ?, ?)",
+                        sql_change_rows(self.origin, changes, replace | {update['store'] for update in updates}, now)
+                    )
+                    self.conn.execute("DELETE FROM changes WHERE changed_at < ?", (now - CHANGE_LOG_SECONDS,))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def load_records(self, store: str, record_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Leer registros concretos de un almacén (None para los que ya no existen)"""
+        table, _, daily_table, value_column, _ = SQL_LAYOUT[store]
+        record_ids = list(record_ids)
+        document = {}
+        with self.lock:
+            # De 500 en 500 para no pasar el límite de parámetros de SQLite
+            for start in range(0, len(record_ids), 500):
+                chunk = [int(record_id) for record_id in record_ids[start:start + 500]]
+                placeholders = ", ".join("?" for _ in chunk)
+                document.update(sql_documents(
+                    store,
+                    self.conn.execute(f"SELECT user_id, data FROM {table} WHERE user_id IN ({placeholders})", chunk),
+                    self.conn.execute(f"SELECT user_id, date, {value_column} FROM {daily_table} "
+                                      f"WHERE user_id IN ({placeholders})", chunk)
+                ))
+        return {record_id: document.get(record_id) for record_id in record_ids}
+
+    def latest_change(self) -> int:
+        """Versión del último cambio anotado en el registro compartido"""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, version: int) -> Tuple[int, Dict[str, Optional[set]]]:
+        """Cambios de otros nodos posteriores a `version` (ver sql_changes)"""
+        with self.lock:
+            oldest = self.conn.execute("SELECT MIN(version) FROM changes").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT version, origin, store, user_id FROM changes WHERE version > ? ORDER BY version",
+                (version,)
+            ).fetchall()
+        return sql_changes(self.origin, version, oldest, rows)
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """Tomar o renovar el lease `name` por `seconds`; False si otro nodo lo tiene vigente"""
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at <= ?",
+                (name, holder, now + seconds, now)
+            )
+            self.conn.commit()
+            return cursor.rowcount == 1
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Liberar un lease si todavía es de `holder`"""
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+            self.conn.commit()
+
+    def backup(self, documents: Dict[str, Dict[str, Any]]) -> None:
+        """Crear una generación de backup consistente de la base de datos"""
+        rotate_backups(self.path, self.backup_generations)
+
+        temp_path = f"{self.path}.backup.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with self.lock:
+            target = sqlite3.connect(temp_path)
+            try:
+                self.conn.backup(target)
+            finally:
+                target.close()
+        os.replace(temp_path, f"{self.path}.backup.1")
+
+    def close(self) -> None:
+        """Cerrar la conexión a la base de datos"""
+        with self.lock:
+            self.conn.close()
+
+
+class PostgresStorage:
+    """Almacenamiento compartido en PostgreSQL con un pool de conexiones acotado.
+
+    Usa el mismo esquema que SqliteStorage (con `data` en JSONB). Cada commit es
+    una transacción con sentencias por conjunto: un INSERT ... ON CONFLICT con
+    todas las filas modificadas de cada almacén y un DELETE ... = ANY(...) para
+    las filas diarias o eliminadas, sin importar cuántos registros cambiaron.
+    Los métodos son bloqueantes: desde asyncio deben llamarse en un executor.
+    Con `schema` las tablas se crean en ese esquema (uno por servidor de
+    Discord), fijado como search_path de todas las conexiones del pool.
+    Como SqliteStorage, con `origin` anota cada commit en `changes` y reparte
+    tareas con `leases`, en este caso entre procesos de varias máquinas; los
+    leases usan el reloj del servidor de PostgreSQL.
+    """
+
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            name TEXT,
+            status TEXT NOT NULL,
+            total_time DOUBLE PRECISION NOT NULL DEFAULT 0,
+            data JSONB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_status ON users(status);
+        CREATE TABLE IF NOT EXISTS user_daily_times (
+            user_id BIGINT NOT NULL,
+            date TEXT NOT NULL,
+            seconds DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_daily_times_date ON user_daily_times(date);
+        CREATE TABLE IF NOT EXISTS attendance (
+            user_id BIGINT PRIMARY KEY,
+            name TEXT,
+            total_attendance INTEGER NOT NULL DEFAULT 0,
+            data JSONB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            user_id BIGINT NOT NULL,
+            date TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_attendance_daily_date ON attendance_daily(date);
+        CREATE TABLE IF NOT EXISTS credits (
+            user_id BIGINT PRIMARY KEY,
+            total_credits DOUBLE PRECISION NOT NULL DEFAULT 0,
+            data JSONB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS credits_daily (
+            user_id BIGINT NOT NULL,
+            date TEXT NOT NULL,
+            credits DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_credits_daily_date ON credits_daily(date);
+        CREATE TABLE IF NOT EXISTS changes (
+            version BIGSERIAL PRIMARY KEY,
+            origin TEXT NOT NULL,
+            store TEXT NOT NULL,
+            user_id BIGINT,
+            changed_at DOUBLE PRECISION NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON changes(changed_at);
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        );
+    """
+
+    # Sentencias por conjunto de cada operación sobre todo un almacén (ver Journal.apply)
+    UPDATES = {
+        'reset_daily': (
+            "UPDATE users SET data = data - 'milestone_1h_completed' - 'milestone_2h_completed' "
+            "WHERE data ?| ARRAY['milestone_1h_completed', 'milestone_2h_completed']",
+            "INSERT INTO user_daily_times (user_id, date, seconds) SELECT user_id, %(date)s, 0 FROM users "
+            "ON CONFLICT (user_id, date) DO UPDATE SET seconds = 0 WHERE user_daily_times.seconds <> 0"
+        )
+    }
+
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = 5,
+                 import_from: Optional[JsonStorage] = None, schema: Optional[str] = None,
+                 origin: Optional[str] = None):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 no está instalado (pip install psycopg2-binary)")
+        self.import_from = import_from
+        # Nodo que escribe; None si ningún otro proceso comparte la base
+        self.origin = origin
+        if schema:
+            # Crear el esquema antes de abrir el pool que lo usa como search_path
+            conn = psycopg2.connect(dsn)
+            try:
+                with conn, conn.cursor() as cur:
+                    cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+            finally:
+                conn.close()
+            self.pool = psycopg2_pool.ThreadedConnectionPool(min_connections, max_connections, dsn,
+                                                             options=f"-c search_path={schema}")
+        else:
+            self.pool = psycopg2_pool.ThreadedConnectionPool(min_connections, max_connections, dsn)
+        # El pool lanza error al agotarse; el semáforo hace esperar en su lugar
+        self.slots = threading.BoundedSemaphore(max_connections)
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.SCHEMA)
+
+    @contextmanager
+    def connection(self):
+        """Tomar una conexión del pool dentro de una transacción"""
+        with self.slots:
+            conn = self.pool.getconn()
+            try:
+                with conn:  # commit al salir, rollback si hay excepción
+                    yield conn
+            finally:
+                self.pool.putconn(conn)
+
+    def load(self, stores: Iterable[str] = STORES) -> Dict[str, Dict[str, Any]]:
+        """Cargar los almacenes indicados (importando los JSON existentes si la base está vacía)"""
+        documents = {}
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                empty = True
+                for store in STORES:
+                    cur.execute(f"SELECT 1 FROM {SQL_LAYOUT[store][0]} LIMIT 1")
+                    empty = empty and cur.fetchone() is None
+                for store in stores:
+                    table, _, daily_table, value_column, _ = SQL_LAYOUT[store]
+                    cur.execute(f"SELECT user_id, data FROM {table}")
+                    main_rows = cur.fetchall()
+                    cur.execute(f"SELECT user_id, date, {value_column} FROM {daily_table}")
+                    documents[store] = sql_documents(store, main_rows, cur.fetchall())
+
+        # Solo la primera carga importa los JSON (ver SqliteStorage.load)
+        import_from, self.import_from = self.import_from, None
+        if empty and import_from is not None:
+            imported = import_from.load()
+            if any(imported.values()):
+                print("Importando datos JSON existentes a PostgreSQL")
+                self.commit({}, imported, replace=STORES)
+                return {store: imported[store] for store in stores}
+        return documents
+
+    def needs_compaction(self) -> bool:
+        """PostgreSQL no necesita compactación explícita"""
+        return False
+
+    @staticmethod
+    def _write_rows(cur, store: str, rows: List[tuple], daily_rows: List[tuple]) -> None:
+        """Insertar o actualizar todas las filas de un almacén en una sentencia"""
+        table, columns, daily_table, value_column, _ = SQL_LAYOUT[store]
+        if rows:
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns + ('data',))
+            execute_values(
+                cur,
+                f"INSERT INTO {table} (user_id, {', '.join(columns)}, data) VALUES %s "
+                f"ON CONFLICT (user_id) DO UPDATE SET {updates}",
+                rows
+            )
+        if daily_rows:
+            execute_values(
+                cur,
+                f"INSERT INTO {daily_table} (user_id, date, {value_column}) VALUES %s",
+                daily_rows
+            )
+
+    def commit(self, changes: Dict[str, Iterable[str]], documents: Dict[str, Dict[str, Any]],
+               replace: Iterable[str] = (), complete: bool = True,
+               updates: Iterable[Dict[str, Any]] = ()) -> None:
+        """Persistir los cambios en una sola transacción con sentencias por conjunto"""
+        replace = set(replace)
+        updates = [update for update in updates if update['store'] not in replace]
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                for store in replace:
+                    table, _, daily_table, _, _ = SQL_LAYOUT[store]
+                    cur.execute(f"TRUNCATE {table}, {daily_table}")
+                    rows, daily_rows, _, _ = sql_changed_rows(store, documents[store].keys(), documents[store])
+                    self._write_rows(cur, store, rows, daily_rows)
+
+                # Las operaciones por conjunto van antes que los registros modificados
+                for update in updates:
+                    for statement in self.UPDATES[update['op']]:
+                        cur.execute(statement, update)
+
+                for store, ids in changes.items():
+                    if store in replace:
+                        continue
+                    table, _, daily_table, _, _ = SQL_LAYOUT[store]
+                    rows, daily_rows, touched, deleted = sql_changed_rows(store, ids, documents[store])
+                    cur.execute(f"DELETE FROM {daily_table} WHERE user_id = ANY(%s)", (touched,))
+                    if deleted:
+                        cur.execute(f"DELETE FROM {table} WHERE user_id = ANY(%s)", (deleted,))
+                    self._write_rows(cur, store, rows, daily_rows)
+
+                if self.origin is not None:
+                    now = time.time()
+                    change_rows = sql_change_rows(self.origin, changes, replace | {update['store'] for update in updates}, now)
+                    if change_rows:
+                        execute_values(cur, "INSERT INTO changes (origin, store, user_id, changed_at) VALUES %s",
+                                       change_rows)
+                    cur.execute("DELETE FROM changes WHERE changed_at < %s", (now - CHANGE_LOG_SECONDS,))
+
+    def load_records(self, store: str, record_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Leer registros concretos de un almacén (None para los que ya no existen)"""
+        table, _, daily_table, value_column, _ = SQL_LAYOUT[store]
+        record_ids = list(record_ids)
+        ids = [int(record_id) for record_id in record_ids]
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT user_id, data FROM {table} WHERE user_id = ANY(%s)", (ids,))
+                main_rows = cur.fetchall()
+                cur.execute(f"SELECT user_id, date, {value_column} FROM {daily_table} WHERE user_id = ANY(%s)", (ids,))
+                document = sql_documents(store, main_rows, cur.fetchall())
+        return {record_id: document.get(record_id) for record_id in record_ids}
+
+    def latest_change(self) -> int:
+        """Versión del último cambio anotado en el registro compartido"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(MAX(version), 0) FROM changes")
+                return cur.fetchone()[0]
+
+    def changes_since(self, version: int) -> Tuple[int, Dict[str, Optional[set]]]:
+        """Cambios de otros nodos posteriores a `version` (ver sql_changes)"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT MIN(version) FROM changes")
+                oldest = cur.fetchone()[0]
+                cur.execute("SELECT version, origin, store, user_id FROM changes WHERE version > %s ORDER BY version",
+                            (version,))
+                rows = cur.fetchall()
+        return sql_changes(self.origin, version, oldest, rows)
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """Tomar o renovar el lease `name` por `seconds`; False si otro nodo lo tiene vigente"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO leases (name, holder, expires_at) "
+                    "VALUES (%s, %s, EXTRACT(EPOCH FROM clock_timestamp()) + %s) "
+                    "ON CONFLICT (name) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at "
+                    "WHERE leases.holder = EXCLUDED.holder OR leases.expires_at <= EXTRACT(EPOCH FROM clock_timestamp()) "
+                    "RETURNING holder",
+                    (name, holder, seconds)
+                )
+                return cur.fetchone() is not None
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Liberar un lease si todavía es de `holder`"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM leases WHERE name = %s AND holder = %s", (name, holder))
+
+    def backup(self, documents: Dict[str, Dict[str, Any]]) -> None:
+        """Los backups de PostgreSQL se hacen con pg_dump fuera del bot"""
+
+    def close(self) -> None:
+        """Cerrar todas las conexiones del pool"""
+        self.pool.closeall()
+
+
+def create_storage(settings: Dict[str, Any], data_file: str = "user_times.json",
+                   attendance_file: str = "attendance_data.json",
+                   credits_file: str = "saved_credits.json",
+                   compact_every: int = 500, backup_generations: int = 3,
+                   namespace: Optional[str] = None, origin: Optional[str] = None):
+    """Crear el almacenamiento indicado en la sección `storage` de config.json.
+
+    Con `namespace` (un servidor de Discord) SQLite usa su propio archivo
+    `<ruta>_<namespace>.db` y PostgreSQL su propio esquema; los archivos JSON
+    los elige el llamador. Con `origin` (id del nodo en modo sharded) los
+    backends SQL anotan sus commits para los demás procesos.
+    """
+    json_storage = JsonStorage(data_file, attendance_file, credits_file, compact_every, backup_generations)
+    backend = settings.get('backend', 'json')
+
+    if backend == 'sqlite':
+        sqlite_path = settings.get('sqlite_path', 'tracker.db')
+        if namespace:
+            root, extension = os.path.splitext(sqlite_path)
+            sqlite_path = f"{root}_{namespace}{extension}"
+        return SqliteStorage(sqlite_path, backup_generations, import_from=json_storage, origin=origin)
+    if backend == 'postgres':
+        dsn = settings.get('postgres_dsn') or os.getenv('DATABASE_URL')
+        return PostgresStorage(dsn, settings.get('postgres_min_connections', 1),
+                               settings.get('postgres_max_connections', 5),
+                               import_from=json_storage, schema=namespace, origin=origin)
+    if backend != 'json':
+        print(f"Backend de almacenamiento desconocido '{backend}', usando JSON")
+    return json_storage
@@ -1,401 +1,1136 @@
 
-import json
-import os
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Iterable, Iterator, List, Callable
+import asyncio
+import copy
+import heapq
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import codec
+from archive import SessionArchive
+from ranking import RankingIndex
+from storage import STORES, JsonStorage
+from user_record import UserRecord, to_iso
 
 class TimeTracker:
-    def __init__(self, data_file: str = "user_times.json"):
+    # Atributo interno de cada almacén (None mientras no se haya cargado)
+    _STORE_ATTRIBUTES = {'users': '_data', 'attendance': '_attendance_data', 'credits': '_credits_data'}
+    # Milestones de tiempo total en orden: (atributo de completado, segundos)
+    _MILESTONES = (('milestone_1h_completed', 3600), ('milestone_2h_completed', 7200))
+
+    def __init__(self, data_file: str = "user_times.json", compact_every: int = 500,
+                 write_behind: bool = False, max_dirty: int = 200, backup_generations: int = 3,
+                 storage=None, archive=None, lock_stripes: int = 64):
         self.data_file = data_file
-        self.data = self.load_data()
-        self.attendance_file = "attendance_data.json"
-        self.attendance_data = self.load_attendance_data()
-        self.credits_file = "saved_credits.json"
-        self.credits_data = self.load_credits_data()
-
-    def load_data(self) -> Dict[str, Any]:
-        """Cargar datos desde el archivo JSON"""
+        self.attendance_file = os.path.join(os.path.dirname(data_file), "attendance_data.json")
+        self.credits_file = os.path.join(os.path.dirname(data_file), "saved_credits.json")
+        # Backend de persistencia (JSON por defecto, ver storage.create_storage)
+        self.storage = storage or JsonStorage(data_file, self.attendance_file, self.credits_file,
+                                              compact_every, backup_generations)
+
+        # Historial antiguo comprimido por mes (ver archive_history)
+        self.archive = archive or SessionArchive(os.path.join(os.path.dirname(data_file), "archive"))
+
+        # Modo write-behind: las mutaciones solo marcan registros como sucios y
+        # flush() los escribe (por intervalo, por tamaño o al apagar el bot)
+        self.write_behind = write_behind
+        self.max_dirty = max_dirty
+        self._pending = {store: set() for store in STORES}
+        self._pending_replace = set()
+        # Operaciones sobre todo un almacén pendientes, en orden (p. ej. el reset
+        # diario): el almacenamiento las aplica con una sentencia por conjunto
+        self._pending_updates: List[Dict[str, Any]] = []
+        # Si se define, los guardados inmediatos se delegan a esta función (p. ej.
+        # para escribir desde un executor) en lugar de bloquear al llamador
+        self.flush_requested = None
+        # Profundidad de transacciones abiertas (ver transaction())
+        self._transaction_depth = 0
+        # Ids pendientes de la pasada actual de cleanup_inactive
+        self._cleanup_queue = []
+        # Fecha de hoy y su medianoche (epoch), recalculadas al cambiar el día
+        self._today_key = None
+        self._midnight = 0.0
+        self._next_midnight = 0.0
+        # Asistencias de la semana en curso por admin (lunes a viernes + manuales),
+        # recalculadas en cada guardado de asistencias y al empezar una semana nueva
+        self._weekly_attendance: Dict[str, int] = {}
+        self._week_dates = ()
+        self._week_start = 0.0
+        self._next_week_start = 0.0
+
+        # Los almacenes se cargan al primer acceso (ver data, attendance_data,
+        # credits_data y warm_up); el lock evita cargas duplicadas entre hilos
+        self._load_lock = threading.RLock()
+        self._data: Optional[Dict[int, UserRecord]] = None
+        self._attendance_data: Optional[Dict[str, Any]] = None
+        self._credits_data: Optional[Dict[str, Any]] = None
+        # Índices por estado (ids de usuario), actualizados en cada guardado de usuarios
+        self._status_index = {'active': set(), 'paused': set(), 'pre_registered': set()}
+        # Próximo milestone de cada usuario activo: heap de (epoch, id) con borrado
+        # perezoso; una entrada solo es válida si coincide con _milestone_deadlines
+        self._milestone_heap = []
+        self._milestone_deadlines: Dict[int, float] = {}
+        # Funciones llamadas (sin argumentos, desde cualquier hilo) cuando aparece
+        # un milestone más próximo que los programados
+        self.milestone_listeners: List[Callable[[], None]] = []
+        # Rankings incrementales por tiempo total (id int) y créditos guardados (id int)
+        self._time_ranking = RankingIndex()
+        self._credits_ranking = RankingIndex()
+        # Locks asyncio por franjas de ids de usuario (ver user_lock): comprobar
+        # el estado y mutarlo sin que otra corrutina cambie al usuario en medio
+        self._user_locks = [asyncio.Lock() for _ in range(lock_stripes)]
+
+    def _load_store(self, store: str) -> None:
+        """Cargar un almacén desde el almacenamiento si aún no está en memoria"""
+        with self._load_lock:
+            if getattr(self, self._STORE_ATTRIBUTES[store]) is not None:
+                return
+            document = self.storage.load([store])[store]
+            # Los índices se construyen desde el documento local y el documento se
+            # publica al final: quien lo lea sin esperar al lock (el event loop
+            # durante un warm_up en segundo plano) ya lo encuentra indexado
+            if store == 'users':
+                # Usuarios como UserRecord con clave int; los archivos siguen en formato dict
+                document = {
+                    int(user_id_str): UserRecord.from_dict(int(user_id_str), user_data)
+                    for user_id_str, user_data in document.items()
+                }
+                self._rebuild_status_index(document)
+            elif store == 'attendance':
+                self._rebuild_weekly_attendance(document)
+            elif store == 'credits':
+                self._rebuild_credits_ranking(document)
+            setattr(self, self._STORE_ATTRIBUTES[store], document)
+            if store == 'users':
+                # Reprogramar desde el índice ya publicado: incluye a los usuarios
+                # que se iniciaron mientras se cargaba
+                self.schedule_milestones(tuple(self._status_index['active']))
+
+    def _rebuild_status_index(self, data: Optional[Dict[int, UserRecord]] = None) -> None:
+        """Reconstruir los índices por estado, el ranking y los milestones desde todos los usuarios"""
+        if data is None:
+            data = self._data
+        index = {status: set() for status in self._status_index}
+        for user_id, user_data in data.items():
+            status = user_data.status
+            if status in index:
+                index[status].add(user_id)
+        time_ranking = RankingIndex()
+        time_ranking.rebuild((user_id, user_data.total_time) for user_id, user_data in data.items())
+
+        deadlines = {}
+        for user_id in index['active']:
+            deadline = self._milestone_deadline(data[user_id])
+            if deadline is not None:
+                deadlines[user_id] = deadline
+        heap = [(deadline, user_id) for user_id, deadline in deadlines.items()]
+        heapq.heapify(heap)
+
+        self._status_index = index
+        self._time_ranking = time_ranking
+        self._milestone_deadlines = deadlines
+        self._milestone_heap = heap
+        self._notify_milestone_listeners()
+
+    def _rebuild_credits_ranking(self, credits_data: Optional[Dict[str, Any]] = None) -> None:
+        """Reconstruir el ranking de créditos guardados"""
+        if credits_data is None:
+            credits_data = self.credits_data
+        ranking = RankingIndex()
+        ranking.rebuild((int(user_id_str), user_credits.get('total_credits', 0))
+                        for user_id_str, user_credits in credits_data.items())
+        self._credits_ranking = ranking
+
+    def _weekly_count(self, admin_data: Dict[str, Any]) -> int:
+        """Asistencias de la semana en curso de un admin (días laborables + manuales)"""
+        daily = admin_data.get('daily_attendance', {})
+        return sum(daily.get(date, 0) for date in self._week_dates) + admin_data.get('manual_weekly_attendance', 0)
+
+    def _rebuild_weekly_attendance(self, attendance_data: Optional[Dict[str, Any]] = None) -> None:
+        """Recalcular los contadores semanales de todos los admins"""
+        if attendance_data is None:
+            attendance_data = self.attendance_data
+        self._current_week(time.time())
+        self._weekly_attendance = {
+            admin_id_str: self._weekly_count(admin_data)
+            for admin_id_str, admin_data in attendance_data.items()
+        }
+
+    def _reindex_attendance(self, admin_ids: Iterable[Any]) -> None:
+        """Actualizar los contadores semanales de los admins indicados"""
+        if self._current_week(time.time()):
+            self._rebuild_weekly_attendance()
+            return
+        attendance_data = self.attendance_data
+        for admin_id in admin_ids:
+            admin_id_str = str(admin_id)
+            admin_data = attendance_data.get(admin_id_str)
+            if admin_data is None:
+                self._weekly_attendance.pop(admin_id_str, None)
+            else:
+                self._weekly_attendance[admin_id_str] = self._weekly_count(admin_data)
+
+    def _current_week(self, now: float) -> bool:
+        """Actualizar las fechas de la semana en curso; True si la semana cambió"""
+        if self._week_start <= now < self._next_week_start:
+            return False
+        today = datetime.fromtimestamp(now).date()
+        monday = today - timedelta(days=today.weekday())
+        # Solo 5 días: lunes a viernes
+        self._week_dates = tuple((monday + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(5))
+        self._week_start = datetime.combine(monday, datetime.min.time()).timestamp()
+        self._next_week_start = datetime.combine(monday + timedelta(days=7), datetime.min.time()).timestamp()
+        return True
+
+    def _reindex_users(self, user_ids: Iterable[Any]) -> None:
+        """Actualizar los índices por estado de los usuarios indicados"""
+        data = self.data
+        for user_id in user_ids:
+            user_id = int(user_id)
+            for ids in self._status_index.values():
+                ids.discard(user_id)
+            user_data = data.get(user_id)
+            if user_data is None:
+                self._time_ranking.discard(user_id)
+                continue
+            if user_data.status in self._status_index:
+                self._status_index[user_data.status].add(user_id)
+            self._time_ranking.update(user_id, user_data.total_time)
+        self.schedule_milestones(user_ids)
+
+    def _milestone_deadline(self, user_data: Optional[UserRecord]) -> Optional[float]:
+        """Momento (epoch) en que un usuario activo alcanza su próximo milestone"""
+        if user_data is None or not user_data.is_active or not user_data.last_start:
+            return None
+        for flag, threshold in self._MILESTONES:
+            if not getattr(user_data, flag):
+                return user_data.last_start + threshold - user_data.total_time
+        return None
+
+    def _schedule_milestones(self, user_ids: Iterable[Any]) -> bool:
+        """Recalcular el próximo milestone de los usuarios; True si alguno quedó primero"""
+        data = self._data
+        heap = self._milestone_heap
+        deadlines = self._milestone_deadlines
+        earliest = heap[0][0] if heap else None
+        moved_up = False
+        for user_id in user_ids:
+            user_id = int(user_id)
+            deadline = self._milestone_deadline(data.get(user_id))
+            if deadline is None:
+                deadlines.pop(user_id, None)
+                continue
+            if deadlines.get(user_id) == deadline:
+                continue
+            deadlines[user_id] = deadline
+            heapq.heappush(heap, (deadline, user_id))
+            if earliest is None or deadline < earliest:
+                earliest = deadline
+                moved_up = True
+
+        # Compactar cuando las entradas obsoletas superan a las vigentes
+        if len(heap) > 2 * len(deadlines) + 64:
+            self._milestone_heap = [(deadline, user_id) for user_id, deadline in deadlines.items()]
+            heapq.heapify(self._milestone_heap)
+        return moved_up
+
+    def _notify_milestone_listeners(self) -> None:
+        """Avisar a los planificadores de que el próximo milestone cambió"""
+        for listener in self.milestone_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error notificando cambio de milestones: {e}")
+
+    def schedule_milestones(self, user_ids: Iterable[Any]) -> None:
+        """Reprogramar el próximo milestone de los usuarios (al iniciar, reanudar, pausar, sumar o restar)"""
+        if self._data is None:
+            return
+        if self._schedule_milestones(user_ids):
+            self._notify_milestone_listeners()
+
+    def next_milestone_deadline(self) -> Optional[float]:
+        """Momento (epoch) del próximo milestone de cualquier usuario activo"""
+        if self._data is None:
+            self._load_store('users')
+        heap = self._milestone_heap
+        while heap and self._milestone_deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due_milestones(self, now: Optional[float] = None) -> List[int]:
+        """Sacar del planificador los usuarios cuyo milestone ya venció"""
+        if self._data is None:
+            self._load_store('users')
+        now = time.time() if now is None else now
+        heap = self._milestone_heap
+        due = []
+        while heap and heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(heap)
+            if self._milestone_deadlines.get(user_id) == deadline:
+                del self._milestone_deadlines[user_id]
+                due.append(user_id)
+        return due
+
+    def user_lock(self, user_id: int) -> asyncio.Lock:
+        """Lock asyncio de un usuario (compartido con los ids de la misma franja)"""
+        return self._user_locks[int(user_id) % len(self._user_locks)]
+
+    @asynccontextmanager
+    async def lock_users(self, user_ids: Iterable[int]):
+        """Tomar los locks de varios usuarios a la vez.
+
+        Las franjas se toman en orden creciente para que dos operaciones sobre
+        conjuntos solapados de usuarios no puedan bloquearse mutuamente.
+        """
+        stripes = sorted({int(user_id) % len(self._user_locks) for user_id in user_ids})
+        acquired = []
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return {}
-        except Exception as e:
-            print(f"Error cargando datos: {e}")
-            return {}
+            for stripe in stripes:
+                lock = self._user_locks[stripe]
+                await lock.acquire()
+                acquired.append(lock)
+            yield self
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def _iter_status(self, status: str) -> Iterator[int]:
+        """Copia de los ids de un índice (se puede cambiar el estado mientras se recorre)"""
+        if self._data is None:
+            self._load_store('users')
+        return iter(tuple(self._status_index[status]))
+
+    def iter_active_users(self) -> Iterator[int]:
+        """Ids de usuarios con tiempo corriendo"""
+        return self._iter_status('active')
+
+    def iter_paused_users(self) -> Iterator[int]:
+        """Ids de usuarios con tiempo pausado"""
+        return self._iter_status('paused')
+
+    def iter_pre_registered_users(self) -> Iterator[int]:
+        """Ids de usuarios pre-registrados para el inicio automático"""
+        return self._iter_status('pre_registered')
+
+    @property
+    def data(self) -> Dict[int, UserRecord]:
+        """Usuarios en memoria (se cargan al primer acceso)"""
+        if self._data is None:
+            self._load_store('users')
+        return self._data
+
+    @data.setter
+    def data(self, value: Dict[int, UserRecord]) -> None:
+        self._data = value
+
+    @property
+    def attendance_data(self) -> Dict[str, Any]:
+        """Asistencias en memoria (se cargan al primer acceso)"""
+        if self._attendance_data is None:
+            self._load_store('attendance')
+        return self._attendance_data
+
+    @attendance_data.setter
+    def attendance_data(self, value: Dict[str, Any]) -> None:
+        self._attendance_data = value
+
+    @property
+    def credits_data(self) -> Dict[str, Any]:
+        """Créditos guardados en memoria (se cargan al primer acceso)"""
+        if self._credits_data is None:
+            self._load_store('credits')
+        return self._credits_data
+
+    @credits_data.setter
+    def credits_data(self, value: Dict[str, Any]) -> None:
+        self._credits_data = value
+
+    def is_loaded(self, store: str) -> bool:
+        """Verificar si un almacén ya está en memoria"""
+        return getattr(self, self._STORE_ATTRIBUTES[store]) is not None
+
+    def warm_up(self, background: bool = False, stores: Iterable[str] = STORES) -> Optional[threading.Thread]:
+        """Cargar de antemano los almacenes indicados.
+
+        Con `background` la carga se hace en un hilo daemon y se devuelve el
+        hilo; los accesos que lleguen mientras tanto esperan al lock de carga.
+        """
+        stores = list(stores)
+
+        def load_all():
+            for store in stores:
+                try:
+                    self._load_store(store)
+                except Exception as e:
+                    print(f"Error precargando {store}: {e}")
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name="tracker-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _export_record(self, store: str, record_id: str) -> Optional[Dict[str, Any]]:
+        """Copia en formato dict de un registro (None si no existe)"""
+        if store == 'users':
+            record = self.data.get(int(record_id))
+            return record.to_dict() if record is not None else None
+        record = self._live_store(store).get(record_id)
+        return copy.deepcopy(record) if record is not None else None
+
+    def _live_store(self, store: str) -> Dict[str, Any]:
+        """Documento en memoria de asistencias o créditos"""
+        return self.attendance_data if store == 'attendance' else self.credits_data
+
+    def _documents(self) -> Dict[str, Dict[str, Any]]:
+        """Copia en formato dict de los almacenes cargados (los demás no han cambiado)"""
+        documents = {}
+        if self._data is not None:
+            documents['users'] = {str(user_id): record.to_dict() for user_id, record in self._data.items()}
+        if self._attendance_data is not None:
+            documents['attendance'] = copy.deepcopy(self._attendance_data)
+        if self._credits_data is not None:
+            documents['credits'] = copy.deepcopy(self._credits_data)
+        return documents
+
+    def _mark_records(self, store: str, record_ids: Iterable[Any]) -> None:
+        """Marcar registros modificados y escribirlos (o diferirlos en modo write-behind)"""
+        self._pending[store].update(str(record_id) for record_id in record_ids)
+        if self._transaction_depth:
+            return
+        if not self.write_behind:
+            self._request_flush()
+        elif sum(len(ids) for ids in self._pending.values()) >= self.max_dirty:
+            self._request_flush()
+
+    def _mark_store(self, store: str) -> None:
+        """Marcar un almacén completo para reescritura"""
+        self._pending_replace.add(store)
+        if not self.write_behind and not self._transaction_depth:
+            self._request_flush()
+
+    def _mark_update(self, update: Dict[str, Any]) -> None:
+        """Registrar una operación sobre todo un almacén ya aplicada en memoria"""
+        self._pending_updates.append(update)
+        if not self.write_behind and not self._transaction_depth:
+            self._request_flush()
+
+    @contextmanager
+    def transaction(self):
+        """Agrupar mutaciones de los tres almacenes en un solo commit durable.
+
+        Dentro del bloque las mutaciones se aplican en memoria como siempre, pero
+        no se escriben; al salir del bloque exterior todo se guarda junto (una
+        línea del registro JSON o una transacción SQL). Si el bloque lanza una
+        excepción, lo ya aplicado en memoria también se guarda para que disco y
+        memoria no diverjan.
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if not self._transaction_depth and not self.write_behind and self.has_pending_changes():
+                self._request_flush()
+
+    def _today(self, now: float) -> Tuple[str, float]:
+        """Fecha de hoy (AAAA-MM-DD) y epoch de su medianoche, en caché hasta el día siguiente"""
+        if now >= self._next_midnight or now < self._midnight:
+            today = datetime.fromtimestamp(now).date()
+            self._today_key = today.strftime("%Y-%m-%d")
+            self._midnight = datetime.combine(today, datetime.min.time()).timestamp()
+            self._next_midnight = datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+        return self._today_key, self._midnight
+
+    def _request_flush(self) -> None:
+        """Guardar ahora o delegar el guardado si hay un flush_requested configurado"""
+        if self.flush_requested is not None:
+            self.flush_requested()
+        else:
+            self.flush()
 
     def save_data(self) -> None:
-        """Guardar datos al archivo JSON - optimizado para operaciones masivas"""
+        """Guardar el documento completo de usuarios - para operaciones masivas"""
+        self._rebuild_status_index()
+        self._mark_store('users')
+
+    def save_users_data(self, user_ids: Iterable[int]) -> None:
+        """Guardar el estado actual de varios usuarios con una sola escritura"""
+        user_ids = list(user_ids)
+        self._reindex_users(user_ids)
+        self._mark_records('users', user_ids)
+
+    def save_user_data(self, user_id: int) -> None:
+        """Guardar el estado actual de un usuario"""
+        self._reindex_users([user_id])
+        self._mark_records('users', [user_id])
+
+    def save_attendance_records(self, admin_ids: Iterable[int]) -> None:
+        """Guardar las asistencias de los administradores indicados"""
+        admin_ids = list(admin_ids)
+        self._reindex_attendance(admin_ids)
+        self._mark_records('attendance', admin_ids)
+
+    def save_credits_records(self, user_ids: Iterable[int]) -> None:
+        """Guardar los créditos de los usuarios indicados"""
+        user_ids = list(user_ids)
+        credits_data = self.credits_data
+        for user_id in user_ids:
+            self._credits_ranking.update(int(user_id), credits_data.get(str(user_id), {}).get('total_credits', 0))
+        self._mark_records('credits', user_ids)
+
+    def backup_data_files(self) -> None:
+        """Crear una generación de backup de los datos (tarea programada)"""
+        self.flush()
         try:
-            # Crear backup del archivo anterior
-            import shutil
-            if os.path.exists(self.data_file):
-                backup_file = f"{self.data_file}.backup"
-                shutil.copy2(self.data_file, backup_file)
-            
-            # Guardar con formato compacto para archivos grandes
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                if len(self.data) > 50:  # Formato compacto para muchos usuarios
-                    json.dump(self.data, f, separators=(',', ':'), ensure_ascii=False)
-                else:  # Formato legible para pocos usuarios
-                    json.dump(self.data, f, indent=2, ensure_ascii=False)
+            self.storage.backup(self._documents())
+        except Exception as e:
+            print(f"Error creando backups: {e}")
+
+    def backup_documents(self) -> Dict[str, Dict[str, Any]]:
+        """Copia de los almacenes cargados para escribir un backup desde otro hilo"""
+        return self._documents()
+
+    def apply_remote_changes(self, records: Dict[str, Dict[str, Optional[Dict[str, Any]]]],
+                             complete: Iterable[str] = ()) -> Dict[str, List[str]]:
+        """Aplicar en memoria registros escritos por otro nodo (ver cluster.StoreSync).
+
+        `records` trae, por almacén, los registros releídos (None si se
+        eliminaron); en los almacenes de `complete` trae el almacén entero y se
+        eliminan los registros que ya no están. Los registros con cambios
+        locales pendientes se conservan: se escribirán después y ganan. No se
+        marca nada como pendiente. Devuelve los ids aplicados por almacén.
+        """
+        complete = set(complete)
+        applied = {}
+        for store, store_records in records.items():
+            if not self.is_loaded(store) or store in self._pending_replace:
+                continue
+            pending = self._pending[store]
+            # Las operaciones por conjunto aún no escritas se vuelven a aplicar
+            # sobre lo recibido: el almacenamiento las aplicará también
+            updates = [update for update in self._pending_updates if update['store'] == store]
+            if store == 'users':
+                live = self._data
+                if store in complete:
+                    store_records = {**{str(user_id): None for user_id in live}, **store_records}
+                ids = []
+                for record_id, record in store_records.items():
+                    if record_id in pending:
+                        continue
+                    if record is None:
+                        live.pop(int(record_id), None)
+                    else:
+                        user_data = UserRecord.from_dict(int(record_id), record)
+                        for update in updates:
+                            self._apply_user_update(user_data, update)
+                        live[int(record_id)] = user_data
+                    ids.append(record_id)
+                self._reindex_users(ids)
+            else:
+                live = self._live_store(store)
+                if store in complete:
+                    store_records = {**{record_id: None for record_id in live}, **store_records}
+                ids = []
+                for record_id, record in store_records.items():
+                    if record_id in pending:
+                        continue
+                    if record is None:
+                        live.pop(record_id, None)
+                    else:
+                        live[record_id] = record
+                    ids.append(record_id)
+                if store == 'attendance':
+                    self._reindex_attendance(ids)
+                else:
+                    for record_id in ids:
+                        record = live.get(record_id)
+                        if record is None:
+                            self._credits_ranking.discard(int(record_id))
+                        else:
+                            self._credits_ranking.update(int(record_id), record.get('total_credits', 0))
+            applied[store] = ids
+        return applied
+
+    def has_pending_changes(self) -> bool:
+        """Verificar si hay cambios en memoria pendientes de escribir"""
+        return bool(self._pending_replace or self._pending_updates or any(self._pending.values()))
+
+    def take_pending(self) -> Optional[Tuple[Dict[str, set], Dict[str, Dict[str, Any]], set, bool, List[Dict[str, Any]]]]:
+        """Extraer los cambios pendientes como un lote independiente de la memoria viva.
+
+        Los registros se copian para que el lote pueda escribirse desde otro hilo
+        mientras los comandos siguen modificando los datos. Solo se copian los
+        documentos completos cuando hay reemplazos o el almacenamiento necesita
+        compactar.
+        """
+        if not self.has_pending_changes():
+            return None
+
+        changes = {store: ids for store, ids in self._pending.items() if ids}
+        replace = self._pending_replace
+        # Un almacén reemplazado ya va completo: sus operaciones por conjunto sobran
+        updates = [update for update in self._pending_updates if update['store'] not in replace]
+        self._pending = {store: set() for store in STORES}
+        self._pending_replace = set()
+        self._pending_updates = []
+
+        complete = bool(replace) or self.storage.needs_compaction()
+        if complete:
+            documents = self._documents()
+        else:
+            documents = {store: {} for store in STORES}
+            for store, ids in changes.items():
+                for record_id in ids:
+                    record = self._export_record(store, record_id)
+                    if record is not None:
+                        documents[store][record_id] = record
+        return changes, documents, replace, complete, updates
+
+    def commit_batch(self, batch: Tuple[Dict[str, set], Dict[str, Dict[str, Any]], set, bool, List[Dict[str, Any]]]) -> None:
+        """Escribir un lote obtenido con take_pending (puede llamarse desde otro hilo)"""
+        changes, documents, replace, complete, updates = batch
+        self.storage.commit(changes, documents, replace, complete, updates)
+
+    def restore_pending(self, batch: Tuple[Dict[str, set], Dict[str, Dict[str, Any]], set, bool, List[Dict[str, Any]]]) -> None:
+        """Volver a marcar como pendiente un lote que no se pudo escribir"""
+        changes, _, replace, _, updates = batch
+        for store, ids in changes.items():
+            self._pending[store].update(ids)
+        self._pending_replace.update(replace)
+        # Las operaciones del lote fallido van antes que las registradas después
+        self._pending_updates = list(updates) + self._pending_updates
+
+    def flush(self) -> None:
+        """Escribir todos los cambios pendientes en el almacenamiento"""
+        batch = self.take_pending()
+        if batch is None:
+            return
+
+        try:
+            self.commit_batch(batch)
         except Exception as e:
             print(f"Error guardando datos: {e}")
-            # Intentar restaurar backup si falla
-            try:
-                backup_file = f"{self.data_file}.backup"
-                if os.path.exists(backup_file):
-                    shutil.copy2(backup_file, self.data_file)
-                    print("Backup restaurado exitosamente")
-            except Exception as backup_error:
-                print(f"Error restaurando backup: {backup_error}")
+            # Conservar los cambios para reintentarlos en el próximo flush
+            self.restore_pending(batch)
 
     def pre_register_user(self, user_id: int, user_name: str) -> bool:
         """Pre-registrar usuario para inicio automático"""
-        user_id_str = str(user_id)
-        current_time = datetime.now().isoformat()
-
-        if user_id_str not in self.data:
-            self.data[user_id_str] = {
-                'name': user_name,
-                'total_time': 0,
-                'sessions': [],
-                'is_active': False,
-                'is_paused': False,
-                'pause_count': 0,
-                'notified_milestones': [],
-                'milestone_completed': False,
-                'is_pre_registered': False
-            }
+        current_time = time.time()
 
-        user_data = self.data[user_id_str]
+        user_data = self.data.get(user_id)
+        if user_data is None:
+            user_data = self.data[user_id] = UserRecord(user_id, user_name)
 
         # Si ya está activo o pre-registrado, no hacer nada
-        if user_data.get('is_active', False) or user_data.get('is_pre_registered', False):
+        if user_data.is_active or user_data.is_pre_registered:
             return False
 
         # Si está pausado, no permitir pre-registro
-        if user_data.get('is_paused', False):
+        if user_data.is_paused:
             return False
 
         # Pre-registrar usuario
-        user_data['is_pre_registered'] = True
-        user_data['pre_register_time'] = current_time
-        user_data['name'] = user_name  # Actualizar nombre
+        user_data.is_pre_registered = True
+        user_data.pre_register_time = current_time
+        user_data.name = user_name  # Actualizar nombre
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def start_tracking(self, user_id: int, user_name: str) -> bool:
         """Iniciar seguimiento de tiempo para un usuario"""
-        user_id_str = str(user_id)
-        current_time = datetime.now().isoformat()
-
-        if user_id_str not in self.data:
-            self.data[user_id_str] = {
-                'name': user_name,
-                'total_time': 0,
-                'sessions': [],
-                'is_active': False,
-                'is_paused': False,
-                'pause_count': 0,
-                'notified_milestones': [],
-                'milestone_completed': False,
-                'is_pre_registered': False
-            }
+        current_time = time.time()
 
-        user_data = self.data[user_id_str]
+        user_data = self.data.get(user_id)
+        if user_data is None:
+            user_data = self.data[user_id] = UserRecord(user_id, user_name)
 
         # Si ya está activo, no hacer nada
-        if user_data.get('is_active', False):
+        if user_data.is_active:
             return False
 
         # Si está pausado, no permitir iniciar nuevo tracking
-        if user_data.get('is_paused', False):
+        if user_data.is_paused:
             return False
 
         # Limpiar pre-registro si existe
-        if user_data.get('is_pre_registered', False):
-            user_data['is_pre_registered'] = False
-            if 'pre_register_time' in user_data:
-                del user_data['pre_register_time']
-            if 'pre_register_initiator' in user_data:
-                del user_data['pre_register_initiator']
+        if user_data.is_pre_registered:
+            user_data.is_pre_registered = False
+            user_data.pre_register_time = None
+            user_data.pre_register_initiator = None
 
         # Iniciar nueva sesión
-        user_data['is_active'] = True
-        user_data['is_paused'] = False
-        user_data['last_start'] = current_time
-        user_data['name'] = user_name  # Actualizar nombre
+        user_data.is_active = True
+        user_data.is_paused = False
+        user_data.last_start = current_time
+        user_data.name = user_name  # Actualizar nombre
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def start_tracking_from_pre_register(self, user_id: int) -> bool:
         """Iniciar seguimiento desde pre-registro (para inicio automático a las 8 PM)"""
-        user_id_str = str(user_id)
-        current_time = datetime.now().isoformat()
+        current_time = time.time()
 
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
-
         # Solo funciona si está pre-registrado
-        if not user_data.get('is_pre_registered', False):
+        if not user_data.is_pre_registered:
             return False
 
         # Si ya está activo, no hacer nada
-        if user_data.get('is_active', False):
+        if user_data.is_active:
             return False
 
         # Iniciar desde pre-registro
-        user_data['is_active'] = True
-        user_data['is_paused'] = False
-        user_data['is_pre_registered'] = False
-        user_data['last_start'] = current_time
+        user_data.is_active = True
+        user_data.is_paused = False
+        user_data.is_pre_registered = False
+        user_data.last_start = current_time
 
         # Limpiar pre-registro
-        if 'pre_register_time' in user_data:
-            del user_data['pre_register_time']
+        user_data.pre_register_time = None
         
         # Limpiar información del admin pre-registrador
-        if 'pre_register_initiator' in user_data:
-            del user_data['pre_register_initiator']
+        user_data.pre_register_initiator = None
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def get_pre_registered_users(self) -> Dict[str, Any]:
         """Obtener usuarios pre-registrados"""
         pre_registered = {}
-        for user_id_str, data in self.data.items():
-            if data.get('is_pre_registered', False):
-                pre_registered[user_id_str] = data
+        for user_id in self.iter_pre_registered_users():
+            pre_registered[str(user_id)] = self.data[user_id].to_dict()
         return pre_registered
 
     def stop_tracking(self, user_id: int) -> bool:
         """Detener seguimiento de tiempo para un usuario"""
-        user_id_str = str(user_id)
-        today = datetime.now().strftime("%Y-%m-%d")
+        now = time.time()
+        today, _ = self._today(now)
 
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
-
-        if not user_data.get('is_active', False):
+        if not user_data.is_active:
             return False
 
         # Calcular tiempo de sesión
         session_time = 0
-        if user_data.get('last_start'):
-            session_start = datetime.fromisoformat(user_data['last_start'])
-            session_time = (datetime.now() - session_start).total_seconds()
+        if user_data.last_start:
+            session_time = now - user_data.last_start
             
             # Añadir tiempo de sesión al total
-            user_data['total_time'] = user_data.get('total_time', 0) + session_time
+            user_data.total_time += session_time
             
             # Actualizar tiempo diario
-            if 'daily_times' not in user_data:
-                user_data['daily_times'] = {}
-            user_data['daily_times'][today] = user_data['daily_times'].get(today, 0) + session_time
+            user_data.daily_times[today] = user_data.daily_times.get(today, 0) + session_time
 
         # Marcar como inactivo
-        user_data['is_active'] = False
-        user_data['is_paused'] = False
+        user_data.is_active = False
+        user_data.is_paused = False
 
         # Agregar sesión al historial
-        if 'sessions' not in user_data:
-            user_data['sessions'] = []
-
         session_record = {
-            'start': user_data.get('last_start'),
-            'end': datetime.now().isoformat(),
+            'start': to_iso(user_data.last_start),
+            'end': to_iso(now),
             'duration': session_time,
             'date': today
         }
-        user_data['sessions'].append(session_record)
+        user_data.sessions.append(session_record)
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def pause_tracking(self, user_id: int) -> bool:
         """Pausar seguimiento de tiempo para un usuario"""
-        user_id_str = str(user_id)
-        today = datetime.now().strftime("%Y-%m-%d")
+        now = time.time()
+        today, _ = self._today(now)
 
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
-
-        if not user_data.get('is_active', False):
+        if not user_data.is_active:
             return False
 
         # Calcular tiempo de sesión actual y añadirlo al total y diario
-        if user_data.get('last_start'):
-            session_start = datetime.fromisoformat(user_data['last_start'])
-            session_time = (datetime.now() - session_start).total_seconds()
-            user_data['total_time'] = user_data.get('total_time', 0) + session_time
+        if user_data.last_start:
+            session_time = now - user_data.last_start
+            user_data.total_time += session_time
             
             # Actualizar tiempo diario
-            if 'daily_times' not in user_data:
-                user_data['daily_times'] = {}
-            user_data['daily_times'][today] = user_data['daily_times'].get(today, 0) + session_time
+            user_data.daily_times[today] = user_data.daily_times.get(today, 0) + session_time
 
         # Marcar como pausado
-        user_data['is_active'] = False
-        user_data['is_paused'] = True
-        user_data['pause_start'] = datetime.now().isoformat()
-        user_data['pause_count'] = user_data.get('pause_count', 0) + 1
+        user_data.is_active = False
+        user_data.is_paused = True
+        user_data.pause_start = now
+        user_data.pause_count += 1
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def resume_tracking(self, user_id: int) -> bool:
         """Reanudar seguimiento de tiempo para un usuario pausado"""
-        user_id_str = str(user_id)
-
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
-
-        if not user_data.get('is_paused', False):
+        if not user_data.is_paused:
             return False
 
         # Reanudar seguimiento
-        user_data['is_active'] = True
-        user_data['is_paused'] = False
-        user_data['last_start'] = datetime.now().isoformat()
+        user_data.is_active = True
+        user_data.is_paused = False
+        user_data.last_start = time.time()
 
         # Limpiar pause_start
-        if 'pause_start' in user_data:
-            del user_data['pause_start']
+        user_data.pause_start = None
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def get_total_time(self, user_id: int) -> float:
         """Obtener tiempo total acumulado de un usuario"""
-        user_id_str = str(user_id)
-
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return 0.0
 
-        user_data = self.data[user_id_str]
-        total_time = user_data.get('total_time', 0)
+        total_time = user_data.total_time
 
         # Si está activo, añadir tiempo de sesión actual
-        if user_data.get('is_active', False) and user_data.get('last_start'):
-            session_start = datetime.fromisoformat(user_data['last_start'])
-            current_session_time = (datetime.now() - session_start).total_seconds()
-            total_time += current_session_time
+        if user_data.is_active and user_data.last_start:
+            total_time += time.time() - user_data.last_start
 
         return total_time
 
     def get_daily_time(self, user_id: int) -> float:
         """Obtener tiempo acumulado del día actual de un usuario"""
-        user_id_str = str(user_id)
-        today = datetime.now().strftime("%Y-%m-%d")
-
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return 0.0
 
-        user_data = self.data[user_id_str]
-        
-        # Inicializar registro diario si no existe
-        if 'daily_times' not in user_data:
-            user_data['daily_times'] = {}
-        
-        daily_time = user_data['daily_times'].get(today, 0)
+        now = time.time()
+        today, midnight = self._today(now)
+        daily_time = user_data.daily_times.get(today, 0)
 
         # Si está activo hoy, añadir tiempo de sesión actual
-        if (user_data.get('is_active', False) and 
-            user_data.get('last_start') and 
-            user_data.get('last_start').startswith(today)):
+        if (user_data.is_active and 
+            user_data.last_start and 
+            user_data.last_start >= midnight):
             
-            session_start = datetime.fromisoformat(user_data['last_start'])
-            current_session_time = (datetime.now() - session_start).total_seconds()
-            daily_time += current_session_time
+            daily_time += now - user_data.last_start
 
         return daily_time
 
     def get_daily_history(self, user_id: int, days: int = 7) -> Dict[str, float]:
         """Obtener historial de tiempo diario de los últimos N días"""
-        user_id_str = str(user_id)
-        
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return {}
         
-        user_data = self.data[user_id_str]
-        daily_times = user_data.get('daily_times', {})
+        daily_times = user_data.daily_times
         
         # Generar fechas de los últimos N días
         history = {}
         for i in range(days):
             date = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
             history[date] = daily_times.get(date, 0)
+
+        # Las fechas de meses archivados se leen del archivo histórico
+        archived_months = user_data.monthly_times
+        missing = [date for date in history if date not in daily_times and date[:7] in archived_months]
+        if missing:
+            history.update(self.archive.get_daily_times(user_id, missing))
         
         return history
 
+    def archive_history(self, days: int) -> Dict[str, int]:
+        """Mover al archivo histórico las sesiones y tiempos diarios de hace más de N días.
+
+        En el documento principal solo queda el total por mes (`monthly_times`)
+        de lo archivado. Si la escritura del archivo falla no se quita nada.
+        Equivale a prepare_archive_history, write_archive y finish_archive en
+        el mismo hilo; el bot escribe el archivo desde el hilo escritor.
+        """
+        job = self.prepare_archive_history(days)
+        self.write_archive(job)
+        return self.finish_archive(job)
+
+    def prepare_archive_history(self, days: int) -> Dict[str, Any]:
+        """Reunir el historial de hace más de N días a archivar (sin modificar nada)"""
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        return self._archive_job(list(self.data.keys()), cutoff)
+
+    @staticmethod
+    def _session_month(session: Dict[str, Any]) -> str:
+        """Mes (AAAA-MM) de una sesión cerrada"""
+        return (session.get('date') or session.get('end') or '')[:7]
+
+    def _archive_job(self, user_ids: Iterable[int], cutoff: str) -> Dict[str, Any]:
+        """Preparar el archivado del historial anterior a `cutoff` (AAAA-MM-DD) de los usuarios indicados.
+
+        El trabajo es independiente de la memoria viva: write_archive puede
+        escribirlo desde otro hilo mientras los comandos siguen modificando datos.
+        """
+        months = {}
+        history = []
+        for user_id in user_ids:
+            user_data = self.data.get(user_id)
+            if user_data is None:
+                continue
+            user_id_str = str(user_id)
+            old_days = {date: seconds for date, seconds in user_data.daily_times.items() if date < cutoff}
+            old_sessions = [dict(session) for session in user_data.sessions
+                            if (session.get('date') or session.get('end') or '')[:10] < cutoff]
+            if not old_days and not old_sessions:
+                continue
+
+            for date, seconds in old_days.items():
+                user_history = months.setdefault(date[:7], {}).setdefault(user_id_str, {'daily_times': {}, 'sessions': []})
+                user_history['daily_times'][date] = seconds
+            for session in old_sessions:
+                user_history = months.setdefault(self._session_month(session), {}).setdefault(
+                    user_id_str, {'daily_times': {}, 'sessions': []})
+                user_history['sessions'].append(session)
+
+            history.append((user_id, old_days, old_sessions))
+
+        return {'cutoff': cutoff, 'months': months, 'history': history, 'inactive': {},
+                'history_written': False, 'inactive_written': False}
+
+    def write_archive(self, job: Dict[str, Any]) -> None:
+        """Escribir los archivos de un archivado preparado (E/S bloqueante, desde el hilo escritor)"""
+        if job['months']:
+            try:
+                self.archive.archive(job['months'])
+            except Exception as e:
+                print(f"Error escribiendo archivo histórico: {e}")
+                # Los usuarios inactivos se archivan ya sin ese historial: no moverlos
+                return
+        job['history_written'] = True
+
+        if job['inactive']:
+            try:
+                self.archive.archive_users(job['inactive'])
+                job['inactive_written'] = True
+            except Exception as e:
+                print(f"Error archivando usuarios inactivos: {e}")
+
+    def _strip_history(self, user_data: UserRecord, old_days: Dict[str, float],
+                       old_sessions: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Quitar de un usuario el historial archivado que no cambió; devuelve días y sesiones quitados"""
+        monthly_times = user_data.monthly_times
+        removed_days = 0
+        for date, seconds in old_days.items():
+            # Un día que cambió después de preparar el archivado queda para la próxima pasada
+            if user_data.daily_times.get(date) != seconds:
+                continue
+            del user_data.daily_times[date]
+            monthly_times[date[:7]] = monthly_times.get(date[:7], 0) + seconds
+            removed_days += 1
+        # Registrar también los meses que solo tenían sesiones
+        for session in old_sessions:
+            monthly_times.setdefault(self._session_month(session), 0)
+        archived = {(session.get('start'), session.get('end')) for session in old_sessions}
+        kept = [session for session in user_data.sessions if (session.get('start'), session.get('end')) not in archived]
+        removed_sessions = len(user_data.sessions) - len(kept)
+        user_data.sessions = kept
+        return removed_days, removed_sessions
+
+    def finish_archive(self, job: Dict[str, Any]) -> Dict[str, int]:
+        """Quitar de la memoria lo que write_archive ya guardó en el archivo"""
+        stats = {'users': 0, 'days': 0, 'sessions': 0, 'evicted': 0}
+        if job['history_written']:
+            archived_users = []
+            for user_id, old_days, old_sessions in job['history']:
+                user_data = self.data.get(user_id)
+                if user_data is None:
+                    continue
+                removed_days, removed_sessions = self._strip_history(user_data, old_days, old_sessions)
+                if removed_days or removed_sessions:
+                    archived_users.append(user_id)
+                    stats['days'] += removed_days
+                    stats['sessions'] += removed_sessions
+            stats['users'] = len(archived_users)
+            self.save_users_data(archived_users)
+
+        if job['inactive_written']:
+            evicted = []
+            for record_id, record in job['inactive'].items():
+                user_data = self.data.get(int(record_id))
+                # Solo si el usuario no cambió desde que se preparó su archivado
+                if user_data is not None and user_data.to_dict() == record:
+                    del self.data[int(record_id)]
+                    evicted.append(record_id)
+            stats['evicted'] = len(evicted)
+            self.save_users_data(evicted)
+        return stats
+
+    def _last_activity_date(self, user_data: UserRecord) -> str:
+        """Fecha (AAAA-MM-DD) de la última actividad registrada de un usuario"""
+        dates = list(user_data.daily_times.keys())
+        dates.extend(datetime.fromtimestamp(value).strftime("%Y-%m-%d")
+                     for value in (user_data.last_start, user_data.pause_start, user_data.pre_register_time)
+                     if value is not None)
+        dates.extend((session.get('date') or session.get('end') or '')[:10] for session in user_data.sessions)
+        # Un mes archivado cuenta como activo hasta su último día posible
+        dates.extend(f"{month}-31" for month in user_data.monthly_times)
+        return max(dates, default='')
+
+    def cleanup_inactive(self, days: int, batch_size: int = 500) -> Dict[str, int]:
+        """Procesar un lote de la limpieza incremental de registros inactivos.
+
+        Recorre los tres almacenes por tandas de `batch_size` ids (el cursor se
+        conserva entre llamadas) y:
+        - archiva el historial diario de tiempo anterior al corte,
+        - quita las claves diarias de asistencias y créditos anteriores al corte,
+        - mueve al archivo los usuarios sin actividad desde el corte que no
+          están activos, pausados ni pre-registrados y no tienen tiempo acumulado.
+        Devuelve lo procesado y los bytes JSON liberados. Equivale a
+        prepare_cleanup, write_archive y finish_cleanup en el mismo hilo.
+        """
+        job = self.prepare_cleanup(days, batch_size)
+        self.write_archive(job)
+        return self.finish_cleanup(job)
+
+    def _record_size(self, store: str, record_id: str) -> int:
+        """Bytes JSON de un registro (0 si no existe)"""
+        record = self._export_record(store, record_id)
+        return 0 if record is None else len(codec.dumps_bytes(record))
+
+    def prepare_cleanup(self, days: int, batch_size: int = 500) -> Dict[str, Any]:
+        """Tomar el siguiente lote de la limpieza y preparar lo que va al archivo (sin modificar datos)"""
+        now = datetime.now()
+        # Nunca recortar la semana en curso (asistencias semanales)
+        cutoff_date = min(now - timedelta(days=days), now - timedelta(days=now.weekday()))
+        cutoff = cutoff_date.strftime("%Y-%m-%d")
+
+        if not self._cleanup_queue:
+            self._cleanup_queue = list({str(user_id) for user_id in self.data}
+                                       | set(self.attendance_data) | set(self.credits_data))
+        batch = self._cleanup_queue[-batch_size:]
+        del self._cleanup_queue[-batch_size:]
+
+        job = self._archive_job([int(record_id) for record_id in batch], cutoff)
+        job['batch'] = batch
+        job['pass_completed'] = 0 if self._cleanup_queue else 1
+        job['sizes_before'] = {(store, record_id): self._record_size(store, record_id)
+                               for store in STORES for record_id in batch}
+
+        history = {user_id: (old_days, old_sessions) for user_id, old_days, old_sessions in job['history']}
+        for record_id in batch:
+            user_data = self.data.get(int(record_id))
+            if user_data is None or user_data.status != 'inactive' or user_data.total_time >= 1:
+                continue
+            # El registro como quedará después de archivar su historial
+            record = UserRecord.from_dict(user_data.user_id, user_data.to_dict())
+            if int(record_id) in history:
+                self._strip_history(record, *history[int(record_id)])
+            if self._last_activity_date(record) >= cutoff:
+                continue
+            job['inactive'][record_id] = record.to_dict()
+        return job
+
+    def finish_cleanup(self, job: Dict[str, Any]) -> Dict[str, int]:
+        """Aplicar en memoria un lote de limpieza cuyo archivo ya se escribió (un solo commit)"""
+        batch, cutoff = job['batch'], job['cutoff']
+        stats = {'scanned': len(batch), 'evicted': 0, 'pruned_keys': 0, 'bytes_reclaimed': 0,
+                 'pass_completed': job['pass_completed']}
+
+        with self.transaction():
+            stats['evicted'] = self.finish_archive(job)['evicted']
+
+            for store, daily_key in (('attendance', 'daily_attendance'), ('credits', 'daily_credits_history')):
+                changed = []
+                for record_id in batch:
+                    daily = self._live_store(store).get(record_id, {}).get(daily_key)
+                    old_keys = [date for date in (daily or {}) if date < cutoff]
+                    for date in old_keys:
+                        del daily[date]
+                    if old_keys:
+                        stats['pruned_keys'] += len(old_keys)
+                        changed.append(record_id)
+                self._mark_records(store, changed)
+
+        for (store, record_id), size in job['sizes_before'].items():
+            stats['bytes_reclaimed'] += size - self._record_size(store, record_id)
+        return stats
+
+    def get_top_total_time(self, limit: int = 10) -> List[Tuple[int, float]]:
+        """Usuarios con más tiempo total (incluida la sesión en curso): lista de (id, segundos)"""
+        if self._data is None:
+            self._load_store('users')
+        # Solo los usuarios activos pueden superar a los del ranking guardado
+        candidates = {user_id for user_id, _ in self._time_ranking.top(limit)}
+        candidates.update(self._status_index['active'])
+        return heapq.nlargest(limit, ((user_id, self.get_total_time(user_id)) for user_id in candidates),
+                              key=lambda item: item[1])
+
+    def get_top_saved_credits(self, limit: int = 10) -> List[Tuple[int, int]]:
+        """Usuarios con más créditos guardados: lista de (id, créditos)"""
+        if self._credits_data is None:
+            self._load_store('credits')
+        return self._credits_ranking.top(limit)
+
     def get_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Obtener datos completos de un usuario"""
-        user_id_str = str(user_id)
-        return self.data.get(user_id_str)
+        """Obtener datos completos de un usuario (copia en formato dict)"""
+        user_data = self.data.get(user_id)
+        return user_data.to_dict() if user_data is not None else None
 
     def get_all_tracked_users(self) -> Dict[str, Any]:
         """Obtener todos los usuarios con seguimiento"""
-        return self.data.copy()
+        return {str(user_id): user_data.to_dict() for user_id, user_data in self.data.items()}
 
     def reset_user_time(self, user_id: int) -> bool:
         """Reiniciar tiempo de un usuario a cero"""
-        user_id_str = str(user_id)
-
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
-        user_data['total_time'] = 0
-        user_data['is_active'] = False
-        user_data['is_paused'] = False
-        user_data['pause_count'] = 0
-        user_data['sessions'] = []
-        user_data['notified_milestones'] = []
-        user_data['milestone_completed'] = False
-        user_data['is_pre_registered'] = False
+        user_data.total_time = 0
+        user_data.is_active = False
+        user_data.is_paused = False
+        user_data.pause_count = 0
+        user_data.sessions = []
+        user_data.notified_milestones = []
+        user_data.milestone_completed = False
+        user_data.is_pre_registered = False
 
         # Limpiar campos de seguimiento
-        if 'last_start' in user_data:
-            del user_data['last_start']
-        if 'pause_start' in user_data:
-            del user_data['pause_start']
-        if 'pre_register_time' in user_data:
-            del user_data['pre_register_time']
+        user_data.last_start = None
+        user_data.pause_start = None
+        user_data.pre_register_time = None
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def reset_all_user_times(self) -> int:
         """Reiniciar todos los tiempos de usuarios"""
         count = 0
-        for user_id_str in list(self.data.keys()):
-            user_id = int(user_id_str)
+        for user_id in list(self.data.keys()):
             if self.reset_user_time(user_id):
                 count += 1
         return count
 
     def cancel_user_tracking(self, user_id: int) -> bool:
         """Cancelar completamente el seguimiento de un usuario"""
-        user_id_str = str(user_id)
-
-        if user_id_str not in self.data:
+        if user_id not in self.data:
             return False
 
         # Eliminar completamente al usuario
-        del self.data[user_id_str]
-        self.save_data()
+        del self.data[user_id]
+        self.save_user_data(user_id)
         return True
 
     def clear_all_data(self) -> bool:
@@ -410,62 +1145,53 @@ class TimeTracker:
 
     def add_minutes(self, user_id: int, user_name: str, minutes: int) -> bool:
         """Añadir minutos al tiempo de un usuario (solo si ya existe)"""
-        user_id_str = str(user_id)
         today = datetime.now().strftime("%Y-%m-%d")
 
         # Solo permitir si el usuario ya existe
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
         seconds_to_add = minutes * 60
-        user_data['total_time'] = user_data.get('total_time', 0) + seconds_to_add
-        user_data['name'] = user_name  # Actualizar nombre
+        user_data.total_time += seconds_to_add
+        user_data.name = user_name  # Actualizar nombre
 
         # También agregar al tiempo diario para que se refleje en límites diarios
-        if 'daily_times' not in user_data:
-            user_data['daily_times'] = {}
-        user_data['daily_times'][today] = user_data['daily_times'].get(today, 0) + seconds_to_add
+        user_data.daily_times[today] = user_data.daily_times.get(today, 0) + seconds_to_add
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def subtract_minutes(self, user_id: int, minutes: int) -> bool:
         """Restar minutos del tiempo de un usuario"""
-        user_id_str = str(user_id)
-
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return False
 
-        user_data = self.data[user_id_str]
-        current_time = user_data.get('total_time', 0)
+        current_time = user_data.total_time
         new_time = max(0, current_time - (minutes * 60))
-        user_data['total_time'] = new_time
+        user_data.total_time = new_time
 
-        self.save_data()
+        self.save_user_data(user_id)
         return True
 
     def get_pause_count(self, user_id: int) -> int:
         """Obtener número de pausas de un usuario"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return 0
-        return self.data[user_id_str].get('pause_count', 0)
+        return user_data.pause_count
 
     def get_paused_duration(self, user_id: int) -> float:
         """Obtener duración pausada actual de un usuario"""
-        user_id_str = str(user_id)
-
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return 0.0
 
-        user_data = self.data[user_id_str]
-
-        if not user_data.get('is_paused', False) or not user_data.get('pause_start'):
+        if not user_data.is_paused or not user_data.pause_start:
             return 0.0
 
-        pause_start = datetime.fromisoformat(user_data['pause_start'])
-        return (datetime.now() - pause_start).total_seconds()
+        return time.time() - user_data.pause_start
 
     def format_time_human(self, seconds: float) -> str:
         """Formatear tiempo en formato humano legible"""
@@ -486,24 +1212,10 @@ class TimeTracker:
 
         return ", ".join(parts)
 
-    def load_attendance_data(self) -> Dict[str, Any]:
-        """Cargar datos de asistencias desde archivo JSON"""
-        try:
-            if os.path.exists(self.attendance_file):
-                with open(self.attendance_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return {}
-        except Exception as e:
-            print(f"Error cargando datos de asistencias: {e}")
-            return {}
-
     def save_attendance_data(self) -> None:
-        """Guardar datos de asistencias al archivo JSON"""
-        try:
-            with open(self.attendance_file, 'w', encoding='utf-8') as f:
-                json.dump(self.attendance_data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error guardando datos de asistencias: {e}")
+        """Guardar todos los datos de asistencias"""
+        self._rebuild_weekly_attendance()
+        self._mark_store('attendance')
 
     def add_manual_attendance(self, admin_id: int, admin_name: str, quantity: int) -> bool:
         """Agregar asistencias manualmente (para comando /sumar_asistencias) - hasta 15 asistencias sin límites"""
@@ -532,7 +1244,7 @@ class TimeTracker:
         # Solo agregar al total y al contador semanal manual (NO al diario)
         admin_data['manual_weekly_attendance'] += quantity
         admin_data['total_attendance'] = admin_data.get('total_attendance', 0) + quantity
-        self.save_attendance_data()
+        self.save_attendance_records([admin_id])
         return True
 
     def add_daily_manual_attendance(self, admin_id: int, admin_name: str, quantity: int) -> bool:
@@ -573,7 +1285,7 @@ class TimeTracker:
         if 'manual_weekly_attendance' not in admin_data:
             admin_data['manual_weekly_attendance'] = 0
         
-        self.save_attendance_data()
+        self.save_attendance_records([admin_id])
         return True
 
     def add_attendance(self, admin_id: int, admin_name: str, attendances_to_add: int = 1) -> bool:
@@ -620,7 +1332,7 @@ class TimeTracker:
         if attendances_to_add > 0:
             admin_data['daily_attendance'][today] += attendances_to_add
             admin_data['total_attendance'] = admin_data.get('total_attendance', 0) + attendances_to_add
-            self.save_attendance_data()
+            self.save_attendance_records([admin_id])
             return True
         
         return False
@@ -637,26 +1349,21 @@ class TimeTracker:
 
     def get_weekly_attendance(self, admin_id: int) -> int:
         """Obtener asistencias de la semana actual"""
-        admin_id_str = str(admin_id)
-        
-        if admin_id_str not in self.attendance_data:
-            return 0
-        
-        admin_data = self.attendance_data[admin_id_str]
-        
-        # Calcular fechas de la semana actual (lunes a viernes)
-        today = datetime.now()
-        start_of_week = today - timedelta(days=today.weekday())
-        
-        weekly_count = 0
-        for i in range(5):  # Solo 5 días: lunes a viernes
-            date = (start_of_week + timedelta(days=i)).strftime("%Y-%m-%d")
-            weekly_count += admin_data['daily_attendance'].get(date, 0)
-        
-        # Agregar asistencias manuales semanales
-        weekly_count += admin_data.get('manual_weekly_attendance', 0)
-        
-        return weekly_count
+        if self._attendance_data is None:
+            self._load_store('attendance')
+        if self._current_week(time.time()):
+            self._rebuild_weekly_attendance()
+        return self._weekly_attendance.get(str(admin_id), 0)
+
+    def get_top_weekly_attendance(self, limit: int = 10) -> List[Tuple[int, str, int]]:
+        """Admins con más asistencias esta semana: lista de (id, nombre, asistencias)"""
+        attendance_data = self.attendance_data
+        if self._current_week(time.time()):
+            self._rebuild_weekly_attendance()
+        top = heapq.nlargest(limit, ((count, admin_id_str) for admin_id_str, count in self._weekly_attendance.items()
+                                     if count > 0))
+        return [(int(admin_id_str), attendance_data[admin_id_str].get('name', ''), count)
+                for count, admin_id_str in top]
 
     def get_total_attendance(self, admin_id: int) -> int:
         """Obtener total de asistencias"""
@@ -677,28 +1384,28 @@ class TimeTracker:
 
     def set_time_initiator(self, user_id: int, admin_id: int, admin_name: str) -> None:
         """Registrar quién inició el tiempo para un usuario"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data:
-            self.data[user_id_str]['time_initiator'] = {
+        user_data = self.data.get(user_id)
+        if user_data is not None:
+            user_data.time_initiator = {
                 'admin_id': admin_id,
                 'admin_name': admin_name,
                 'timestamp': datetime.now().isoformat()
             }
-            self.save_data()
+            self.save_user_data(user_id)
 
     def get_time_initiator(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Obtener información de quién inició el tiempo para un usuario"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data:
-            return self.data[user_id_str].get('time_initiator')
+        user_data = self.data.get(user_id)
+        if user_data is not None:
+            return user_data.time_initiator
         return None
 
     def clear_time_initiator(self, user_id: int) -> None:
         """Limpiar información del iniciador del tiempo"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data and 'time_initiator' in self.data[user_id_str]:
-            del self.data[user_id_str]['time_initiator']
-            self.save_data()
+        user_data = self.data.get(user_id)
+        if user_data is not None and user_data.time_initiator is not None:
+            user_data.time_initiator = None
+            self.save_user_data(user_id)
 
     def reset_weekly_manual_attendances(self) -> None:
         """Resetear solo las asistencias manuales semanales (para nueva semana)"""
@@ -782,7 +1489,7 @@ class TimeTracker:
         from_user_data['transferred_today'] = True
         from_user_data['transfer_date'] = today
         
-        self.save_attendance_data()
+        self.save_attendance_records([from_user_id, to_user_id])
         return True
 
     def can_receive_daily_attendance(self, user_id: int) -> bool:
@@ -815,27 +1522,27 @@ class TimeTracker:
 
     def set_pre_register_initiator(self, user_id: int, admin_id: int, admin_name: str) -> None:
         """Registrar quién hizo el pre-registro para un usuario"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data:
-            self.data[user_id_str]['pre_register_initiator'] = {
+        user_data = self.data.get(user_id)
+        if user_data is not None:
+            user_data.pre_register_initiator = {
                 'admin_id': admin_id,
                 'admin_name': admin_name,
                 'timestamp': datetime.now().isoformat()
             }
-            self.save_data()
+            self.save_user_data(user_id)
 
     def get_pre_register_initiator(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Obtener información de quién hizo el pre-registro para un usuario"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data:
-            return self.data[user_id_str].get('pre_register_initiator')
+        user_data = self.data.get(user_id)
+        if user_data is not None:
+            return user_data.pre_register_initiator
         return None
 
     def clear_pre_register_initiator(self, user_id: int) -> None:
         """Limpiar información del admin que hizo el pre-registro"""
-        user_id_str = str(user_id)
-        if user_id_str in self.data and 'pre_register_initiator' in self.data[user_id_str]:
-            del self.data[user_id_str]['pre_register_initiator']
+        user_data = self.data.get(user_id)
+        if user_data is not None and user_data.pre_register_initiator is not None:
+            user_data.pre_register_initiator = None
             # No guardar inmediatamente para permitir operaciones en lote
 
     def batch_save_data(self) -> None:
@@ -845,41 +1552,36 @@ class TimeTracker:
     def start_tracking_from_pre_register_batch(self, user_ids: list) -> dict:
         """Iniciar seguimiento desde pre-registro para múltiples usuarios (optimizado)"""
         results = {'success': [], 'failed': []}
-        current_time = datetime.now().isoformat()
+        current_time = time.time()
 
         for user_id in user_ids:
             try:
-                user_id_str = str(user_id)
-                
-                if user_id_str not in self.data:
+                user_data = self.data.get(user_id)
+                if user_data is None:
                     results['failed'].append(user_id)
                     continue
 
-                user_data = self.data[user_id_str]
-
                 # Solo funciona si está pre-registrado
-                if not user_data.get('is_pre_registered', False):
+                if not user_data.is_pre_registered:
                     results['failed'].append(user_id)
                     continue
 
                 # Si ya está activo, no hacer nada
-                if user_data.get('is_active', False):
+                if user_data.is_active:
                     results['failed'].append(user_id)
                     continue
 
                 # Iniciar desde pre-registro
-                user_data['is_active'] = True
-                user_data['is_paused'] = False
-                user_data['is_pre_registered'] = False
-                user_data['last_start'] = current_time
+                user_data.is_active = True
+                user_data.is_paused = False
+                user_data.is_pre_registered = False
+                user_data.last_start = current_time
 
                 # Limpiar pre-registro
-                if 'pre_register_time' in user_data:
-                    del user_data['pre_register_time']
+                user_data.pre_register_time = None
                 
                 # Limpiar información del admin pre-registrador
-                if 'pre_register_initiator' in user_data:
-                    del user_data['pre_register_initiator']
+                user_data.pre_register_initiator = None
 
                 results['success'].append(user_id)
 
@@ -887,28 +1589,24 @@ class TimeTracker:
                 print(f"Error procesando usuario {user_id}: {e}")
                 results['failed'].append(user_id)
 
-        # Guardar una sola vez al final
-        self.save_data()
+        # Registrar solo los usuarios iniciados, con una sola escritura
+        self.save_users_data(results['success'])
         return results
 
     def is_user_active(self, user_id: int) -> bool:
         """Verificar si un usuario tiene tiempo activo"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.data:
-            return False
-        return self.data[user_id_str].get('is_active', False)
+        user_data = self.data.get(user_id)
+        return user_data is not None and user_data.is_active
 
     def is_user_paused(self, user_id: int) -> bool:
         """Verificar si un usuario tiene tiempo pausado"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.data:
-            return False
-        return self.data[user_id_str].get('is_paused', False)
+        user_data = self.data.get(user_id)
+        return user_data is not None and user_data.is_paused
 
     def start_time(self, user_id: int) -> bool:
         """Iniciar tiempo para un usuario (alias de start_tracking)"""
-        user = self.data.get(str(user_id), {})
-        user_name = user.get('name', f'Usuario_{user_id}')
+        user = self.data.get(user_id)
+        user_name = user.name if user is not None and user.name else f'Usuario_{user_id}'
         return self.start_tracking(user_id, user_name)
 
     def pause_time(self, user_id: int) -> bool:
@@ -925,47 +1623,40 @@ class TimeTracker:
 
     def get_user_time(self, user_id: int) -> dict:
         """Obtener información de tiempo de un usuario"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.data:
+        user_data = self.data.get(user_id)
+        if user_data is None:
             return {}
         
-        user_data = self.data[user_id_str].copy()
         total_seconds = self.get_total_time(user_id)
         
         return {
             'total_seconds': total_seconds,
-            'is_active': user_data.get('is_active', False),
-            'is_paused': user_data.get('is_paused', False),
-            'start_time': user_data.get('last_start'),
-            'pause_count': user_data.get('pause_count', 0)
+            'is_active': user_data.is_active,
+            'is_paused': user_data.is_paused,
+            'start_time': to_iso(user_data.last_start),
+            'pause_count': user_data.pause_count
         }
 
+    def get_user_times(self, user_ids: Iterable[int]) -> dict:
+        """Obtener tiempos de los usuarios indicados (mismo formato que get_all_user_times)"""
+        result = {}
+        for user_id in user_ids:
+            time_data = self.get_user_time(user_id)
+            if time_data:
+                result[str(user_id)] = time_data
+        return result
+
     def get_all_user_times(self) -> dict:
         """Obtener tiempos de todos los usuarios"""
         result = {}
-        for user_id_str in self.data:
-            user_id = int(user_id_str)
-            result[user_id_str] = self.get_user_time(user_id)
+        for user_id in self.data:
+            result[str(user_id)] = self.get_user_time(user_id)
         return result
 
-    def load_credits_data(self) -> Dict[str, Any]:
-        """Cargar datos de créditos guardados desde archivo JSON"""
-        try:
-            if os.path.exists(self.credits_file):
-                with open(self.credits_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return {}
-        except Exception as e:
-            print(f"Error cargando datos de créditos: {e}")
-            return {}
-
     def save_credits_data(self) -> None:
-        """Guardar datos de créditos al archivo JSON"""
-        try:
-            with open(self.credits_file, 'w', encoding='utf-8') as f:
-                json.dump(self.credits_data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error guardando datos de créditos: {e}")
+        """Guardar todos los datos de créditos"""
+        self._rebuild_credits_ranking()
+        self._mark_store('credits')
 
     def get_saved_credits(self, user_id: int) -> int:
         """Obtener créditos guardados de un usuario"""
@@ -992,7 +1683,7 @@ class TimeTracker:
             daily_history = self.credits_data[user_id_str]['daily_credits_history']
             daily_history[today] = daily_history.get(today, 0) + credits
             
-            self.save_credits_data()
+            self.save_credits_records([user_id])
             return True
         except Exception as e:
             print(f"Error agregando créditos: {e}")
@@ -1004,7 +1695,7 @@ class TimeTracker:
             user_id_str = str(user_id)
             if user_id_str in self.credits_data:
                 del self.credits_data[user_id_str]
-                self.save_credits_data()
+                self.save_credits_records([user_id])
             return True
         except Exception as e:
             print(f"Error limpiando créditos del usuario {user_id}: {e}")
@@ -1020,39 +1711,37 @@ class TimeTracker:
             print(f"Error limpiando créditos guardados: {e}")
             return False
 
-    def reset_daily_times(self) -> None:
-        """Resetear tiempos diarios de todos los usuarios para permitir trabajar nuevamente"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        for user_id_str in self.data:
-            user_data = self.data[user_id_str]
-            
-            # Inicializar daily_times si no existe
-            if 'daily_times' not in user_data:
-                user_data['daily_times'] = {}
-            
+    @staticmethod
+    def _apply_user_update(user_data: UserRecord, update: Dict[str, Any]) -> None:
+        """Aplicar a un usuario una operación por conjunto (ver storage.Journal.apply)"""
+        if update['op'] == 'reset_daily':
             # RESETEAR el tiempo diario de hoy a 0 para permitir trabajar nuevamente
-            user_data['daily_times'][today] = 0
-            
+            user_data.daily_times[update['date']] = 0
+
             # Resetear flags de milestones completados para permitir ganar créditos nuevamente
-            if 'milestone_1h_completed' in user_data:
-                del user_data['milestone_1h_completed']
-            if 'milestone_2h_completed' in user_data:
-                del user_data['milestone_2h_completed']
-                
-        self.save_data()
+            user_data.milestone_1h_completed = False
+            user_data.milestone_2h_completed = False
+
+    def reset_daily_times(self) -> None:
+        """Resetear tiempos diarios de todos los usuarios para permitir trabajar nuevamente"""
+        update = {'op': 'reset_daily', 'store': 'users', 'date': datetime.now().strftime("%Y-%m-%d")}
+        for user_data in self.data.values():
+            self._apply_user_update(user_data, update)
+
+        # Reprogramar los milestones y escribir el reset con una sola operación por conjunto
+        self._rebuild_status_index()
+        self._mark_update(update)
 
     def reset_all_total_times(self) -> None:
         """Resetear tiempos totales de todos los usuarios a 0"""
-        for user_id_str in self.data:
-            user_data = self.data[user_id_str]
-            
+        for user_data in self.data.values():
             # Resetear tiempo total a 0
-            user_data['total_time'] = 0
+            user_data.total_time = 0
             
             # Limpiar historial de sesiones
-            user_data['sessions'] = []
+            user_data.sessions = []
             
             # Limpiar historial de tiempos diarios
-            user_data['daily_times'] = {}
+            user_data.daily_times = {}
             
         self.save_data()
@@ -0,0 +1,90 @@
+import asyncio
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class TrackerActor:
+    """Único punto de entrada de las mutaciones del tracker, con group commit.
+
+    Los comandos y las tareas en segundo plano no modifican el tracker
+    directamente: envían una función con `submit` y esperan su resultado. Una
+    sola tarea consumidora aplica las funciones en orden de llegada; todo lo
+    que llega dentro de la ventana `window` (segundos) se aplica en la misma
+    transacción del tracker y se escribe con un solo commit del hilo escritor.
+    Cada llamador recibe su resultado cuando el commit de su grupo terminó.
+
+    En modo write-behind no se espera al disco: el grupo solo se aplica en
+    memoria y el guardado periódico lo escribe.
+    """
+
+    def __init__(self, tracker, writer, window: float = 0.005, max_batch: int = 500):
+        self.tracker = tracker
+        self.writer = writer
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Estadísticas: grupos escritos y mutaciones aplicadas
+        self.commits = 0
+        self.mutations = 0
+
+    def _ensure_started(self) -> None:
+        """Crear la cola y la tarea consumidora en el event loop actual"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="tracker-actor")
+
+    async def submit(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Aplicar `function(*args)` en el actor y devolver su resultado tras el commit"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((function, args, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Callable[..., Any], tuple, asyncio.Future]]:
+        """Esperar la primera mutación y reunir las que lleguen dentro de la ventana"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        """Tarea consumidora: aplicar cada grupo en una transacción y escribirlo una vez"""
+        while True:
+            batch = await self._collect()
+            outcomes = []
+            with self.tracker.transaction():
+                for function, args, future in batch:
+                    try:
+                        outcomes.append((future, function(*args), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+
+            if not self.tracker.write_behind:
+                try:
+                    await self.writer.durable()
+                except Exception as e:
+                    # Los cambios siguen pendientes en memoria y se reintentan en el próximo guardado
+                    print(f"Error en el commit de grupo ({len(batch)} mutaciones): {e}")
+            self.commits += 1
+            self.mutations += len(batch)
+
+            for future, result, error in outcomes:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,106 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class TrackerWriter:
+    """Hilo escritor único para la persistencia de un TimeTracker.
+
+    Las mutaciones siguen aplicándose en memoria desde el event loop; lo que
+    sale del loop es la escritura. `request_flush` extrae los cambios
+    pendientes (una copia independiente, ver TimeTracker.take_pending) y los
+    encola para el hilo escritor, que los escribe en orden de llegada. Los
+    comandos que necesitan saber que sus cambios ya están en disco esperan
+    `durable()`; los demás responden sin esperar a la escritura.
+    """
+
+    def __init__(self, tracker, name: str = "tracker-writer"):
+        self.tracker = tracker
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._last: Optional[Future] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Bucle del hilo escritor: ejecutar los trabajos encolados en orden"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            function, args, future, on_error = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args)
+            except BaseException as e:
+                if on_error is not None:
+                    on_error(e)
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, function: Callable[..., Any], *args: Any,
+               on_error: Optional[Callable[[BaseException], None]] = None) -> Future:
+        """Encolar una operación de E/S para el hilo escritor (después de las ya encoladas)"""
+        future = Future()
+        if self._closed:
+            # Tras cerrar (apagado del bot) se escribe en el hilo del llamador
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                if on_error is not None:
+                    on_error(e)
+                future.set_exception(e)
+            return future
+        self._queue.put((function, args, future, on_error))
+        self._last = future
+        return future
+
+    def request_flush(self) -> Future:
+        """Encolar los cambios pendientes del tracker.
+
+        Debe llamarse desde el hilo que modifica los datos (el event loop);
+        se usa como `tracker.flush_requested`. Si la escritura falla, el lote
+        vuelve a quedar pendiente para el próximo guardado.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        batch = self.tracker.take_pending()
+        if batch is None:
+            # Nada nuevo: esperar a que termine lo ya encolado
+            return self.submit(lambda: None)
+
+        def restore(error):
+            print(f"Error guardando datos en segundo plano: {error}")
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(self.tracker.restore_pending, batch)
+            else:
+                self.tracker.restore_pending(batch)
+
+        return self.submit(self.tracker.commit_batch, batch, on_error=restore)
+
+    async def durable(self) -> None:
+        """Esperar a que todos los cambios hechos hasta ahora estén escritos"""
+        await asyncio.wrap_future(self.request_flush())
+
+    async def backup(self) -> None:
+        """Escribir los cambios pendientes y crear una generación de backup desde el hilo escritor"""
+        self.request_flush()
+        documents = self.tracker.backup_documents()
+        await asyncio.wrap_future(self.submit(self.tracker.storage.backup, documents))
+
+    def close(self) -> None:
+        """Terminar lo encolado, detener el hilo y escribir lo que quede pendiente"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self.tracker.flush()
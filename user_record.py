@@ -0,0 +1,139 @@
+import copy
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Union
+
+
+def to_epoch(value: Union[str, float, int, None]) -> Optional[float]:
+    """Convertir una marca de tiempo ISO (o numérica) a segundos epoch"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def to_iso(value: Optional[float]) -> Optional[str]:
+    """Convertir segundos epoch a una marca de tiempo ISO local"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value).isoformat()
+
+
+class UserRecord:
+    """Registro de tiempo de un usuario con atributos fijos (__slots__).
+
+    Reemplaza al dict por usuario en memoria: los campos conocidos son
+    atributos y las claves desconocidas de archivos antiguos se conservan en
+    `extra`. La conversión a/desde dict solo ocurre en el límite con el
+    almacenamiento (from_dict al cargar, to_dict al guardar o exportar).
+    Las marcas de tiempo se guardan en memoria como segundos epoch para que
+    los cálculos periódicos no tengan que interpretar cadenas ISO.
+    """
+
+    __slots__ = (
+        'user_id', 'name', 'total_time', 'sessions', 'daily_times', 'monthly_times',
+        'is_active', 'is_paused', 'is_pre_registered', 'pause_count',
+        'notified_milestones', 'milestone_completed',
+        'milestone_1h_completed', 'milestone_2h_completed',
+        'last_start', 'pause_start', 'pre_register_time',
+        'pre_register_initiator', 'time_initiator', 'extra'
+    )
+
+    # Campos que solo se escriben si tienen valor (antes se borraban del dict)
+    OPTIONAL_FIELDS = ('last_start', 'pause_start', 'pre_register_time',
+                       'pre_register_initiator', 'time_initiator')
+    # Marcas de tiempo: epoch (float) en memoria, ISO en los archivos y exportaciones
+    TIMESTAMP_FIELDS = ('last_start', 'pause_start', 'pre_register_time')
+
+    def __init__(self, user_id: int, name: Optional[str] = None):
+        self.user_id = user_id
+        self.name = name
+        self.total_time = 0
+        self.sessions: List[Dict[str, Any]] = []
+        self.daily_times: Dict[str, float] = {}
+        self.monthly_times: Dict[str, float] = {}
+        self.is_active = False
+        self.is_paused = False
+        self.is_pre_registered = False
+        self.pause_count = 0
+        self.notified_milestones: List[Any] = []
+        self.milestone_completed = False
+        self.milestone_1h_completed = False
+        self.milestone_2h_completed = False
+        self.last_start: Optional[float] = None
+        self.pause_start: Optional[float] = None
+        self.pre_register_time: Optional[float] = None
+        self.pre_register_initiator: Optional[Dict[str, Any]] = None
+        self.time_initiator: Optional[Dict[str, Any]] = None
+        self.extra: Dict[str, Any] = {}
+
+    @property
+    def status(self) -> str:
+        """Estado del usuario (active, paused, pre_registered o inactive)"""
+        if self.is_active:
+            return 'active'
+        if self.is_paused:
+            return 'paused'
+        if self.is_pre_registered:
+            return 'pre_registered'
+        return 'inactive'
+
+    @classmethod
+    def from_dict(cls, user_id: int, data: Dict[str, Any]) -> 'UserRecord':
+        """Crear un registro desde el formato dict de los archivos (también los antiguos)"""
+        record = cls(user_id, data.get('name'))
+        for key, value in data.items():
+            if key in ('user_id', 'extra'):
+                record.extra[key] = value
+            elif key in cls.__slots__:
+                setattr(record, key, value)
+            else:
+                record.extra[key] = value
+
+        for key in cls.TIMESTAMP_FIELDS:
+            try:
+                setattr(record, key, to_epoch(getattr(record, key)))
+            except (TypeError, ValueError):
+                print(f"Marca de tiempo inválida en {key} del usuario {user_id}: {getattr(record, key)!r}")
+                setattr(record, key, None)
+
+        # Normalizar valores nulos de archivos antiguos
+        if record.total_time is None:
+            record.total_time = 0
+        if record.pause_count is None:
+            record.pause_count = 0
+        for key in ('sessions', 'notified_milestones'):
+            if getattr(record, key) is None:
+                setattr(record, key, [])
+        for key in ('daily_times', 'monthly_times'):
+            if getattr(record, key) is None:
+                setattr(record, key, {})
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convertir a dict para guardar o exportar (copia independiente del registro)"""
+        data = {
+            'name': self.name,
+            'total_time': self.total_time,
+            'sessions': list(self.sessions),
+            'is_active': self.is_active,
+            'is_paused': self.is_paused,
+            'pause_count': self.pause_count,
+            'notified_milestones': list(self.notified_milestones),
+            'milestone_completed': self.milestone_completed,
+            'is_pre_registered': self.is_pre_registered,
+            'daily_times': dict(self.daily_times)
+        }
+        if self.monthly_times:
+            data['monthly_times'] = dict(self.monthly_times)
+        if self.milestone_1h_completed:
+            data['milestone_1h_completed'] = True
+        if self.milestone_2h_completed:
+            data['milestone_2h_completed'] = True
+        for key in self.OPTIONAL_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = to_iso(value) if key in self.TIMESTAMP_FIELDS else value
+        for key, value in self.extra.items():
+            data.setdefault(key, copy.deepcopy(value))
+        return data
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Script para verificar el modo sharded con varios procesos en una sola máquina
+Uso: python verify_cluster.py [sqlite|postgres] [procesos]   (por defecto sqlite 3)
+
+Cada proceso es un nodo con su propio TimeTracker sobre el mismo
+almacenamiento. Se comprueba que:
+1. Lo que escribe un nodo aparece en la memoria de los demás (StoreSync).
+2. Un lease lo tiene un solo nodo a la vez y, si su nodo cae, otro lo toma.
+"""
+
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import time
+
+import cluster
+import storage
+import time_tracker
+
+# IDs de prueba que no deberían existir en datos reales
+TEST_USER_BASE = 900000000000000100
+LEASE_SECONDS = 1.0
+# Tiempo que el nodo con el lease lo conserva antes de "caerse" sin liberarlo
+HOLD_BEFORE_CRASH = 1.5
+LEASE_ROUND_SECONDS = 6.0
+
+def create_backend(backend, directory, origin):
+    if backend == 'sqlite':
+        return storage.SqliteStorage(os.path.join(directory, 'tracker.db'), origin=origin)
+    if backend == 'postgres':
+        dsn = os.getenv('DATABASE_URL')
+        if not dsn:
+            raise RuntimeError("Define DATABASE_URL con la conexión a PostgreSQL")
+        return storage.PostgresStorage(dsn, origin=origin)
+    raise RuntimeError(f"Backend desconocido: {backend}")
+
+def run_node(index, nodes, backend, directory, start_barrier, results):
+    """Un nodo: escribir su usuario, esperar a ver los de los demás y competir por un lease"""
+    node = cluster.ClusterNode(f"nodo-{index}", LEASE_SECONDS)
+    tracker = time_tracker.TimeTracker(storage=create_backend(backend, directory, node.node_id))
+    sync = cluster.StoreSync(tracker)
+    tracker.warm_up()
+    start_barrier.wait()
+
+    # 1. Coherencia: cada nodo inicia a su usuario y espera ver activos a todos
+    tracker.start_tracking(TEST_USER_BASE + index, f"Prueba {index}")
+    tracker.flush()
+    expected = [TEST_USER_BASE + i for i in range(nodes)]
+    deadline = time.time() + 10
+    seen = False
+    while time.time() < deadline and not seen:
+        batch = sync.fetch()
+        if batch is not None:
+            tracker.apply_remote_changes(*batch)
+        seen = all(tracker.is_user_active(user_id) for user_id in expected)
+        time.sleep(0.05)
+    results.put(('sync', index, seen))
+    start_barrier.wait()
+
+    # 2. Leases: anotar cada momento en que este nodo cree tenerlo
+    holding_since = None
+    deadline = time.time() + LEASE_ROUND_SECONDS
+    while time.time() < deadline:
+        if node.holds(tracker.storage, 'verificacion'):
+            now = time.time()
+            holding_since = holding_since or now
+            results.put(('lease', index, now))
+            if now - holding_since > HOLD_BEFORE_CRASH:
+                break  # "caída": deja de renovar sin liberar
+        time.sleep(0.02)
+
+    start_barrier.wait()
+    if index == 0:
+        for user_id in expected:
+            tracker.cancel_user_tracking(user_id)
+        tracker.flush()
+        tracker.storage.release_lease('verificacion', node.node_id)
+    tracker.storage.close()
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'sqlite'
+    nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print(f"🔍 Verificando modo sharded con {nodes} procesos sobre '{backend}'")
+    print("-" * 40)
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            # Crear las tablas antes de arrancar los nodos
+            create_backend(backend, directory, None).close()
+        except Exception as e:
+            print(f"❌ No se pudo abrir el almacenamiento: {e}")
+            return 1
+
+        start_barrier = context.Barrier(nodes)
+        results = context.Queue()
+        processes = [
+            context.Process(target=run_node, args=(index, nodes, backend, directory, start_barrier, results))
+            for index in range(nodes)
+        ]
+        for process in processes:
+            process.start()
+
+        # Vaciar la cola mientras los nodos corren (un proceso no termina con datos sin leer)
+        events = []
+        while any(process.is_alive() for process in processes) or not results.empty():
+            try:
+                events.append(results.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        for process in processes:
+            process.join()
+
+    synced = [event for event in events if event[0] == 'sync']
+    ok_sync = len(synced) == nodes and all(event[2] for event in synced)
+    print("✅ Todos los nodos ven los cambios de los demás" if ok_sync
+          else f"❌ Nodos sin los cambios de los demás: {[event[1] for event in synced if not event[2]]}")
+
+    # Los titulares del lease en orden de tiempo no pueden alternarse (A, B, A)
+    holders = []
+    for _, index, _ in sorted((event for event in events if event[0] == 'lease'), key=lambda event: event[2]):
+        if not holders or holders[-1] != index:
+            holders.append(index)
+    ok_lease = len(holders) >= 2 and len(holders) == len(set(holders))
+    print(f"✅ Lease exclusivo con relevo tras caídas: nodos {holders}" if ok_lease
+          else f"❌ Titulares del lease inesperados: {holders}")
+
+    return 0 if ok_sync and ok_lease and all(process.exitcode == 0 for process in processes) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
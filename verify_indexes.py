@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Script para verificar los índices en memoria del tracker
+Uso: python verify_indexes.py
+
+Comprueba que los índices incrementales (rankings) den lo mismo que recorrer
+todos los datos, incluso cuando un valor desaparece y vuelve.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import time_tracker
+from guild_state import GuildState
+from ranking import RankingIndex
+
+# IDs de prueba que no deberían existir en datos reales
+TEST_USER_IDS = [900000000000000201, 900000000000000202, 900000000000000203, 900000000000000204]
+GOLD_ROLE_ID = 900000000000000299
+
+class FakeGuild:
+    """Caché de miembros de un servidor que cuenta las consultas"""
+
+    def __init__(self, members):
+        self.members = {member.id: member for member in members}
+        self.lookups = 0
+
+    def get_member(self, user_id):
+        self.lookups += 1
+        return self.members.get(user_id)
+
+def fake_member(user_id, *role_ids):
+    return SimpleNamespace(id=user_id, roles=[SimpleNamespace(id=role_id, position=1) for role_id in role_ids])
+
+class SlowIndexTracker(time_tracker.TimeTracker):
+    """Tracker que tarda en indexar los milestones fuera del hilo principal (como el warm_up)"""
+
+    def _milestone_deadline(self, user_data):
+        if threading.current_thread() is not threading.main_thread():
+            time.sleep(0.2)
+        return super()._milestone_deadline(user_data)
+
+def check(ok, success, failure):
+    print(f"✅ {success}" if ok else f"❌ {failure}")
+    return ok
+
+def verify_ranking_index():
+    """Un valor que vuelve a uno anterior no debe duplicar la clave en el top"""
+    ranking = RankingIndex()
+    ranking.update(1, 10)
+    ranking.update(1, 5)
+    ranking.update(1, 10)
+    ranking.update(2, 7)
+    first = ranking.top(3)
+
+    # Desaparece (valor 0) y vuelve con el mismo valor
+    ranking.update(2, 0)
+    ranking.update(2, 7)
+    second = ranking.top(3)
+    return check(first == [(1, 10), (2, 7)] and second == first and ranking.top(3) == first,
+                 "El ranking no repite claves que vuelven a un valor anterior",
+                 f"Ranking con claves repetidas: {first} / {second}")
+
+def verify_credits_ranking(directory):
+    """Créditos limpiados y ganados de nuevo por el mismo importe aparecen una sola vez"""
+    first, second, third = TEST_USER_IDS[:3]
+    tracker = time_tracker.TimeTracker(os.path.join(directory, 'user_times.json'))
+    tracker.add_saved_credits(first, 5)
+    tracker.clear_user_saved_credits(first)
+    tracker.add_saved_credits(first, 5)
+    tracker.add_saved_credits(second, 3)
+    tracker.add_saved_credits(third, 5)
+    tracker.clear_user_saved_credits(third)
+
+    expected = sorted(((int(user_id), data['total_credits']) for user_id, data in tracker.credits_data.items()
+                       if data.get('total_credits', 0) > 0), key=lambda item: -item[1])
+    top = tracker.get_top_saved_credits(10)
+    return check(top == expected,
+                 "/ranking creditos coincide con recorrer todos los créditos",
+                 f"Ranking de créditos {top}, esperado {expected}")
+
+def verify_role_buckets(directory):
+    """Los /paga_* listan solo miembros del servidor sin recorrer todos los usuarios"""
+    gold, recluta, absent, late = TEST_USER_IDS
+    os.makedirs(os.path.join(directory, 'roles'))
+    tracker = time_tracker.TimeTracker(os.path.join(directory, 'roles', 'user_times.json'))
+    for user_id in (gold, recluta, absent):
+        tracker.start_tracking(user_id, f"Usuario {user_id}")
+    state = GuildState(1, {'gold_role_id': GOLD_ROLE_ID}, tracker, None, None)
+
+    # El miembro de `recluta` aún no está en la caché al reconstruir
+    guild = FakeGuild([fake_member(gold, GOLD_ROLE_ID)])
+    state.rebuild_role_buckets(guild)
+    guild.members[recluta] = fake_member(recluta)
+    ok = (list(state.iter_role_bucket('gold', guild=guild)) == [gold]
+          and list(state.iter_role_bucket('recluta', guild=guild)) == [recluta])
+
+    # Ya resueltos: listar otra vez no consulta la caché de miembros
+    guild.lookups = 0
+    ok = ok and list(state.iter_role_bucket('recluta', 'gold', guild=guild)) == [recluta, gold] and guild.lookups == 0
+
+    # Registro nuevo, salida y vuelta al servidor
+    guild.members[late] = fake_member(late)
+    tracker.start_tracking(late, "Tarde")
+    state.place_in_role_bucket(guild.members[late])
+    state.remove_from_role_bucket(recluta)
+    ok = ok and sorted(state.iter_role_bucket('recluta', guild=guild)) == [late]
+    state.place_in_role_bucket(guild.members[recluta])
+    ok = ok and sorted(state.iter_role_bucket('recluta', guild=guild)) == sorted([recluta, late])
+    return check(ok and absent not in state.unplaced,
+                 "Los buckets por rol listan solo miembros y no recorren todos los usuarios",
+                 f"Buckets por rol incorrectos: {state.role_buckets}, pendientes {state.unplaced}")
+
+def verify_milestones_after_warm_up(directory):
+    """Un usuario iniciado durante un warm_up en segundo plano conserva su milestone"""
+    existing, started = TEST_USER_IDS[:2]
+    os.makedirs(os.path.join(directory, 'warm_up'))
+    data_file = os.path.join(directory, 'warm_up', 'user_times.json')
+    tracker = time_tracker.TimeTracker(data_file)
+    tracker.start_tracking(existing, "Existente")
+    tracker.flush()
+
+    tracker = SlowIndexTracker(data_file)
+    thread = tracker.warm_up(background=True)
+    # Iniciar en cuanto el event loop vería los usuarios cargados
+    while not tracker.is_loaded('users'):
+        time.sleep(0.001)
+    tracker.start_tracking(started, "Iniciado durante la carga")
+    thread.join()
+
+    due = tracker.pop_due_milestones(time.time() + 3 * 3600)
+    return check(sorted(due) == sorted([existing, started]),
+                 "Los milestones de usuarios iniciados durante el warm_up se programan",
+                 f"Milestones vencidos {due}, esperados {[existing, started]}")
+
+def main():
+    print("🔍 Verificando índices en memoria")
+    print("-" * 40)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [
+            verify_ranking_index(),
+            verify_credits_ranking(directory),
+            verify_role_buckets(directory),
+            verify_milestones_after_warm_up(directory),
+        ]
+
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Script para verificar un backend de almacenamiento del tracker
+Uso: python verify_storage.py [json|sqlite|postgres]
+"""
+
+import os
+import sys
+import tempfile
+
+import storage
+import time_tracker
+
+# IDs de prueba que no deberían existir en datos reales
+TEST_USER_IDS = [900000000000000001, 900000000000000002, 900000000000000003]
+
+def create_backend(backend, directory):
+    if backend == 'json':
+        return storage.JsonStorage(
+            os.path.join(directory, 'user_times.json'),
+            os.path.join(directory, 'attendance_data.json'),
+            os.path.join(directory, 'saved_credits.json')
+        )
+    if backend == 'sqlite':
+        return storage.SqliteStorage(os.path.join(directory, 'tracker.db'))
+    if backend == 'postgres':
+        dsn = os.getenv('DATABASE_URL')
+        if not dsn:
+            raise RuntimeError("Define DATABASE_URL con la conexión a PostgreSQL")
+        return storage.PostgresStorage(dsn)
+    raise RuntimeError(f"Backend desconocido: {backend}")
+
+def records(tracker):
+    """Registros de prueba de los tres almacenes"""
+    ids = [str(user_id) for user_id in TEST_USER_IDS]
+    return (
+        {i: tracker.get_user_data(int(i)) for i in ids},
+        {i: tracker.attendance_data.get(i) for i in ids},
+        {i: tracker.credits_data.get(i) for i in ids}
+    )
+
+def verify_torn_journal(directory):
+    """Un registro con la última línea cortada no debe perder lo que se agregue después"""
+    directory = os.path.join(directory, 'registro')
+    os.makedirs(directory)
+    first, second, third = TEST_USER_IDS
+    tracker = time_tracker.TimeTracker(storage=create_backend('json', directory))
+    tracker.start_tracking(first, "Prueba 1")
+    tracker.start_tracking(second, "Prueba 2")
+    tracker.flush()
+    # Simular un corte a mitad de un append
+    with open(tracker.storage.journal.journal_file, 'ab') as f:
+        f.write(b'{"op": "set", "store": "users", "id": "9000')
+
+    restarted = time_tracker.TimeTracker(storage=create_backend('json', directory))
+    restarted.get_user_data(first)
+    restarted.start_tracking(third, "Prueba 3")
+    restarted.flush()
+
+    reloaded = time_tracker.TimeTracker(storage=create_backend('json', directory))
+    return all(reloaded.is_user_active(user_id) for user_id in TEST_USER_IDS)
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'sqlite'
+    print(f"🔍 Verificando almacenamiento '{backend}'")
+    print("-" * 40)
+
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            tracker = time_tracker.TimeTracker(storage=create_backend(backend, directory))
+        except Exception as e:
+            print(f"❌ No se pudo abrir el almacenamiento: {e}")
+            return 1
+
+        first, second, third = TEST_USER_IDS
+        tracker.start_tracking(first, "Prueba 1")
+        tracker.pause_tracking(first)
+        tracker.add_saved_credits(first, 3)
+        tracker.add_attendance(first, "Prueba 1")
+        tracker.pre_register_user(second, "Prueba 2")
+        tracker.pre_register_user(third, "Prueba 3")
+        results = tracker.start_tracking_from_pre_register_batch([second, third])
+        tracker.flush()
+        print(f"✅ Operaciones aplicadas (lote: {len(results['success'])} iniciados)")
+
+        reloaded = time_tracker.TimeTracker(storage=create_backend(backend, directory))
+        ok = records(reloaded) == records(tracker)
+        print("✅ Los datos recargados coinciden" if ok else "❌ Los datos recargados no coinciden")
+
+        if backend == 'json':
+            ok_journal = verify_torn_journal(directory)
+            print("✅ Un registro cortado conserva lo escrito después" if ok_journal
+                  else "❌ Se perdieron entradas escritas tras un registro cortado")
+            ok = ok and ok_journal
+
+        # Limpiar los registros de prueba
+        for user_id in TEST_USER_IDS:
+            tracker.cancel_user_tracking(user_id)
+            tracker.clear_user_saved_credits(user_id)
+            if tracker.attendance_data.pop(str(user_id), None) is not None:
+                tracker.save_attendance_records([user_id])
+        tracker.flush()
+        tracker.storage.close()
+        reloaded.storage.close()
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())